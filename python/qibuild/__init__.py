@@ -22,6 +22,7 @@ from qibuild import ctest
 from qibuild import envsetter
 from qibuild import interact
 from qibuild import log
+from qibuild import parallel
 from qibuild import parsers
 from qibuild import sh
 from qibuild import toc
@@ -6,7 +6,12 @@
 
 """
 
+import os
+import sys
+import threading
+
 import qibuild
+import qibuild.parallel
 from qibuild import ui
 
 def configure_parser(parser):
@@ -14,6 +19,7 @@ def configure_parser(parser):
     qibuild.parsers.toc_parser(parser)
     qibuild.parsers.build_parser(parser)
     qibuild.parsers.project_parser(parser)
+    qibuild.parsers.parallel_parser(parser)
     group = parser.add_argument_group("cmake arguments")
     group.add_argument("--build-directory", dest="build_directory",
         action="store",
@@ -24,6 +30,9 @@ def configure_parser(parser):
     group.add_argument("--no-clean-first", dest="clean_first",
         action="store_false",
         help="do not clean CMake cache")
+    group.add_argument("--force", dest="force_cmake",
+        action="store_true",
+        help="call cmake even if nothing changed since the last configure")
     group.add_argument("--debug-trycompile", dest="debug_trycompile",
         action="store_true",
         help="pass --debug-trycompile to CMake call")
@@ -36,6 +45,7 @@ def configure_parser(parser):
     parser.add_argument("--profile", dest="profile", action="store_true",
         help="profile cmake execution")
     parser.set_defaults(clean_first=True,
+        force_cmake=False,
         effective_cplusplus=False,
         werror=False)
 
@@ -67,15 +77,57 @@ def do(args):
         ui.info(ui.green, "Active configuration:", ui.blue, toc.active_config)
 
     project_count = len(projects)
-    i = 0
-    for project in projects:
-        i = i + 1
-        ui.info(ui.green, "*", ui.reset, "(%i/%i)" %  (i, project_count),
-                ui.green, "Configuring",
-                ui.blue, project.name)
-        toc.configure_project(project,
-            clean_first=args.clean_first,
-            debug_trycompile=args.debug_trycompile,
-            profile=args.profile)
+    if not args.parallel:
+        for (i, project) in enumerate(projects):
+            ui.info(ui.green, "*", ui.reset, "(%i/%i)" %  (i+1, project_count),
+                    ui.green, "Configuring",
+                    ui.blue, project.name)
+            configured = toc.configure_project(project,
+                clean_first=args.clean_first,
+                debug_trycompile=args.debug_trycompile,
+                profile=args.profile,
+                force=args.force_cmake)
+            if not configured:
+                ui.info("Nothing changed, not calling cmake")
+        return
 
+    # Configure every project as soon as its dependencies are
+    # configured. Each cmake output goes to a log file in the build
+    # directory, displayed in one block when cmake is done
+    lock = threading.Lock()
+    finished = list()
+    quiet = qibuild.command.CONFIG.get("quiet", False)
+    def configure(project_name):
+        project = toc.get_project(project_name)
+        log_file = os.path.join(project.build_directory, "configure.log")
+        ok = False
+        configured = True
+        try:
+            configured = toc.configure_project(project,
+                clean_first=args.clean_first,
+                debug_trycompile=args.debug_trycompile,
+                profile=args.profile,
+                log_file=log_file,
+                force=args.force_cmake)
+            ok = True
+        finally:
+            with lock:
+                finished.append(project_name)
+                if ok and not configured:
+                    mess = [ui.green, "Up to date:"]
+                elif ok:
+                    mess = [ui.green, "Configured"]
+                else:
+                    mess = [ui.red, "Failed to configure"]
+                mess = [ui.green, "*", ui.reset,
+                        "(%i/%i)" % (len(finished), project_count)] + mess
+                ui.info(*(mess + [ui.blue, project.name]))
+                if configured and os.path.exists(log_file) and \
+                        (not ok or not quiet):
+                    with open(log_file, "r") as fp:
+                        sys.stdout.write(fp.read())
+                    sys.stdout.flush()
 
+    deps = toc.get_deps_graph(project_names)
+    qibuild.parallel.run_dag(project_names, deps, configure,
+                             num_jobs=args.num_jobs)
@@ -8,7 +8,6 @@
 
 import qibuild
 import qibuild.ui
-from qibuild.dependencies_solver import DependenciesSolver
 
 def configure_parser(parser):
     """Configure parser for this action"""
@@ -20,22 +19,13 @@ def configure_parser(parser):
     parser.add_argument("--deep", action="store_true", help="display all dependencies using a depth traversal")
 
 def get_reverse_deps(toc, project_name):
-    bproject_names = []
-    rproject_names = []
-    for p in toc.projects:
-        dep_solver = DependenciesSolver(projects=toc.projects, packages=toc.packages, active_projects=toc.active_projects)
-        (bp, _, _) = dep_solver.solve([p.name], runtime=False)
-        (rp, _, _) = dep_solver.solve([p.name], runtime=True)
-        if project_name in bp:
-            bproject_names.append(p.name)
-        if project_name in rp:
-            rproject_names.append(p.name)
+    bproject_names = toc.get_reverse_deps(project_name, runtime=False)
+    rproject_names = toc.get_reverse_deps(project_name, runtime=True)
     return (bproject_names, rproject_names, set(), set())
 
 def get_deps(toc, project_name):
-    dep_solver = DependenciesSolver(projects=toc.projects, packages=toc.packages, active_projects=toc.active_projects)
-    (bproject_names, bpackage_names, _) = dep_solver.solve([project_name], runtime=False)
-    (rproject_names, rpackage_names, _) = dep_solver.solve([project_name], runtime=True)
+    (bproject_names, bpackage_names, _) = toc.get_project_deps(project_name, runtime=False)
+    (rproject_names, rpackage_names, _) = toc.get_project_deps(project_name, runtime=True)
     return (bproject_names, rproject_names, bpackage_names, rpackage_names)
 
 def do(args):
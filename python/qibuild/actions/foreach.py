@@ -12,12 +12,15 @@ For instance
 import qibuild.log
 
 import qisrc
+import qisrc.foreach
+import qisrc.parsers
 import qibuild
 
 
 def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
+    qisrc.parsers.jobs_parser(parser)
     parser.add_argument("command", metavar="COMMAND", nargs="+")
     parser.add_argument("--continue", "--ignore-errors", dest="ignore_errors",
                         action="store_true", help="continue on error")
@@ -26,6 +29,16 @@ def do(args):
     """Main entry point"""
     qiwt = qisrc.open_worktree(args.worktree)
     logger = qibuild.log.get_logger(__name__)
+    if args.num_jobs > 1:
+        # The output of each command goes to .qi/foreach/<project>.log
+        logger.info("Running `%s` for every project", " ".join(args.command))
+        errors = qisrc.foreach.foreach(qiwt, qiwt.buildable_projects,
+                                       args.command,
+                                       num_jobs=args.num_jobs,
+                                       ignore_errors=args.ignore_errors)
+        for project in errors:
+            logger.error("Command failed for %s", project.src)
+        return
     for project in qiwt.buildable_projects:
         logger.info("Running `%s` for %s", " ".join(args.command), project.src)
         try:
@@ -36,4 +49,3 @@ def do(args):
                 continue
             else:
                 raise
-
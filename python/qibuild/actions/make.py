@@ -6,15 +6,19 @@
 
 """
 
+import threading
+
 from qibuild import ui
 import qibuild
 import qibuild.cmdparse
+import qibuild.parallel
 
 def configure_parser(parser):
     """Configure parser for this action"""
     qibuild.parsers.toc_parser(parser)
     qibuild.parsers.build_parser(parser)
     qibuild.parsers.project_parser(parser)
+    qibuild.parsers.parallel_parser(parser)
     group = parser.add_argument_group("make options")
     group.add_argument("-t", "--target", help="Special target to build")
     group.add_argument("--rebuild", "-r", action="store_true", default=False)
@@ -37,15 +41,36 @@ def do(args):
     projects = [toc.get_project(name) for name in project_names]
 
     project_count = len(projects)
-    i = 0
-    for project in projects:
-        i += 1
-        if args.target:
-            mess = "Building target %s for" % args.target
-        else:
-            mess = "Building"
+    if args.target:
+        mess = "Building target %s for" % args.target
+    else:
+        mess = "Building"
+
+    if not args.parallel:
+        for (i, project) in enumerate(projects):
+            ui.info(ui.green, "*", ui.reset, "(%i/%i)" % (i+1, project_count),
+                    ui.green, mess, ui.blue, project.name)
+            toc.build_project(project, target=args.target, num_jobs=args.num_jobs,
+                              incredibuild=use_incredibuild, rebuild=args.rebuild,
+                              fix_shared_libs=args.fix_shared_libs)
+        return
+
+    # Build every project as soon as its dependencies are built,
+    # sharing the -j budget between the running builds
+    lock = threading.Lock()
+    started = list()
+    def build(project_name, num_jobs):
+        project = toc.get_project(project_name)
+        with lock:
+            started.append(project_name)
+            i = len(started)
         ui.info(ui.green, "*", ui.reset, "(%i/%i)" % (i, project_count),
-                ui.green, mess, ui.blue, project.name)
-        toc.build_project(project, target=args.target, num_jobs=args.num_jobs,
+                ui.green, mess, ui.blue, project.name,
+                ui.reset, "(-j %i)" % num_jobs)
+        toc.build_project(project, target=args.target, num_jobs=num_jobs,
                           incredibuild=use_incredibuild, rebuild=args.rebuild,
                           fix_shared_libs=args.fix_shared_libs)
+
+    deps = toc.get_deps_graph(project_names)
+    qibuild.parallel.run_dag(project_names, deps, build,
+                             num_jobs=args.num_jobs, split_jobs=True)
@@ -44,6 +44,7 @@ def do(args):
 
     res = qibuild.ctest.run_tests(project, toc.build_env,
             pattern=args.pattern, slow=args.slow,
-            dry_run=args.dry_run, valgrind=args.valgrind, verbose=args.verbose_tests)
+            dry_run=args.dry_run, valgrind=args.valgrind, verbose=args.verbose_tests,
+            num_jobs=args.num_jobs)
     if not res:
         sys.exit(1)
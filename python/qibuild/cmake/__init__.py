@@ -82,13 +82,16 @@ def get_cached_var(build_dir, var, default=None):
 
 
 def cmake(source_dir, build_dir, cmake_args, env=None,
-          clean_first=True, profile=False):
+          clean_first=True, profile=False, log_file=None):
     """Call cmake with from a build dir for a source dir.
     cmake_args are added on the command line.
 
     If clean_first is True, we will remove cmake-generated files.
     Useful when dependencies have changed.
 
+    If log_file is given, cmake output is written there
+    instead of the console.
+
     """
     if not os.path.exists(source_dir):
         raise Exception("source dir: %s does not exist, aborting")
@@ -119,7 +122,8 @@ def cmake(source_dir, build_dir, cmake_args, env=None,
     # the current working dir.
     cmake_args += [source_dir]
     if not profile:
-        qibuild.command.call(["cmake"] + cmake_args, cwd=build_dir, env=env)
+        qibuild.command.call(["cmake"] + cmake_args, cwd=build_dir, env=env,
+                             log_file=log_file)
         return
     # importing here in order to not create circular dependencies:
     cmake_log = os.path.join(build_dir, "cmake.log")
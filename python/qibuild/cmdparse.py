@@ -279,6 +279,21 @@ at the top of the file
 
 
 
+def _action_module_names(package_name):
+    """ Return the names of the modules of a package,
+    importing the package but none of its modules
+
+    """
+    splitted = package_name.split(".")[1:]
+    last_part = ".".join(splitted)
+    package = __import__(package_name, globals(), locals(), [last_part])
+    base_path = os.path.dirname(package.__file__)
+    module_paths = os.listdir(base_path)
+    module_paths = [x[:-3] for x in module_paths if x.endswith(".py")]
+    module_paths.remove("__init__")
+    return module_paths
+
+
 def action_modules_from_package(package_name):
     """Returns a suitable list of modules from
     a package.
@@ -295,13 +310,7 @@ def action_modules_from_package(package_name):
 
     """
     res = list()
-    splitted = package_name.split(".")[1:]
-    last_part = ".".join(splitted)
-    package = __import__(package_name, globals(), locals(), [last_part])
-    base_path = os.path.dirname(package.__file__)
-    module_paths = os.listdir(base_path)
-    module_paths = [x[:-3] for x in module_paths if x.endswith(".py")]
-    module_paths.remove("__init__")
+    module_paths = _action_module_names(package_name)
     for module_path in module_paths:
         try:
             _tmp = __import__(package_name, globals(), locals(), [module_path], -1)
@@ -315,6 +324,39 @@ def action_modules_from_package(package_name):
     return res
 
 
+def root_command_main_from_package(name, parser, package_name, args=None):
+    """ Same as :py:func:`root_command_main`, but only import
+    the module of the action the user asked for, and only
+    configure its parser.
+
+    Every action of the package is imported only when
+    the full list is needed, that is when general help
+    is requested or when the action is not known.
+
+    """
+    if not args:
+        args = sys.argv[1:]
+    (help_requested, action) = parse_args_for_help(args)
+    if not help_requested:
+        action = args[0]
+
+    modules = None
+    # we want to type `foo bar-baz', and not type `foo bar_baz',
+    # even if "bar-baz" is not a valid module name.
+    module_names = dict((x.replace("_", "-"), x)
+                        for x in _action_module_names(package_name))
+    if action in module_names:
+        module_name = module_names[action]
+        try:
+            _tmp = __import__(package_name, globals(), locals(), [module_name], -1)
+            modules = [getattr(_tmp, module_name)]
+        except ImportError:
+            pass
+    if modules is None:
+        modules = action_modules_from_package(package_name)
+    return root_command_main(name, parser, modules, args=args)
+
+
 
 if __name__ == "__main__":
     import doctest
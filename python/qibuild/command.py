@@ -8,7 +8,10 @@
 
 import os
 import sys
+import errno
+import select
 import contextlib
+import collections
 import subprocess
 import threading
 import Queue
@@ -25,16 +28,130 @@ CONFIG = dict()
 # Cache for find_program()
 _FIND_PROGRAM_CACHE = dict()
 
+# Size of the blocks read from the output of a child process
+_BLOCK_SIZE = 64 * 1024
+
+class OutputBuffer:
+    """ Store the output of a child process.
+
+    Data is kept as a list of chunks, so that appending to it
+    does not copy everything that was read before.
+
+    If max_size is given, at most max_size bytes are kept in memory:
+    the first and the last max_size / 2 bytes. The first time data
+    has to be dropped, everything read so far is written to spill_path
+    (if given), and from then on every new chunk is appended to it,
+    so that the full output is still available.
+
+    """
+    def __init__(self, max_size=None, spill_path=None):
+        self.max_size = max_size
+        self.spill_path = spill_path
+        self.spilled = False
+        self.skipped = 0
+        self._head = list()
+        self._head_size = 0
+        self._tail = collections.deque()
+        self._tail_size = 0
+        self._spill_fp = None
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        """ Add a chunk of data """
+        if not data:
+            return
+        with self._lock:
+            if self._spill_fp:
+                self._spill_fp.write(data)
+            if self.max_size is None:
+                self._head.append(data)
+                self._head_size += len(data)
+                return
+            head_max = self.max_size / 2
+            if self._head_size < head_max:
+                to_head = data[:head_max - self._head_size]
+                self._head.append(to_head)
+                self._head_size += len(to_head)
+                data = data[len(to_head):]
+                if not data:
+                    return
+            self._tail.append(data)
+            self._tail_size += len(data)
+            tail_max = self.max_size - head_max
+            if self._tail_size <= tail_max:
+                return
+            if not self.skipped and self.spill_path:
+                self._start_spill()
+            while self._tail_size > tail_max:
+                extra = self._tail_size - tail_max
+                first = self._tail[0]
+                if len(first) <= extra:
+                    self._tail.popleft()
+                    self._tail_size -= len(first)
+                    self.skipped += len(first)
+                else:
+                    self._tail[0] = first[extra:]
+                    self._tail_size -= extra
+                    self.skipped += extra
+
+    def _start_spill(self):
+        """ Write everything read so far to spill_path.
+        Called once, just before dropping data for the first time
+
+        """
+        try:
+            qibuild.sh.mkdir(os.path.dirname(self.spill_path), recursive=True)
+            self._spill_fp = open(self.spill_path, "wb")
+            for chunk in self._head:
+                self._spill_fp.write(chunk)
+            for chunk in self._tail:
+                self._spill_fp.write(chunk)
+        except (IOError, OSError), e:
+            ui.debug("Could not write", self.spill_path, ":", e)
+            self._spill_fp = None
+            return
+        self.spilled = True
+
+    def close(self):
+        """ Close the spill file, if any """
+        with self._lock:
+            if self._spill_fp:
+                self._spill_fp.close()
+                self._spill_fp = None
+
+    def getvalue(self):
+        """ Get the output kept in memory, with a marker in
+        place of the data that was dropped
+
+        """
+        with self._lock:
+            res = "".join(self._head)
+            if self.skipped:
+                res += "\n[... %i bytes skipped" % self.skipped
+                if self.spilled:
+                    res += ", full output in %s" % self.spill_path
+                res += " ...]\n"
+            res += "".join(self._tail)
+        return res
+
+
 class ProcessThread(threading.Thread):
     """ A simple way to run commands.
 
     The thread will terminate when the command terminates
 
-    The full log is available in self.out, and the subprocess.Popen
+    The log is available in self.out, and the subprocess.Popen
     object in self.process
 
+    :param max_out: if given, only keep the first and the last
+        max_out / 2 bytes of the output in self.out
+    :param out_file: if given, and if the output does not fit in
+        max_out bytes, write the full output to this file.
+        self.spilled tells whether the file was written.
+
     """
-    def __init__(self, cmd, name=None, verbose=False, cwd=None, env=None):
+    def __init__(self, cmd, name=None, verbose=False, cwd=None, env=None,
+                 max_out=None, out_file=None):
         if name is None:
             thread_name = "ProcessThread"
         else:
@@ -43,10 +160,20 @@ class ProcessThread(threading.Thread):
         self.cmd = cmd
         self.cwd = cwd
         self.env = env
-        self.out = ""
         self.process = None
         self.exception = ""
         self.verbose = verbose
+        self._buffer = OutputBuffer(max_size=max_out, spill_path=out_file)
+
+    @property
+    def out(self):
+        """ The output of the command read so far """
+        return self._buffer.getvalue()
+
+    @property
+    def spilled(self):
+        """ Whether the full output was written to out_file """
+        return self._buffer.spilled
 
     def run(self):
         ui.debug("Calling:", " ".join(self.cmd))
@@ -60,20 +187,22 @@ class ProcessThread(threading.Thread):
             self.exception = e
             return
 
-        while self.process.poll() is None:
-            line = self.process.stdout.readline()
-            self.out += line
-            if self.verbose:
-                sys.stdout.write(line)
-        #program is finished, does not mean we read all lines
-        #read them!
-        while True:
-            line = self.process.stdout.readline()
-            if line == "":
-                break
-            self.out += line
-            if self.verbose:
-                sys.stdout.write(line)
+        # os.read returns as soon as some data is available,
+        # and an empty string once the process closed its output
+        fd = self.process.stdout.fileno()
+        try:
+            while True:
+                data = os.read(fd, _BLOCK_SIZE)
+                if not data:
+                    break
+                self._buffer.write(data)
+                if self.verbose:
+                    sys.stdout.write(data)
+                    sys.stdout.flush()
+        finally:
+            self._buffer.close()
+            self.process.stdout.close()
+        self.process.wait()
 
 
 class CommandFailedException(Exception):
@@ -203,7 +332,8 @@ def check_is_in_path(executable, build_env=None):
         raise NotInPath(executable, env=build_env)
 
 
-def call(cmd, cwd=None, env=None, ignore_ret_code=False, quiet=None):
+def call(cmd, cwd=None, env=None, ignore_ret_code=False, quiet=None,
+         log_file=None):
     """ Execute a command line.
 
     If ignore_ret_code is False:
@@ -211,6 +341,10 @@ def call(cmd, cwd=None, env=None, ignore_ret_code=False, quiet=None):
     Else:
         simply returns the returncode of the process
 
+    If log_file is given, the output of the command is written
+    to this file instead of the console. This is useful when
+    several commands run at the same time.
+
     Note: first arg of the cmd is assumed to be something
     inside %PATH%. (or in env[PATH] if env is not None)
 
@@ -249,7 +383,12 @@ def call(cmd, cwd=None, env=None, ignore_ret_code=False, quiet=None):
     # so quiet will be ignored
     if sys.platform.startswith("win") and sys.version_info < (2, 7):
         quiet_command = False
-    if not quiet_command:
+    if log_file:
+        quiet_command = False
+        with open(log_file, "w") as fp:
+            returncode = subprocess.call(cmd, env=env, cwd=cwd,
+                stdout=fp, stderr=subprocess.STDOUT)
+    elif not quiet_command:
         returncode = subprocess.call(cmd, env=env, cwd=cwd)
     else:
         cmdline = CommandLine(cmd, cwd=cwd, env=env)
@@ -333,47 +472,204 @@ class CommandLine:
         """Execute the command, and return a generator for iterating over
         the output written to the standard output and error streams.
 
+        Yields (line, None) for each line written on stdout,
+        and (None, line) for each line written on stderr.
+
         """
-        def reader(pipe, pipe_name, queue):
-            "To be called in a thread"
-            while pipe and not pipe.closed:
-                line = pipe.readline()
-                if line == '':
-                    break
-                queue.put((pipe_name, line))
-            if not pipe.closed:
-                pipe.close()
         ui.debug("Calling:", " ".join(self.cmd))
         process =  subprocess.Popen(
             self.cmd,
             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
             cwd=self.cwd,
             env=self.env)
-        queue = Queue.Queue()
+        pipes = {
+            process.stdout.fileno() : "stdout",
+            process.stderr.fileno() : "stderr",
+        }
+        if hasattr(select, "poll"):
+            blocks = _poll_pipes(pipes)
+        elif os.name != "nt":
+            blocks = _select_pipes(pipes)
+        else:
+            # select() only works on sockets on Windows
+            blocks = _read_pipes_in_threads(pipes)
+        splitters = {
+            "stdout" : LineSplitter(),
+            "stderr" : LineSplitter(),
+        }
+        try:
+            for (pipe_name, block) in blocks:
+                for line in splitters[pipe_name].feed(block):
+                    if pipe_name == "stderr":
+                        yield(None, line)
+                    else:
+                        yield(line, None)
+            for line in splitters["stdout"].flush():
+                yield(line, None)
+            for line in splitters["stderr"].flush():
+                yield(None, line)
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+            self.returncode = process.wait()
+
+
+class LineSplitter:
+    """ Split blocks of data into lines.
+
+    Lines are returned with their trailing newline, as
+    file.readline() would do.
+
+    >>> splitter = LineSplitter()
+    >>> list(splitter.feed("foo\\nba"))
+    ['foo\\n']
+    >>> list(splitter.feed("r\\nbaz"))
+    ['bar\\n']
+    >>> list(splitter.flush())
+    ['baz']
 
-        pipe_out = threading.Thread(target=reader,
-            args=(process.stdout, 'stdout', queue))
-        pipe_err = threading.Thread(target=reader,
-            args=(process.stderr, 'stderr', queue))
+    """
+    def __init__(self):
+        # Chunks of the line being read, so that a very long line
+        # coming in several blocks is only joined once
+        self._partial = list()
 
-        pipe_out.start()
-        pipe_err.start()
+    def feed(self, block):
+        """ Add a block of data, and return a generator
+        over the lines it completes
 
+        """
+        end = block.rfind("\n")
+        if end == -1:
+            self._partial.append(block)
+            return iter(())
+        if self._partial:
+            self._partial.append(block[:end + 1])
+            data = "".join(self._partial)
+            self._partial = list()
+        else:
+            data = block[:end + 1]
+        if end + 1 < len(block):
+            self._partial.append(block[end + 1:])
+        return _iter_lines(data)
+
+    def flush(self):
+        """ Return the last line, if it has no trailing newline,
+        as a list of at most one element
+
+        """
+        if not self._partial:
+            return list()
+        data = "".join(self._partial)
+        self._partial = list()
+        return [data]
+
+
+def _iter_lines(data):
+    """ Iterate over the lines of data, which ends with a newline """
+    start = 0
+    while start < len(data):
+        stop = data.index("\n", start) + 1
+        yield data[start:stop]
+        start = stop
+
+
+def _read_block(fd):
+    """ Read at most _BLOCK_SIZE bytes. Return an empty
+    string when the pipe is closed
+
+    """
+    try:
+        return os.read(fd, _BLOCK_SIZE)
+    except OSError, e:
+        if e.errno == errno.EINTR:
+            return _read_block(fd)
+        # Treat errors as the end of the stream
+        return ""
+
+
+def _poll_pipes(pipes):
+    """ Yield (pipe_name, block) as soon as something can be read
+    from one of the pipes, until all of them are closed.
+
+    :param pipes: a dict file descriptor -> name
+
+    """
+    pipes = pipes.copy()
+    poller = select.poll()
+    for fd in pipes:
+        poller.register(fd, select.POLLIN | select.POLLPRI)
+    while pipes:
+        try:
+            events = poller.poll()
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for (fd, event_) in events:
+            block = _read_block(fd)
+            if block:
+                yield (pipes[fd], block)
+            else:
+                poller.unregister(fd)
+                del pipes[fd]
+
+
+def _select_pipes(pipes):
+    """ Same as :py:func:`_poll_pipes`, for platforms
+    that do not have select.poll()
+
+    """
+    pipes = pipes.copy()
+    while pipes:
+        try:
+            (readable, _, _) = select.select(pipes.keys(), list(), list())
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in readable:
+            block = _read_block(fd)
+            if block:
+                yield (pipes[fd], block)
+            else:
+                del pipes[fd]
+
+
+def _read_pipes_in_threads(pipes):
+    """ Same as :py:func:`_poll_pipes`, using one
+    thread per pipe. Used on Windows
+
+    """
+    queue = Queue.Queue()
+    def reader(fd, pipe_name):
+        "To be called in a thread"
         while True:
-            if process.poll() is not None and self.returncode is None:
-                self.returncode = process.returncode
-            try:
-                name, line = queue.get(block=True, timeout=.01)
-                if name == "stderr":
-                    yield(None, line)
-                else:
-                    yield(line, None)
-            except Queue.Empty:
-                if self.returncode is not None:
-                    break
+            block = _read_block(fd)
+            queue.put((pipe_name, block))
+            if not block:
+                break
+    threads = list()
+    for (fd, pipe_name) in pipes.iteritems():
+        thread = threading.Thread(target=reader, args=(fd, pipe_name))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    running = len(threads)
+    while running:
+        try:
+            # Queue.get() can not be interrupted by CTRL-C
+            # unless a timeout is given
+            (pipe_name, block) = queue.get(True, 3600)
+        except Queue.Empty:
+            continue
+        if block:
+            yield (pipe_name, block)
+        else:
+            running -= 1
+    for thread in threads:
+        thread.join()
 
-        pipe_out.join()
-        pipe_err.join()
 
 def configure_call(args):
     """ Configure qibuild.command.call behavoir
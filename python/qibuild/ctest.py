@@ -14,10 +14,17 @@ import datetime
 import errno
 import signal
 import shlex
+import xml.sax.saxutils
 
 import qibuild
+import qibuild.parallel
 from qibuild import ui
 
+# At most this number of bytes of the output of a test are kept in
+# memory (the beginning and the end of the output). When a test
+# writes more than that, the full output goes to
+# test-results/<test_name>.log
+MAX_OUTPUT_SIZE = 1024 * 1024
 
 def _str_from_signal(code):
     """ Returns a nice string describing the signal
@@ -41,6 +48,9 @@ class TestResult:
         self.ok   = False
         # Output of the executable of the test
         self.out = ""
+        # Path to the full output, if it was too big to be kept
+        # in self.out
+        self.out_file = None
         # Short description of what went wrong
         self.message = ""
 
@@ -100,11 +110,16 @@ def run_test(build_dir, test_name, cmd, properties, build_env, verbose=False, va
         valgrind_log = os.path.join(build_dir, test_name + "valgrind_output.log")
         ncmd = [ "valgrind", "--track-fds=yes", "--log-file=%s" % valgrind_log ]
         ncmd.extend(cmd)
+    out_file = os.path.join(build_dir, "test-results", test_name + ".log")
+    if os.path.exists(out_file):
+        os.remove(out_file)
     process_thread = qibuild.command.ProcessThread(ncmd,
         name=test_name,
         cwd=cwd,
         env=env,
-        verbose=verbose)
+        verbose=verbose,
+        max_out=MAX_OUTPUT_SIZE,
+        out_file=out_file)
 
     res = TestResult(test_name)
     start = datetime.datetime.now()
@@ -126,6 +141,8 @@ def run_test(build_dir, test_name, cmd, properties, build_env, verbose=False, va
                 mess += "Are you sure you have built the tests?"
         raise Exception(mess)
     res.out = process_thread.out
+    if process_thread.spilled:
+        res.out_file = out_file
     if process_thread.isAlive():
         process.terminate()
         res.ok = False
@@ -149,10 +166,88 @@ def run_test(build_dir, test_name, cmd, properties, build_env, verbose=False, va
     return res
 
 
-def run_tests(project, build_env, pattern=None, verbose=False, slow=False, dry_run=False, valgrind=False):
+def _is_true(value):
+    """ Parse a CMake boolean """
+    if value is None:
+        return False
+    return value.upper() in ("1", "ON", "YES", "TRUE", "Y")
+
+
+def _get_cost(properties):
+    """ Get the COST property of a test, 0 if it is not
+    set or not a number
+
+    """
+    try:
+        return float(properties.get("COST", 0))
+    except ValueError:
+        return 0
+
+
+def _schedule(tests):
+    """ Split the tests in two lists: the tests that can run
+    at the same time, sorted by decreasing COST so that the longest
+    tests start first, and the tests that have the RUN_SERIAL
+    property
+
+    """
+    concurrent = list()
+    serial = list()
+    for test in tests:
+        properties = test[2]
+        if _is_true(properties.get("RUN_SERIAL")):
+            serial.append(test)
+        else:
+            concurrent.append(test)
+    concurrent.sort(key=lambda x: _get_cost(x[2]), reverse=True)
+    return (concurrent, serial)
+
+
+def _run_tests_parallel(build_dir, tests, build_env, num_jobs,
+                        verbose=False, valgrind=False):
+    """ Run at most num_jobs tests at the same time, then the
+    RUN_SERIAL tests one after the other.
+
+    The output of each test is displayed when the test is over,
+    so that outputs do not interleave.
+
+    :return: a dict test name -> TestResult
+
+    """
+    results = dict()
+    def run(test):
+        (test_name, cmd, properties) = test
+        return run_test(build_dir, test_name, cmd, properties, build_env,
+                        valgrind=valgrind)
+
+    def on_done(test, test_res):
+        results[test_res.test_name] = test_res
+        if test_res.ok:
+            status = [ui.green, "[OK]"]
+        else:
+            status = [ui.red, "[FAIL]"]
+        ui.info(*([ui.green, " * ", ui.reset, ui.bold,
+                  "(%2i/%2i)" % (len(results), len(tests)),
+                  ui.blue, test_res.test_name.ljust(25)] + status))
+        if verbose or not test_res.ok:
+            print test_res.out
+
+    (concurrent, serial) = _schedule(tests)
+    qibuild.parallel.run_parallel(concurrent, run, num_jobs=num_jobs,
+                                  on_done=on_done)
+    for test in serial:
+        on_done(test, run(test))
+    return results
+
+
+def run_tests(project, build_env, pattern=None, verbose=False, slow=False,
+              dry_run=False, valgrind=False, num_jobs=1):
     """ Called by :py:meth:`qibuild.toc.Toc.test_project`
 
     :param test_name: If given, only run this test
+    :param num_jobs: If greater than one, run this number of tests
+        at the same time, the ones with the highest COST first.
+        Tests with the RUN_SERIAL property still run alone.
 
     Always write some XML files in build-<config>/test-results
     (even if they were no tests to run at all)
@@ -177,8 +272,8 @@ def run_tests(project, build_env, pattern=None, verbose=False, slow=False, dry_r
     else:
         for test in all_tests:
             (name, cmd_, properties) = test
-            cost = properties.get("COST")
-            if not slow and cost and float(cost) > 50:
+            cost = _get_cost(properties)
+            if not slow and cost > 50:
                 ui.debug("Skipping test", name, "because cost",
                          "(%s)"% cost, "is greater than 50")
                 slow_tests.append(name)
@@ -203,23 +298,33 @@ def run_tests(project, build_env, pattern=None, verbose=False, slow=False, dry_r
     ui.info(ui.green, "Testing", project.name, "...")
     ok = True
     fail_tests = list()
-    for (i, test) in enumerate(tests):
-        (test_name, cmd, properties) = test
-        ui.info(ui.green, " * ", ui.reset, ui.bold,
-                "(%2i/%2i)" % (i+1, len(tests)),
-                ui.blue, test_name.ljust(25), end="")
-        if verbose:
-            print
-        sys.stdout.flush()
-        test_res = run_test(build_dir, test_name, cmd, properties, build_env,
-                            valgrind=valgrind, verbose=verbose)
-        if test_res.ok:
-            ui.info(ui.green, "[OK]")
-        else:
+    if num_jobs > 1:
+        results = _run_tests_parallel(build_dir, tests, build_env, num_jobs,
+                                      verbose=verbose, valgrind=valgrind)
+    else:
+        results = dict()
+        for (i, test) in enumerate(tests):
+            (test_name, cmd, properties) = test
+            ui.info(ui.green, " * ", ui.reset, ui.bold,
+                    "(%2i/%2i)" % (i+1, len(tests)),
+                    ui.blue, test_name.ljust(25), end="")
+            if verbose:
+                print
+            sys.stdout.flush()
+            test_res = run_test(build_dir, test_name, cmd, properties, build_env,
+                                valgrind=valgrind, verbose=verbose)
+            if test_res.ok:
+                ui.info(ui.green, "[OK]")
+            else:
+                ui.info(ui.red, "[FAIL]")
+                if not verbose:
+                    print test_res.out
+            results[test_name] = test_res
+
+    for (test_name, _, _) in tests:
+        test_res = results[test_name]
+        if not test_res.ok:
             ok = False
-            ui.info(ui.red, "[FAIL]")
-            if not verbose:
-                print test_res.out
             fail_tests.append(test_name)
         xml_out = os.path.join(results_dir, test_name + ".xml")
         if not os.path.exists(xml_out):
@@ -265,6 +370,14 @@ def write_xml(xml_out, test_res):
 """
         failure = failure.format(out=test_res.out,
             message=test_res.message)
+    if test_res.out_file:
+        # Let the CI server find the full log instead of
+        # copying megabytes of output in the XML file
+        system_out = """
+      <system-out>[[ATTACHMENT|{out_file}]]</system-out>
+"""
+        failure += system_out.format(
+            out_file=xml.sax.saxutils.escape(os.path.abspath(test_res.out_file)))
     to_write = to_write.format(num_failures=num_failures,
                                testsuite_name="test", # nothing clever to put here :/
                                testcase_name=test_res.test_name,
@@ -38,8 +38,8 @@ def assert_dag(data):
     DagError: Circular dependency error: Starting from 'e', node 'e' depends on 'e', complete path []
     """
 
-    for node, _ in data.items():
-        _topological_sort(data, node, node, True)
+    for node in data.keys():
+        _topological_sort(data, [node], node, raise_exception=True)
 
 def topological_sort(data, heads):
     """ Topological sort
@@ -109,34 +109,46 @@ def topological_sort(data, heads):
     ['g', 'c', 'e', 'b', 'd', 'a', 'u', 'y', 'o', 'i', 'q']
     """
     if isinstance(heads, list):
-        data['internalfakehead'] = heads
-        head = 'internalfakehead'
-        result =  _topological_sort(data, head, head)
-        return [ x for x in result if x != 'internalfakehead' ]
+        return _topological_sort(data, heads, 'internalfakehead')
     else:
-        head = heads
-        return _topological_sort(data, head, head)
+        return _topological_sort(data, [heads], heads)
 
-def _topological_sort(data, head, top_node, raise_exception = False, result = None, visited = None):
+def _topological_sort(data, heads, top_node, raise_exception=False):
     """ Internal function
+
+    Depth-first walk from each of the heads, in order, returning
+    the nodes in post-order.
+
+    Uses an explicit stack rather than recursion, so that deep graphs
+    do not hit the recursion limit, and sets for the visited nodes,
+    so that the whole sort is linear in the size of the graph.
+
     """
-    if not result:
-        result = []
-    if not visited:
-        visited = []
-    deps = data.get(head, list())
-    if head in visited:
-        if head == top_node and raise_exception:
-            raise DagError(head, head, result)
-        return result
-    visited.append(head)
-    for i in deps:
-        try:
-            result.index(i)
-        except ValueError:
-            #the item does not exist
-            result = _topological_sort(data, i, top_node, raise_exception, result, visited)
-    result.append(head)
+    result = list()
+    done = set()
+    visited = set()
+    for head in heads:
+        if head in visited:
+            continue
+        visited.add(head)
+        stack = [(head, iter(data.get(head, list())))]
+        while stack:
+            (node, deps) = stack[-1]
+            for dep in deps:
+                if dep in done:
+                    continue
+                if dep in visited:
+                    # dep is being visited: this is a cycle
+                    if dep == top_node and raise_exception:
+                        raise DagError(dep, dep, result)
+                    continue
+                visited.add(dep)
+                stack.append((dep, iter(data.get(dep, list()))))
+                break
+            else:
+                stack.pop()
+                result.append(node)
+                done.add(node)
     return result
 
 
@@ -144,6 +156,10 @@ def _topological_sort(data, head, top_node, raise_exception = False, result = No
 class DependenciesSolver:
     """This class is able to resolve dependencies between projects
 
+    The names and the dependencies of the projects and packages
+    are read on the first call to solve(), so create a new
+    solver when they change.
+
     """
     logger = qibuild.log.get_logger(__name__)
 
@@ -158,6 +174,35 @@ class DependenciesSolver:
             self.projects = projects
         if packages:
             self.packages = packages
+        # runtime -> (project_names, package_names, to_sort),
+        # see _get_index()
+        self._index = dict()
+
+    def _get_index(self, runtime):
+        """ Return the set of project names, the set of
+        package names, and the dict name -> dependencies
+        used by solve()
+
+        """
+        res = self._index.get(runtime)
+        if res is not None:
+            return res
+        project_names = set(p.name for p in self.projects)
+        active_projects = set(self.active_projects)
+        package_names = set(p.name for p in self.packages)
+        package_names = package_names - active_projects
+
+        to_sort = dict()
+        for project in self.projects:
+            if runtime:
+                to_sort[project.name] = project.rdepends
+            else:
+                to_sort[project.name] = project.depends
+        for package in self.packages:
+            to_sort[package.name] = package.depends
+        res = (project_names, package_names, to_sort)
+        self._index[runtime] = res
+        return res
 
     def solve(self, names, runtime=False):
         """Given a list of names, try to sort them in the correct order.
@@ -172,41 +217,21 @@ class DependenciesSolver:
         r_packages = list()
         r_not_found = list()
 
-        project_names = [p.name for p in self.projects]
-        package_names = [p.name for p in self.packages]
-        package_names = [x for x in package_names if not x in self.active_projects]
-
-        mess  = "Solving deps...\n"
-        mess += "Projects:\n"
-        for project in self.projects:
-            mess += "  " + project.name + "\n"
-            mess += "   deps: " +  ",".join(project.depends) + "\n"
-            mess += "  rdeps: " +  ",".join(project.depends) + "\n"
-        mess += "Packages:\n"
-        for package in self.packages:
-            mess += "  " + package.name + "\n"
+        wanted = set(names)
+        (project_names, package_names, to_sort) = self._get_index(runtime)
 
         # Assert that all the names are known projects:
         for name in names:
             if name not in project_names:
                 raise Exception("Unknown project: %s" % name)
 
-        to_sort = dict()
-        for project in self.projects:
-            if runtime:
-                to_sort[project.name] = project.rdepends
-            else:
-                to_sort[project.name] = project.depends
-        for package in self.packages:
-            to_sort[package.name] = package.depends
-
         sorted_names = topological_sort(to_sort, names)
 
         # Append what is left in sorted names, looking first in
         # known packages, then in known projects, but keeping
         # in r_projects what was passed as argument:
         for name in sorted_names:
-            if name in names:
+            if name in wanted:
                 r_projects.append(name)
             elif name in package_names:
                 r_packages.append(name)
@@ -216,13 +241,101 @@ class DependenciesSolver:
                 r_not_found.append(name)
 
         res = (r_projects, r_packages, r_not_found)
+        self._log_result(res)
+        return res
+
+    def solve_each(self, runtime=False):
+        """ Return a dict project name -> (projects, packages, not_found),
+        with for each project what ``solve([name], runtime)`` would return.
+
+        The dependencies of every project are computed in one walk
+        of the graph, each node reusing the sorted dependencies of its
+        children. Only the nodes that are part of a cycle, or depend
+        on one, are sorted on their own, because the result of the sort
+        then depends on where it started.
 
+        """
+        (project_names, package_names, to_sort) = self._get_index(runtime)
+        # name -> sorted names, as topological_sort(to_sort, [name])
+        # would return them
+        sorted_deps = dict()
+        in_cycle = set()
+        visited = set()
+        for head in sorted(project_names):
+            if head in visited:
+                continue
+            visited.add(head)
+            stack = [(head, iter(to_sort.get(head, list())))]
+            while stack:
+                (node, deps) = stack[-1]
+                for dep in deps:
+                    if dep in sorted_deps:
+                        continue
+                    if dep in visited:
+                        # dep is being visited: this is a cycle
+                        in_cycle.add(node)
+                        continue
+                    visited.add(dep)
+                    stack.append((dep, iter(to_sort.get(dep, list()))))
+                    break
+                else:
+                    stack.pop()
+                    sorted_deps[node] = _merge_deps(node, to_sort, sorted_deps,
+                                                    in_cycle)
+
+        res = dict()
+        for name in project_names:
+            if name in in_cycle:
+                sorted_names = topological_sort(to_sort, [name])
+            else:
+                sorted_names = sorted_deps[name]
+            r_projects = list()
+            r_packages = list()
+            r_not_found = list()
+            for dep in sorted_names:
+                if dep == name:
+                    r_projects.append(dep)
+                elif dep in package_names:
+                    r_packages.append(dep)
+                elif dep in project_names:
+                    r_projects.append(dep)
+                else:
+                    r_not_found.append(dep)
+            res[name] = (r_projects, r_packages, r_not_found)
+        return res
+
+    def _log_result(self, res):
+        """ Log the result of a sort """
+        (r_projects, r_packages, r_not_found) = res
         mess  =  "Sorting result:\n"
         mess +=  "  projects:  " + ",".join(r_projects)  + "\n"
         mess +=  "  packages:  " + ",".join(r_packages)  + "\n"
         mess +=  "  not_found: " + ",".join(r_not_found) + "\n"
         self.logger.debug(mess)
-        return res
+
+
+def _merge_deps(node, to_sort, sorted_deps, in_cycle):
+    """ Return the sorted dependencies of node, built from the ones
+    of its children, in the order a depth-first walk would visit them.
+
+    Add node to in_cycle instead if one of its children is in a
+    cycle, since their sorted dependencies can not be reused
+
+    """
+    if node in in_cycle:
+        return None
+    res = list()
+    seen = set()
+    for dep in to_sort.get(node, list()):
+        if dep in in_cycle:
+            in_cycle.add(node)
+            return None
+        for name in sorted_deps[dep]:
+            if name not in seen:
+                seen.add(name)
+                res.append(name)
+    res.append(node)
+    return res
 
 if __name__ == "__main__":
     import doctest
@@ -8,7 +8,6 @@ import re
 import os
 
 import qibuild.command
-from qibuild.dependencies_solver import DependenciesSolver
 
 FILE_SETUP_GDB  = """\
 # gdb script generated by qiBuild
@@ -152,11 +151,7 @@ def _get_subfolder(directory):
 def _generate_solib_search_path(toc, project_name):
     """ generate the solib_search_path useful for gdb """
     res = []
-    dep_solver = DependenciesSolver(projects=toc.projects,
-                                    packages=toc.packages,
-                                    active_projects=toc.active_projects)
-
-    (r_project_names, _package_names, not_found) = dep_solver.solve([project_name])
+    (r_project_names, _package_names, not_found) = toc.get_project_deps(project_name)
     for p in r_project_names:
         ppath = toc.get_project(p).build_directory
         ppath = os.path.join(ppath, "deploy", "lib")
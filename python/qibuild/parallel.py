@@ -0,0 +1,141 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Run jobs concurrently.
+
+Jobs are run in threads: this is enough for us since the real work
+is almost always done by a child process (cmake, make, git ...)
+
+The main entry point is :py:func:`run_dag`, which starts a job
+as soon as every job it depends on is done, without ever running
+more than ``num_jobs`` jobs at the same time.
+
+"""
+
+import sys
+import threading
+import Queue
+
+# Used when waiting for a job to finish: Queue.get() can not
+# be interrupted by CTRL-C unless a timeout is given
+_WAIT_TIMEOUT = 3600
+
+
+def _run_job(func, name, args, done_queue):
+    """ To be called in a thread """
+    try:
+        res = func(name, *args)
+    except Exception:
+        done_queue.put((name, None, sys.exc_info()))
+        return
+    done_queue.put((name, res, None))
+
+
+def run_dag(names, deps, func, num_jobs=1, split_jobs=False,
+            on_done=None):
+    """ Call ``func(name)`` for every name, as soon as every
+    dependency of name has been processed.
+
+    :param names: the list of names, in the order jobs should be
+        started when several of them are ready. This is usually the
+        result of a topological sort.
+    :param deps: a dict name -> list of names it depends on.
+        Only the dependencies found *before* name in ``names``
+        are taken into account, so a circular dependency can never
+        block the scheduler: the order of ``names`` always wins.
+    :param num_jobs: the global job budget. At most ``num_jobs``
+        jobs run at the same time.
+    :param split_jobs: if True, call ``func(name, jobs)``, where jobs
+        is the share of the budget given to this job (at least one).
+        Useful to pass it to ``make -j``
+    :param on_done: if given, called from the calling thread with
+        ``(name, result)`` each time a job succeeds.
+
+    :return: a dict name -> value returned by func
+
+    When a job raises, no new job is started, the running jobs are
+    waited for, and the first exception is re-raised.
+
+    """
+    if num_jobs < 1:
+        num_jobs = 1
+    position = dict((name, i) for (i, name) in enumerate(names))
+    waiting_for = dict()
+    dependents = dict((name, list()) for name in names)
+    for name in names:
+        waiting_for[name] = set()
+        for dep in deps.get(name, list()):
+            if position.get(dep, len(names)) < position[name]:
+                waiting_for[name].add(dep)
+                dependents[dep].append(name)
+
+    pending = list(names)
+    results = dict()
+    given = dict()
+    error = None
+    free = num_jobs
+    running = 0
+    done_queue = Queue.Queue()
+    while True:
+        if error is None:
+            ready = [x for x in pending if not waiting_for[x]]
+            while ready and free > 0:
+                name = ready.pop(0)
+                pending.remove(name)
+                if split_jobs:
+                    jobs = max(1, free / (len(ready) + 1))
+                    args = (jobs,)
+                else:
+                    jobs = 1
+                    args = tuple()
+                free -= jobs
+                given[name] = jobs
+                running += 1
+                thread = threading.Thread(target=_run_job,
+                    name="Job<%s>" % name,
+                    args=(func, name, args, done_queue))
+                thread.daemon = True
+                thread.start()
+        if running == 0:
+            break
+        try:
+            (name, res, exc_info) = done_queue.get(True, _WAIT_TIMEOUT)
+        except Queue.Empty:
+            continue
+        running -= 1
+        free += given[name]
+        if exc_info:
+            if error is None:
+                error = exc_info
+            continue
+        results[name] = res
+        for dependent in dependents[name]:
+            waiting_for[dependent].discard(name)
+        if on_done:
+            on_done(name, res)
+
+    if error:
+        raise error[0], error[1], error[2]
+    return results
+
+
+def run_parallel(items, func, num_jobs=1, on_done=None):
+    """ Call ``func(item)`` for every item, running at most
+    ``num_jobs`` calls at the same time.
+
+    :param on_done: if given, called from the calling thread with
+        ``(item, result)`` as soon as a call returns.
+
+    :return: the list of results, in the same order as ``items``
+
+    """
+    items = list(items)
+    def job(i):
+        return func(items[i])
+    callback = None
+    if on_done:
+        callback = lambda i, res: on_done(items[i], res)
+    results = run_dag(range(len(items)), dict(), job,
+                      num_jobs=num_jobs, on_done=callback)
+    return [results[i] for i in range(len(items))]
@@ -83,3 +83,12 @@ def project_parser(parser):
         help="Work on specified projects without taking dependencies into account.")
     parser.add_argument("projects", nargs="*", metavar="PROJECT", help="Project name(s)")
     parser.set_defaults(single=False, projects = list())
+
+def parallel_parser(parser):
+    """ Parser settings for every action able to work on several
+    projects at the same time
+    """
+    parser.add_argument("--parallel", action="store_true",
+        help="Work on independent projects at the same time. "
+             "The -j budget is shared between the running jobs")
+    parser.set_defaults(parallel=False)
@@ -32,7 +32,7 @@ class Project:
     """ Store information about a :term:`project`
 
     """
-    def __init__(self, directory):
+    def __init__(self, directory, index=None):
         self.name = None
         self.directory  = directory
         self.depends    = list()
@@ -45,7 +45,7 @@ class Project:
         self.sdk_directory   = None
         self._custom_sdk_dir = False
 
-        self.load_config()
+        self.load_config(index=index)
 
     def get_sdk_dir(self):
         """ Return the SDK dir of the project.
@@ -55,13 +55,31 @@ class Project:
         """
         return self.sdk_directory
 
-    def load_config(self):
-        """ Update project dependency list """
+    def load_config(self, index=None):
+        """ Update project dependency list
+
+        :param index: a :py:class:`qisrc.index.QiProjectIndex`.
+            If given, the parsing results of the qiproject.xml
+            file are taken from there.
+
+        """
         handle_old_manifest(self.directory)
         project_xml = os.path.join(self.directory, "qiproject.xml")
-        if not os.path.exists(project_xml):
-            return
-        self.config.read(project_xml)
+        if index:
+            qiproject = index.read(project_xml)
+            if qiproject is None:
+                return
+            if qiproject["name"]:
+                self.config.name = qiproject["name"]
+                self.config.depends = set(qiproject["depends"])
+                self.config.rdepends = set(qiproject["rdepends"])
+            else:
+                # Let ProjectConfig raise a nice error message
+                self.config.read(project_xml)
+        else:
+            if not os.path.exists(project_xml):
+                return
+            self.config.read(project_xml)
         self.name = self.config.name
         self.depends  = self.config.depends
         self.rdepends = self.config.rdepends
@@ -264,6 +282,13 @@ endif()
 
     dep_cmake = os.path.join(project.build_directory, "dependencies.cmake")
 
+    # Do not write the file if it's the same, so that
+    # cmake does not think something has changed
+    if os.path.exists(dep_cmake):
+        with open(dep_cmake, "r") as fp:
+            if fp.read() == to_write:
+                return
+
     with open(dep_cmake, "w") as fp:
         fp.write(to_write)
 
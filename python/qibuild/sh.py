@@ -18,6 +18,12 @@ import tempfile
 import qibuild.log
 import subprocess
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 LOGGER = qibuild.log.get_logger("buildtool.sh")
 
 def mkdir(dest_dir, recursive=False):
@@ -475,6 +481,104 @@ class TempDir:
                 return
         rm(self._temp_dir)
 
+class FileLock:
+    """ An exclusive lock, held by at most one process or
+    thread at a time, and released when the process dies.
+
+    Usage::
+
+        with FileLock("/path/to/foo.lock"):
+            write_foo()
+
+    The lock file is created if needed, and left in place
+    unless :py:meth:`remove` is called while holding the lock.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fp = None
+
+    def acquire(self, blocking=True):
+        """ Wait for the lock, unless blocking is False
+
+        :return: whether the lock was acquired
+
+        """
+        while True:
+            fp = open(self.path, "a")
+            if not _lock_file(fp, blocking):
+                fp.close()
+                return False
+            # The previous holder may have removed the file
+            # in the mean time: start again with the new one
+            if _is_same_file(fp, self.path):
+                self._fp = fp
+                return True
+            fp.close()
+
+    def release(self):
+        """ Release the lock """
+        if fcntl:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+        else:
+            self._fp.seek(0)
+            msvcrt.locking(self._fp.fileno(), msvcrt.LK_UNLCK, 1)
+        self._fp.close()
+        self._fp = None
+
+    def remove(self):
+        """ Remove the lock file, then release the lock """
+        if fcntl:
+            os.remove(self.path)
+            self.release()
+        else:
+            # Open files cannot be removed on Windows
+            self.release()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.release()
+
+def _lock_file(fp, blocking):
+    """ Lock an open file for FileLock """
+    if fcntl:
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fp.fileno(), flags)
+        except IOError, e:
+            if not blocking and e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+    fp.seek(0)
+    while True:
+        try:
+            msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except IOError:
+            if not blocking:
+                return False
+            time.sleep(0.1)
+
+def _is_same_file(fp, path):
+    """ Whether the open file fp is still the one at path """
+    if os.name == "nt":
+        # Nobody can remove it while it is open
+        return True
+    try:
+        return os.fstat(fp.fileno()).st_ino == os.stat(path).st_ino
+    except OSError:
+        return False
+
 @contextlib.contextmanager
 def change_cwd(directory):
     """ Change the current working dir """
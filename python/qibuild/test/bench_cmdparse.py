@@ -0,0 +1,82 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Benchmark for the start-up time of the command line tools
+
+Compares running ``qibuild --version`` and ``qisrc list``
+with the actions imported lazily (the default) and with every action
+imported first, as it used to be.
+
+Run with::
+
+    python -m qibuild.test.bench_cmdparse [REPEAT]
+
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+import time
+
+import qibuild.sh
+
+BIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       "..", "..", "bin"))
+
+# Same as running bin/<tool> args, but importing every action and
+# configuring every parser first
+EAGER = """
+import sys
+sys.path.insert(0, %(python_dir)r)
+sys.argv = [%(tool)r] + %(args)r
+import qibuild.cmdparse
+qibuild.cmdparse.action_modules_from_package(%(package)r)
+def eager_main(name, parser, package_name, args=None):
+    modules = qibuild.cmdparse.action_modules_from_package(package_name)
+    return qibuild.cmdparse.root_command_main(name, parser, modules, args=args)
+qibuild.cmdparse.root_command_main_from_package = eager_main
+execfile(%(script)r, {"__name__" : "__main__", "__file__" : %(script)r})
+"""
+
+def run(cmd, repeat):
+    """ Return the best wall time of running cmd, in ms """
+    best = None
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            before = time.time()
+            subprocess.check_call(cmd, stdout=devnull)
+            elapsed = time.time() - before
+            if best is None or elapsed < best:
+                best = elapsed
+    return best * 1000
+
+def bench(tool, args, repeat):
+    script = os.path.join(BIN_DIR, tool)
+    eager = EAGER % {
+        "python_dir" : os.path.dirname(BIN_DIR),
+        "tool" : tool,
+        "args" : args,
+        "package" : tool + ".actions",
+        "script" : script,
+    }
+    lazy_time = run([sys.executable, script] + args, repeat)
+    eager_time = run([sys.executable, "-c", eager], repeat)
+    label = " ".join([tool] + args)
+    print "%-40s lazy: %7.1f ms   eager: %7.1f ms" % (label, lazy_time, eager_time)
+
+def main():
+    repeat = 10
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+    worktree = tempfile.mkdtemp(prefix="bench-cmdparse")
+    try:
+        qibuild.sh.mkdir(os.path.join(worktree, ".qi"))
+        bench("qibuild", ["--version"], repeat)
+        bench("qisrc", ["list", "-w", worktree], repeat)
+    finally:
+        qibuild.sh.rm(worktree)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Benchmark for qibuild.command.CommandLine, which is used by
+qibuild.command.call(quiet=True)
+
+Run with::
+
+    python -m qibuild.test.bench_command [NUM_MB]
+
+"""
+
+import os
+import sys
+import subprocess
+import threading
+import timeit
+import Queue
+
+from qibuild.command import CommandLine, RingBuffer
+
+# Looks like the output of a compiler
+LINE = "/path/to/src/foo.cpp:42:12: warning: unused variable 'bar' [-Wunused-variable]\n"
+
+GENERATOR = """
+import os
+import sys
+line = %r
+count = int(sys.argv[1]) * 1024 * 1024 / len(line)
+for i in xrange(count):
+    if i %% 10 == 0:
+        sys.stderr.write(line)
+    else:
+        sys.stdout.write(line)
+"""
+
+def generator_cmd(num_mb):
+    return [sys.executable, "-c", GENERATOR % LINE, str(num_mb)]
+
+
+def execute_polling(cmd):
+    """ The implementation of CommandLine.execute() before it
+    used select(): one thread per pipe, polled every 10ms
+
+    """
+    def reader(pipe, pipe_name, queue):
+        while pipe and not pipe.closed:
+            line = pipe.readline()
+            if line == '':
+                break
+            queue.put((pipe_name, line))
+        if not pipe.closed:
+            pipe.close()
+    process = subprocess.Popen(cmd,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    queue = Queue.Queue()
+    pipe_out = threading.Thread(target=reader,
+        args=(process.stdout, 'stdout', queue))
+    pipe_err = threading.Thread(target=reader,
+        args=(process.stderr, 'stderr', queue))
+    pipe_out.start()
+    pipe_err.start()
+    returncode = None
+    while True:
+        if process.poll() is not None and returncode is None:
+            returncode = process.returncode
+        try:
+            name, line = queue.get(block=True, timeout=.01)
+            if name == "stderr":
+                yield(None, line)
+            else:
+                yield(line, None)
+        except Queue.Empty:
+            if returncode is not None:
+                break
+    pipe_out.join()
+    pipe_err.join()
+
+def execute_select(cmd):
+    return CommandLine(cmd).execute()
+
+
+def consume(execute, cmd):
+    """ What qibuild.command.call(quiet=True) does """
+    ring_buffer = RingBuffer(300)
+    for (out, err) in execute(cmd):
+        if out is not None:
+            ring_buffer.append(out)
+        if err is not None:
+            ring_buffer.append(err)
+
+def bench(label, func, num_mb, number=3):
+    best = min(timeit.repeat(func, number=1, repeat=number))
+    print "%-40s %8.2f ms/MB" % (label, best * 1000 / num_mb)
+
+def main():
+    num_mb = 20
+    if len(sys.argv) > 1:
+        num_mb = int(sys.argv[1])
+    cmd = generator_cmd(num_mb)
+    print "Reading %i MB of compiler output" % num_mb
+    bench("no capture (baseline)",
+          lambda: subprocess.call(cmd, stdout=open(os.devnull, "w"),
+                                  stderr=subprocess.STDOUT), num_mb)
+    bench("reader threads + 10ms polling",
+          lambda: consume(execute_polling, cmd), num_mb)
+    bench("select/poll",
+          lambda: consume(execute_select, cmd), num_mb)
+
+if __name__ == "__main__":
+    main()
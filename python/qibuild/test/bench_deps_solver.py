@@ -0,0 +1,72 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Benchmark for qibuild.dependencies_solver
+
+Run with::
+
+    python -m qibuild.test.bench_deps_solver [NUM_NODES]
+
+"""
+
+import sys
+import random
+import timeit
+
+from qibuild.dependencies_solver import topological_sort
+from qibuild.dependencies_solver import DependenciesSolver
+
+class Project:
+    def __init__(self, name, depends):
+        self.name = name
+        self.depends = depends
+        self.rdepends = depends
+
+
+def chain_graph(num_nodes):
+    """ node_i depends on node_{i-1}: as deep as it gets """
+    data = dict()
+    for i in range(1, num_nodes):
+        data["node_%i" % i] = ["node_%i" % (i - 1)]
+    return data
+
+def random_graph(num_nodes, max_deps=5, seed=42):
+    """ Each node depends on up to max_deps nodes with a lower index """
+    rand = random.Random(seed)
+    data = dict()
+    for i in range(num_nodes):
+        num_deps = rand.randint(0, min(i, max_deps))
+        deps = rand.sample(range(i), num_deps)
+        data["node_%i" % i] = ["node_%i" % x for x in deps]
+    return data
+
+def bench(label, func, number=5):
+    best = min(timeit.repeat(func, number=1, repeat=number))
+    print "%-40s %8.2f ms" % (label, best * 1000)
+
+def main():
+    num_nodes = 10000
+    if len(sys.argv) > 1:
+        num_nodes = int(sys.argv[1])
+    chain = chain_graph(num_nodes)
+    graph = random_graph(num_nodes)
+    heads = graph.keys()
+
+    print "Topological sort on %i nodes" % num_nodes
+    bench("chain, one head",
+          lambda: topological_sort(chain, "node_%i" % (num_nodes - 1)))
+    bench("random, one head",
+          lambda: topological_sort(graph, "node_%i" % (num_nodes - 1)))
+    bench("random, every node as head",
+          lambda: topological_sort(graph, heads))
+
+    projects = [Project(name, deps) for (name, deps) in graph.iteritems()]
+    solver = DependenciesSolver(projects=projects)
+    bench("DependenciesSolver.solve, all projects",
+          lambda: solver.solve(heads))
+    bench("DependenciesSolver.solve_each",
+          lambda: solver.solve_each())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Benchmark for qibuild.toc.toc_open and Toc.resolve_deps
+on a big worktree
+
+Run with::
+
+    python -m qibuild.test.bench_toc [NUM_PROJECTS]
+
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import timeit
+
+import qibuild.toc
+import qisrc.worktree
+
+QIPROJECT_XML = """<project name="{name}">
+  <depends buildtime="true" runtime="true" names="{depends}" />
+</project>
+"""
+
+CMAKE_LISTS = """cmake_minimum_required(VERSION 2.8)
+project({name})
+"""
+
+def create_worktree(root, num_projects, max_deps=5, seed=42):
+    """ Each project depends on up to max_deps projects
+    with a lower index
+
+    """
+    rand = random.Random(seed)
+    srcs = list()
+    for i in range(num_projects):
+        name = "project_%i" % i
+        src = "lib/%s" % name
+        num_deps = rand.randint(0, min(i, max_deps))
+        deps = ["project_%i" % x for x in rand.sample(range(i), num_deps)]
+        path = os.path.join(root, src)
+        os.makedirs(path)
+        with open(os.path.join(path, "qiproject.xml"), "w") as fp:
+            fp.write(QIPROJECT_XML.format(name=name, depends=" ".join(deps)))
+        with open(os.path.join(path, "CMakeLists.txt"), "w") as fp:
+            fp.write(CMAKE_LISTS.format(name=name))
+        srcs.append(src)
+    os.makedirs(os.path.join(root, ".qi"))
+    with open(os.path.join(root, ".qi", "worktree.xml"), "w") as fp:
+        fp.write("<worktree>\n")
+        for src in srcs:
+            fp.write('  <project src="%s" />\n' % src)
+        fp.write("</worktree>\n")
+
+def open_and_resolve(root):
+    """ What most qibuild actions do """
+    toc = qibuild.toc.toc_open(root)
+    toc.active_projects = [p.name for p in toc.projects]
+    return toc.resolve_deps()
+
+def get_every_project(worktree, toc):
+    for project in worktree.projects:
+        worktree.get_project(project.src)
+        worktree.get_project(project.path)
+    for project in toc.projects:
+        toc.get_project(project.name)
+
+def get_every_reverse_deps(toc):
+    """ What qibuild depends --reverse does """
+    toc.reset_caches()
+    for project in toc.projects:
+        toc.get_reverse_deps(project.name)
+        toc.get_reverse_deps(project.name, runtime=True)
+
+def bench(label, func, number=3):
+    best = min(timeit.repeat(func, number=1, repeat=number))
+    print "%-40s %8.2f ms" % (label, best * 1000)
+
+def main():
+    num_projects = 5000
+    if len(sys.argv) > 1:
+        num_projects = int(sys.argv[1])
+    root = tempfile.mkdtemp(prefix="bench-toc-")
+    try:
+        create_worktree(root, num_projects)
+        print "Worktree with %i projects" % num_projects
+        bench("toc_open + resolve_deps",
+              lambda: open_and_resolve(root))
+        worktree = qisrc.worktree.open_worktree(root)
+        toc = qibuild.toc.toc_open(root)
+        bench("get_project on every project",
+              lambda: get_every_project(worktree, toc))
+        project_names = [p.name for p in toc.projects]
+        bench("get_sdk_dirs on every project",
+              lambda: [toc.get_sdk_dirs(x) for x in project_names], number=1)
+        bench("get_reverse_deps on every project",
+              lambda: get_every_reverse_deps(toc), number=1)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+try:
+    import argparse
+except ImportError:
+    from qibuild.external import argparse
+
+import qibuild.cmdparse
+import qibuild.command
+import qibuild.sh
+import qisrc
+
+def create_actions(tmpdir):
+    """ Create a fake package with a good action, and
+    an action that can not be imported
+
+    """
+    actions = tmpdir.mkdir("fake_actions")
+    actions.join("__init__.py").write('""" Fake actions """\n')
+    actions.join("spam_eggs.py").write('''
+""" Spam eggs """
+import qibuild.parsers
+DONE = list()
+def configure_parser(parser):
+    qibuild.parsers.default_parser(parser)
+    parser.add_argument("--foo")
+def do(args):
+    DONE.append(args.foo)
+''')
+    actions.join("broken.py").write('''
+""" Broken """
+raise Exception("should not be imported")
+''')
+    sys.path.insert(0, tmpdir.strpath)
+
+def test_only_selected_action_is_imported(tmpdir):
+    create_actions(tmpdir)
+    try:
+        parser = argparse.ArgumentParser()
+        qibuild.cmdparse.root_command_main_from_package("fake", parser,
+            "fake_actions", args=["spam-eggs", "--foo", "bar"])
+        assert sys.modules["fake_actions.spam_eggs"].DONE == ["bar"]
+        assert "fake_actions.broken" not in sys.modules
+    finally:
+        sys.path.remove(tmpdir.strpath)
+        for name in sys.modules.keys():
+            if name.startswith("fake_actions"):
+                del sys.modules[name]
+
+def test_help_imports_every_action(tmpdir):
+    create_actions(tmpdir)
+    try:
+        parser = argparse.ArgumentParser()
+        # pylint: disable-msg=E1101
+        with pytest.raises(Exception) as e:
+            qibuild.cmdparse.root_command_main_from_package("fake", parser,
+                "fake_actions", args=["--help"])
+        assert "should not be imported" in str(e.value)
+    finally:
+        sys.path.remove(tmpdir.strpath)
+        for name in sys.modules.keys():
+            if name.startswith("fake_actions"):
+                del sys.modules[name]
+
+def run_qisrc(cwd, *args):
+    """ Run bin/qisrc in a new interpreter, so that
+    nothing but what the action imports is loaded
+
+    """
+    bin_dir = os.path.join(os.path.dirname(qibuild.__file__), "..", "bin")
+    cmd = [sys.executable, os.path.join(bin_dir, "qisrc")] + list(args)
+    process = subprocess.Popen(cmd, cwd=cwd,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = process.communicate()[0]
+    assert process.returncode == 0, out
+
+def test_qisrc_actions_are_usable(tmpdir):
+    git = qibuild.command.find_program("git", raises=True)
+    manifest_xml = tmpdir.join("manifest.xml")
+    manifest_xml.write("<manifest />")
+    run_qisrc(tmpdir.strpath, "init", "-w", "work", manifest_xml.strpath)
+
+    # A manifest project, to go through qisrc.sync
+    srv = tmpdir.mkdir("srv")
+    qibuild.command.call([git, "init", "--bare", "-q", "manifest.git"],
+                         cwd=srv.strpath)
+    manifest_git = srv.join("manifest.git").strpath
+    work = tmpdir.join("work").strpath
+    qibuild.command.call([git, "clone", "-q", manifest_git, "manifest/default"],
+                         cwd=work)
+    manifest_path = os.path.join(work, "manifest", "default")
+    qibuild.sh.install(manifest_xml.strpath,
+                       os.path.join(manifest_path, "default.xml"), quiet=True)
+    for cmd in [["add", "default.xml"], ["commit", "-q", "-m", "manifest"],
+                ["push", "-q", "origin", "HEAD"]]:
+        qibuild.command.call([git] + cmd, cwd=manifest_path)
+    worktree = qisrc.open_worktree(work)
+    worktree.add_project("manifest/default")
+    worktree.set_manifest_project("manifest/default")
+    run_qisrc(work, "sync")
+
+    qibuild.command.call([git, "commit", "-q", "--allow-empty", "-m", "next"],
+                         cwd=manifest_path)
+    run_qisrc(manifest_path, "push", "--dry-run")
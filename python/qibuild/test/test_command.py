@@ -0,0 +1,83 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Automatic testing for qibuild.command
+
+"""
+
+import sys
+
+from qibuild.command import OutputBuffer, ProcessThread
+from qibuild.command import CommandLine, LineSplitter
+
+
+def test_buffer_no_limit():
+    buf = OutputBuffer()
+    for i in range(1000):
+        buf.write("line %i\n" % i)
+    assert buf.getvalue() == "".join("line %i\n" % i for i in range(1000))
+    assert not buf.skipped
+
+def test_buffer_keeps_head_and_tail():
+    buf = OutputBuffer(max_size=10)
+    buf.write("abc")
+    buf.write("defgh")
+    buf.write("ijklmnopq")
+    buf.write("rst")
+    assert buf.skipped == 10
+    value = buf.getvalue()
+    assert value.startswith("abcde")
+    assert value.endswith("pqrst")
+    assert "10 bytes skipped" in value
+
+def test_buffer_spill(tmpdir):
+    spill = tmpdir.join("out", "test.log")
+    buf = OutputBuffer(max_size=4, spill_path=spill.strpath)
+    buf.write("ab")
+    assert not spill.check()
+    buf.write("cdefgh")
+    buf.write("ijkl")
+    buf.close()
+    assert buf.spilled
+    assert spill.read() == "abcdefghijkl"
+    assert buf.getvalue().startswith("ab")
+    assert buf.getvalue().endswith("kl")
+    assert spill.strpath in buf.getvalue()
+
+def test_process_thread_big_output(tmpdir):
+    out_file = tmpdir.join("big.log")
+    cmd = [sys.executable, "-c",
+           "import sys; sys.stdout.write('x' * 1000000 + 'end')"]
+    thread = ProcessThread(cmd, max_out=1000, out_file=out_file.strpath)
+    thread.start()
+    thread.join()
+    assert thread.process.returncode == 0
+    assert thread.spilled
+    assert thread.out.endswith("end")
+    assert len(thread.out) < 2000
+    assert out_file.size() == 1000003
+
+def test_command_line_execute():
+    cmd = [sys.executable, "-c", """
+import sys
+sys.stdout.write("foo\\n" * 3 + "x" * 100000 + "\\nbar")
+sys.stdout.flush()
+sys.stderr.write("error\\n")
+sys.exit(2)
+"""]
+    cmdline = CommandLine(cmd)
+    res = list(cmdline.execute())
+    out = [x for (x, y_) in res if x is not None]
+    err = [y for (x_, y) in res if y is not None]
+    assert out == ["foo\n"] * 3 + ["x" * 100000 + "\n", "bar"]
+    assert err == ["error\n"]
+    assert cmdline.returncode == 2
+
+def test_line_splitter():
+    splitter = LineSplitter()
+    lines = list()
+    for block in ["a", "b\nc\n", "\n", "d" * 10, "e\nf"]:
+        lines.extend(splitter.feed(block))
+    lines.extend(splitter.flush())
+    assert lines == ["ab\n", "c\n", "\n", "d" * 10 + "e\n", "f"]
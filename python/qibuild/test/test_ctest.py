@@ -2,7 +2,10 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+import os
+
 import pytest
+import qibuild.ctest
 from qibuild.ctest import parse_ctest_test_files
 
 def test_parse_simple(tmpdir):
@@ -52,3 +55,60 @@ SET_TESTS_PROPERTIES(bar PROPERTIES SPAM EGGS)
         parse_ctest_test_files(tmpdir.strpath)
     assert "SET_TESTS_PROPERTIES called with wrong name" in e.value.message
 
+
+
+def test_schedule():
+    tests = [
+        ["short", ["short"], {"COST" : "1.5"}],
+        ["no_cost", ["no_cost"], dict()],
+        ["alone", ["alone"], {"COST" : "90", "RUN_SERIAL" : "ON"}],
+        ["long", ["long"], {"COST" : "42"}],
+        ["bad_cost", ["bad_cost"], {"COST" : "high"}],
+    ]
+    (concurrent, serial) = qibuild.ctest._schedule(tests)
+    assert [x[0] for x in concurrent] == \
+        ["long", "short", "no_cost", "bad_cost"]
+    assert [x[0] for x in serial] == ["alone"]
+
+
+class FakeProject:
+    def __init__(self, build_dir):
+        self.name = "fake"
+        self.build_directory = build_dir
+
+def test_run_tests_parallel(tmpdir):
+    root_ctest = tmpdir.join("CTestTestfile.cmake")
+    root_ctest.write("""
+ADD_TEST(test_ok "true")
+ADD_TEST(test_fail "false")
+SET_TESTS_PROPERTIES(test_fail PROPERTIES COST 10.0)
+ADD_TEST(test_serial "true")
+SET_TESTS_PROPERTIES(test_serial PROPERTIES RUN_SERIAL TRUE)
+""")
+    project = FakeProject(tmpdir.strpath)
+    ok = qibuild.ctest.run_tests(project, dict(os.environ), num_jobs=4)
+    assert not ok
+    results = tmpdir.join("test-results")
+    for name in ["test_ok", "test_fail", "test_serial"]:
+        assert results.join(name + ".xml").check(file=True)
+    assert 'failures="1"' in results.join("test_fail.xml").read()
+    assert 'failures="0"' in results.join("test_ok.xml").read()
+
+def test_big_output_is_spilled(tmpdir):
+    root_ctest = tmpdir.join("CTestTestfile.cmake")
+    root_ctest.write("""
+ADD_TEST(test_big "sh" "-c" "head -c 100000 /dev/zero; false")
+""")
+    project = FakeProject(tmpdir.strpath)
+    old_max = qibuild.ctest.MAX_OUTPUT_SIZE
+    qibuild.ctest.MAX_OUTPUT_SIZE = 1000
+    try:
+        qibuild.ctest.run_tests(project, dict(os.environ))
+    finally:
+        qibuild.ctest.MAX_OUTPUT_SIZE = old_max
+    results = tmpdir.join("test-results")
+    log = results.join("test_big.log")
+    assert log.size() == 100000
+    xml = results.join("test_big.xml").read()
+    assert "[[ATTACHMENT|%s]]" % log.strpath in xml
+    assert len(xml) < 2000
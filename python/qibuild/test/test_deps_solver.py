@@ -9,6 +9,7 @@ import unittest
 
 
 from qibuild.dependencies_solver import DependenciesSolver
+from qibuild.dependencies_solver import topological_sort
 
 
 class Project:
@@ -115,5 +116,45 @@ class DependenciesSolverTestCase(unittest.TestCase):
         self.assertEquals(packages,  [])
         self.assertEquals(not_found, [])
 
+    def test_deep_graph(self):
+        # Used to hit the recursion limit:
+        data = dict()
+        for i in range(1, 10000):
+            data["p%i" % i] = ["p%i" % (i - 1)]
+        res = topological_sort(data, "p9999")
+        self.assertEquals(res, ["p%i" % i for i in range(10000)])
+
+    def test_data_is_not_modified(self):
+        data = {"a" : ["b"], "c" : ["b"]}
+        res = topological_sort(data, ["a", "c"])
+        self.assertEquals(res, ["b", "a", "c"])
+        self.assertEquals(data, {"a" : ["b"], "c" : ["b"]})
+
+    def test_solve_each(self):
+        a = Project("a")
+        b = Project("b")
+        c = Project("c")
+        d = Project("d")
+        # c and d depend on each other
+        e = Project("e")
+        world = Package("world")
+        a.depends = ["b", "world", "c"]
+        a.rdepends = ["c"]
+        b.depends = ["world", "not_found"]
+        c.depends = ["d"]
+        d.depends = ["c", "b"]
+        e.depends = ["a", "d"]
+        world.depends = ["b"]
+        projects = [a, b, c, d, e]
+        packages = [world]
+        dep_solver = DependenciesSolver(projects=projects, packages=packages,
+                                        active_projects=["world"])
+        for runtime in [False, True]:
+            res = dep_solver.solve_each(runtime=runtime)
+            self.assertEquals(sorted(res.keys()), ["a", "b", "c", "d", "e"])
+            for project in projects:
+                self.assertEquals(res[project.name],
+                    dep_solver.solve([project.name], runtime=runtime))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,72 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import threading
+import time
+
+import pytest
+from qibuild.parallel import run_dag, run_parallel
+
+def test_deps_are_done_first():
+    done = list()
+    deps = {
+        "hello" : ["world", "foo"],
+        "world" : ["foo"],
+        "bar"   : list(),
+    }
+    def job(name):
+        for dep in deps.get(name, list()):
+            assert dep in done
+        time.sleep(0.01)
+        done.append(name)
+        return name.upper()
+    res = run_dag(["foo", "bar", "world", "hello"], deps, job, num_jobs=4)
+    assert res == {"foo" : "FOO", "bar" : "BAR",
+                   "world" : "WORLD", "hello" : "HELLO"}
+    assert done.index("foo") < done.index("world") < done.index("hello")
+
+def test_budget_is_shared():
+    lock = threading.Lock()
+    given = dict()
+    running = list()
+    max_running = list()
+    def job(name, jobs):
+        with lock:
+            given[name] = jobs
+            running.append(name)
+            max_running.append(sum(given[x] for x in running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(name)
+    run_dag(["a", "b", "c", "d"], {"d" : ["a", "b", "c"]}, job,
+            num_jobs=6, split_jobs=True)
+    assert max(max_running) <= 6
+    assert given["a"] == 2
+    # d runs alone at the end and gets the whole budget
+    assert given["d"] == 6
+
+def test_circular_deps_do_not_block():
+    deps = {"a" : ["b"], "b" : ["a"]}
+    done = list()
+    run_dag(["b", "a"], deps, done.append, num_jobs=2)
+    assert done == ["b", "a"]
+
+def test_first_error_is_raised():
+    done = list()
+    def job(name):
+        if name == "world":
+            raise Exception("world failed")
+        done.append(name)
+    # pylint: disable-msg=E1101
+    with pytest.raises(Exception) as e:
+        run_dag(["world", "hello"], {"hello" : ["world"]}, job, num_jobs=2)
+    assert "world failed" in str(e.value)
+    assert done == list()
+
+def test_run_parallel():
+    finished = list()
+    res = run_parallel([3, 1, 2], lambda x: x * 2, num_jobs=3,
+                       on_done=lambda x, r: finished.append(x))
+    assert res == [6, 2, 4]
+    assert sorted(finished) == [1, 2, 3]
@@ -10,6 +10,7 @@
 import os
 import difflib
 
+import mock
 import pytest
 import unittest
 import qibuild
@@ -64,6 +65,42 @@ class QiBuildTestCase(unittest.TestCase):
         self._run_action("configure", "hello")
         self._run_action("make", "hello")
 
+    def test_configure_parallel(self):
+        self._run_action("configure", "--parallel", "-j", "4", "hello", "bar")
+        for project_name in ["world", "hello", "footool", "bar"]:
+            build_dir = self.get_build_dir(project_name)
+            configure_log = os.path.join(build_dir, "configure.log")
+            self.assertTrue(os.path.exists(configure_log))
+
+    def test_make_parallel(self):
+        self._run_action("configure", "hello", "bar")
+        self._run_action("make", "--parallel", "-j", "4", "hello", "bar")
+
+    def test_configure_nothing_changed(self):
+        self._run_action("configure", "world")
+        build_dir = self.get_build_dir("world")
+        cmake_cache = self.get_cmake_cache("world")
+        dep_cmake = os.path.join(build_dir, "dependencies.cmake")
+        # Make sure a rewrite would change the mtimes
+        for path in [cmake_cache, dep_cmake]:
+            os.utime(path, (0, 0))
+        self._run_action("configure", "world")
+        self.assertEquals(os.stat(cmake_cache).st_mtime, 0)
+        self.assertEquals(os.stat(dep_cmake).st_mtime, 0)
+        # Changing the compiler flags means a new fingerprint
+        with mock.patch.dict(os.environ, {"CXXFLAGS" : "-DSPAM"}):
+            self._run_action("configure", "world")
+        self.assertNotEquals(os.stat(cmake_cache).st_mtime, 0)
+        # A different flag means a new fingerprint
+        self._run_action("configure", "world", "-DFOO=BAR")
+        cache = qibuild.cmake.read_cmake_cache(cmake_cache)
+        self.assertEquals(cache["FOO"], "BAR")
+        self.assertEquals(os.stat(dep_cmake).st_mtime, 0)
+        # And so does --force
+        os.utime(cmake_cache, (0, 0))
+        self._run_action("configure", "world", "-DFOO=BAR", "--force")
+        self.assertNotEquals(os.stat(cmake_cache).st_mtime, 0)
+
     def test_make_without_configure(self):
         self.assertRaises(Exception, self._run_action, "make", "hello")
 
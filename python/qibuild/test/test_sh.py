@@ -16,6 +16,21 @@ class InstallTestCase(unittest.TestCase):
     def tearDown(self):
         qibuild.sh.rm(self.tmp)
 
+    def test_file_lock(self):
+        path = os.path.join(self.tmp, "foo.lock")
+        lock = qibuild.sh.FileLock(path)
+        other = qibuild.sh.FileLock(path)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.assertFalse(other.acquire(blocking=False))
+        lock.release()
+        with other:
+            self.assertFalse(lock.acquire(blocking=False))
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.remove()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
     def test_install_ro(self):
         src = os.path.join(self.tmp, "src")
         os.mkdir(src)
@@ -92,6 +92,56 @@ class TocTestCase(unittest.TestCase):
         workd_sdk_dirs = self.toc.get_sdk_dirs("world")
         self.assertEquals(workd_sdk_dirs, list())
 
+    def test_deps_cache(self):
+        self.toc.projects = [self.hello_project, self.world_project]
+        self.toc.update_projects()
+        deps = self.toc.get_project_deps("hello")
+        self.assertEquals(deps, (["world", "hello"], [], []))
+        # Lists returned are copies:
+        deps[0].remove("hello")
+        self.assertEquals(self.toc.get_project_deps("hello"),
+                          (["world", "hello"], [], []))
+        self.assertEquals(self.toc.get_reverse_deps("world"),
+                          ["hello", "world"])
+        self.assertEquals(self.toc.get_reverse_deps("world", runtime=True),
+                          ["world"])
+        # Changing packages, then resetting the caches:
+        self.toc.packages = [self.world_package]
+        self.toc.reset_caches()
+        self.assertEquals(self.toc.get_project_deps("hello"),
+                          (["hello"], ["world"], []))
+        self.assertEquals(self.toc.get_reverse_deps("world"), ["world"])
+        # Same thing for active projects:
+        self.toc.active_projects = ["world", "hello"]
+        self.toc.reset_caches()
+        self.assertEquals(self.toc.get_project_deps("hello"),
+                          (["world", "hello"], [], []))
+        self.toc.active_projects.remove("world")
+        self.toc.reset_caches()
+        self.assertEquals(self.toc.get_project_deps("hello"),
+                          (["hello"], ["world"], []))
+        self.toc.packages.remove(self.world_package)
+        self.toc.reset_caches()
+        self.assertEquals(self.toc.get_project_deps("hello"),
+                          (["world", "hello"], [], []))
+        self.assertRaises(Exception, self.toc.get_project_deps, "spam")
+
+    def test_deps_graph(self):
+        spam_project = qibuild.project.Project("src/spam")
+        spam_project.name = "spam"
+        self.world_project.depends = ["spam"]
+        self.toc.projects = [self.hello_project, self.world_project, spam_project]
+        deps = self.toc.get_deps_graph(["spam", "world", "hello"])
+        self.assertEquals(deps["spam"], list())
+        self.assertEquals(deps["world"], ["spam"])
+        self.assertEquals(sorted(deps["hello"]), ["spam", "world"])
+        # A package in the middle does not break the chain:
+        world_package = qitoolchain.Package("world", "package/world")
+        world_package.depends = ["spam"]
+        self.toc.packages = [world_package]
+        deps = self.toc.get_deps_graph(["spam", "hello"])
+        self.assertEquals(deps["hello"], ["spam"])
+
     def test_custom_sdk_dir(self):
         dot_qi = os.path.join(self.tmp, ".qi")
         qibuild.sh.mkdir(dot_qi, recursive=True)
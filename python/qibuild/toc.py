@@ -12,6 +12,7 @@ import sys
 import glob
 import platform
 import signal
+import hashlib
 import operator
 
 from qibuild import ui
@@ -25,6 +26,11 @@ from qisrc.worktree import WorkTree
 from qibuild.command  import CommandFailedException
 from qibuild.dependencies_solver import DependenciesSolver
 
+# Variables of the build environment cmake reads when it looks for
+# compilers and tools, but whose changes it does not notice in an
+# existing build directory
+CONFIGURE_ENV_VARS = ["CC", "CXX", "CFLAGS", "CXXFLAGS", "CPPFLAGS",
+                      "LDFLAGS", "PATH", "INCLUDE", "LIB"]
 
 class TocException(Exception):
     """Custom exception.
@@ -160,6 +166,11 @@ class Toc:
         # List of objects of type qibuild.project.Project,
         # this is updated using WorkTree.buildable_projects
         self.projects          = list()
+        # name -> project, and the dependencies of every project,
+        # see reset_caches()
+        self._projects_by_name = None
+        self._deps = None
+        self._reverse_deps = None
 
         # The list of projects the user asked for from command
         # line.
@@ -258,7 +269,8 @@ You may want to run:
             # inside a full qibuild.project.Project object
             # (with CMake flags, build dir, et al.)
             project_path = worktree_project.path
-            qibuild_project = qibuild.project.Project(project_path)
+            qibuild_project = qibuild.project.Project(project_path,
+                                                      index=self.worktree.index)
             project_name = qibuild_project.name
             if project_name in seen:
                 mess  = "Found two qibuild projects with the same name (%s)\n" % qibuild_project.name
@@ -277,7 +289,19 @@ You may want to run:
             qibuild.project.update_project(project, self)
 
         self.projects.sort(key=operator.attrgetter('name'))
+        self.reset_caches()
 
+    def reset_caches(self):
+        """ Forget the name -> project index and the dependencies
+        of the projects.
+
+        Call this after changing self.projects, self.packages
+        or self.active_projects
+
+        """
+        self._projects_by_name = None
+        self._deps = None
+        self._reverse_deps = None
 
     def set_build_folder_name(self):
         """Get a reasonable build folder.
@@ -311,9 +335,11 @@ You may want to run:
         :raise: a TocException if the project was not found
 
         """
-        res = [p for p in self.projects if p.name == project_name]
-        if len(res) == 1:
-            return res[0]
+        if self._projects_by_name is None:
+            self._projects_by_name = dict((p.name, p) for p in self.projects)
+        res = self._projects_by_name.get(project_name)
+        if res:
+            return res
         if raises:
             raise TocException("No such project: %s" % project_name)
         else:
@@ -334,14 +360,12 @@ You may want to run:
         """
         dirs = list()
 
-        known_project_names = [p.name for p in self.projects]
-        if project_name not in known_project_names:
+        if not self.get_project(project_name, raises=False):
             raise TocException("%s is not a buildable project" % project_name)
 
         # Here do not honor self.solve_deps or the software won't compile :)
-        dep_solver = DependenciesSolver(projects=self.projects, packages=self.packages,
-            active_projects=self.active_projects)
-        (r_project_names, _package_names, not_found) = dep_solver.solve([project_name])
+        (r_project_names, _package_names, not_found) = \
+            self.get_project_deps(project_name)
 
         # Nothing to do with with the packages:
         # SDK dirs from toolchain are managed by the toolchain file in
@@ -366,6 +390,57 @@ You may want to run:
         return dirs
 
 
+    def get_project_deps(self, project_name, runtime=False):
+        """ Return the dependencies of a single project, as
+        a tuple (projects, packages, not_found), like
+        ``DependenciesSolver.solve([project_name])`` would.
+
+        The dependencies of every project are computed at once,
+        and kept until :py:meth:`reset_caches` is called
+
+        """
+        res = self._get_deps(runtime).get(project_name)
+        if res is None:
+            raise Exception("Unknown project: %s" % project_name)
+        # Callers are free to modify the lists they get:
+        (projects, packages, not_found) = res
+        return (projects[:], packages[:], not_found[:])
+
+    def get_reverse_deps(self, project_name, runtime=False):
+        """ Return the names of the projects for which
+        project_name is in the projects returned by
+        :py:meth:`get_project_deps`, including project_name itself
+
+        """
+        if self._reverse_deps is None:
+            self._reverse_deps = dict()
+        res = self._reverse_deps.get(runtime)
+        if res is None:
+            res = dict()
+            deps = self._get_deps(runtime)
+            for project in self.projects:
+                (dep_names, _, _) = deps[project.name]
+                for dep_name in dep_names:
+                    res.setdefault(dep_name, list()).append(project.name)
+            self._reverse_deps[runtime] = res
+        return res.get(project_name, list())[:]
+
+    def _get_deps(self, runtime):
+        """ Return a dict name -> (projects, packages, not_found)
+        for every project, computing the build and runtime
+        dependencies of all the projects if needed
+
+        """
+        if self._deps is None:
+            dep_solver = DependenciesSolver(projects=self.projects,
+                                            packages=self.packages,
+                                            active_projects=self.active_projects)
+            self._deps = {
+                False : dep_solver.solve_each(runtime=False),
+                True  : dep_solver.solve_each(runtime=True),
+            }
+        return self._deps[runtime]
+
     def resolve_deps(self, runtime=False):
         """ Return a tuple of three lists:
         (projects, packages, not_foud), see :py:mod:`qibuild.dependencies_solver`
@@ -400,10 +475,48 @@ You may want to run:
             return dep_solver.solve(self.active_projects,
                                     runtime=runtime)
 
+    def get_deps_graph(self, project_names, runtime=False):
+        """ Return a dict project name -> list of the names from
+        project_names it depends on, either directly or through
+        other projects or packages.
+
+        This tells which projects of a list returned by
+        :py:meth:`resolve_deps` can be built at the same time.
+
+        """
+        to_sort = dict()
+        for project in self.projects:
+            if runtime:
+                to_sort[project.name] = project.rdepends
+            else:
+                to_sort[project.name] = project.depends
+        for package in self.packages:
+            to_sort[package.name] = package.depends
+
+        wanted = set(project_names)
+        res = dict()
+        for project_name in project_names:
+            res[project_name] = list()
+            seen = set([project_name])
+            stack = list(to_sort.get(project_name, list()))
+            while stack:
+                name = stack.pop()
+                if name in seen:
+                    continue
+                seen.add(name)
+                if name in wanted:
+                    res[project_name].append(name)
+                stack.extend(to_sort.get(name, list()))
+        return res
+
     def configure_project(self, project, clean_first=True,
-                         debug_trycompile=False, profile=False):
+                         debug_trycompile=False, profile=False,
+                         log_file=None, force=False):
         """ Call cmake with correct options.
 
+        cmake is not called if nothing changed since the last
+        successful configure (see :py:meth:`get_configure_fingerprint`)
+
         :param clean_first: If False, do not delete CMake cache.
             This is mainly useful when you are calling cmake NOT from
             `qibuild configure`.
@@ -411,6 +524,11 @@ You may want to run:
             Useful when detecting compiler fails
         :param profile: If Ture, will run cmake --trace, and then
             generate some stats.
+        :param log_file: If given, write cmake output in this file
+            instead of the console.
+        :param force: If True, always call cmake
+
+        :return: False if cmake was not called because nothing changed
 
         """
         if not os.path.exists(project.directory):
@@ -442,6 +560,21 @@ You may want to run:
         if profile:
             cmake_args.append("--trace")
 
+        fingerprint_path = os.path.join(project.build_directory,
+                                        "qibuild-configure.sha1")
+        fingerprint = self.get_configure_fingerprint(project, cmake_args)
+        cmake_cache = os.path.join(project.build_directory, "CMakeCache.txt")
+        if not (force or debug_trycompile or profile) and \
+                os.path.exists(cmake_cache) and \
+                os.path.exists(fingerprint_path):
+            with open(fingerprint_path, "r") as fp:
+                if fp.read() == fingerprint:
+                    ui.debug("Nothing changed for", project.name,
+                             "skipping cmake")
+                    return False
+        # Only write the fingerprint back when cmake succeeds
+        qibuild.sh.rm(fingerprint_path)
+
         if "MinGW" in self.cmake_generator:
             paths = self.build_env["PATH"].split(os.pathsep)
             paths_withoutsh = list()
@@ -456,7 +589,8 @@ You may want to run:
                           cmake_args,
                           clean_first=clean_first,
                           env=self.build_env,
-                          profile=profile)
+                          profile=profile,
+                          log_file=log_file)
         except CommandFailedException, e:
             if e.returncode == -signal.SIGSEGV:
                 mess = "CMake crashed. "
@@ -465,6 +599,44 @@ You may want to run:
             else:
                 mess = None
             raise ConfigureFailed(project, message=mess)
+        with open(fingerprint_path, "w") as fp:
+            fp.write(fingerprint)
+        return True
+
+    def get_configure_fingerprint(self, project, cmake_args):
+        """ Get a hash of everything that can change the result
+        of calling cmake on the project, but that cmake can not
+        track by itself: the command line arguments (generator
+        and flags), the contents of the toolchain files, the
+        sdk dirs of the dependencies, the generated
+        dependencies.cmake, and the compilers, flags and paths
+        of the build environment (see :py:data:`CONFIGURE_ENV_VARS`)
+
+        Should be called after :py:func:`qibuild.project.bootstrap_project`
+
+        """
+        sha1 = hashlib.sha1()
+        def add(label, value):
+            sha1.update("%s:%i:%s\n" % (label, len(value), value))
+        def add_file(label, path):
+            if path and os.path.exists(path):
+                with open(path, "rb") as fp:
+                    add(label, fp.read())
+            else:
+                add(label, "")
+        for arg in cmake_args:
+            add("arg", arg)
+        if self.toolchain is not None:
+            add_file("toolchain", self.toolchain.toolchain_file)
+            for package in self.toolchain.packages:
+                add_file("package_toolchain", package.toolchain_file)
+        for sdk_dir in self.get_sdk_dirs(project.name):
+            add("sdk_dir", sdk_dir)
+        add_file("dependencies", os.path.join(project.build_directory,
+                                              "dependencies.cmake"))
+        for name in CONFIGURE_ENV_VARS:
+            add("env_" + name, self.build_env.get(name, ""))
+        return sha1.hexdigest()
 
 
     def build_project(self, project, incredibuild=False,
@@ -726,6 +898,7 @@ def toc_open(worktree_root, args=None, qibuild_cfg=None):
 
     (active_projects, single) =  _projects_from_args(toc, args)
     toc.active_projects = active_projects
+    toc.reset_caches()
     ui.debug("active projects: %s", ".".join(toc.active_projects))
     ui.debug("single: %s", str(single))
     toc.solve_deps = (not single)
@@ -5,6 +5,8 @@
 """Add a new project in a qisrc workspace """
 
 import qisrc.sync
+import qisrc.mirror
+import qisrc.parsers
 import qibuild
 
 
@@ -12,6 +14,7 @@ import qibuild
 def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
+    qisrc.parsers.clone_parser(parser)
     parser.add_argument("url",  metavar="URL", help="url of the project. "
         "right now only git URLs are supported")
     parser.add_argument("--src",
@@ -24,4 +27,7 @@ def do(args):
     worktree = qisrc.worktree.open_worktree(args.worktree)
     qisrc.sync.clone_project(worktree, args.url,
                              src=args.src,
-                             skip_if_exists=False)
+                             skip_if_exists=False,
+                             mirrors=qisrc.mirror.store_from_args(args),
+                             depth=args.depth,
+                             single_branch=args.single_branch)
@@ -10,12 +10,15 @@ Use -- to seprate qisrc arguments from the arguments of the command.
 """
 
 import qisrc
+import qisrc.foreach
+import qisrc.parsers
 import qibuild
 from qibuild import ui
 
 def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
+    qisrc.parsers.jobs_parser(parser)
     parser.add_argument("command", metavar="COMMAND", nargs="+")
     parser.add_argument("--ignore-errors", "--continue",
         action="store_true", help="continue on error")
@@ -25,20 +28,26 @@ def do(args):
     qiwt = qisrc.open_worktree(args.worktree)
     errors = list()
     ui.info(ui.green, "Running `%s` on every project" % " ".join(args.command))
-    c = 0
-    count = len(qiwt.git_projects)
-    for project in qiwt.git_projects:
-        c += 1
-        command = args.command[:]
-        ui.info(ui.green, "*", ui.reset, "(%d/%d)" % (c, count), ui.blue, project.src)
-        try:
-            qibuild.command.call(command, cwd=project.path)
-        except qibuild.command.CommandFailedException:
-            if args.ignore_errors:
-                errors.append(project)
-                continue
-            else:
-                raise
+    if args.num_jobs > 1:
+        # The output of each command goes to .qi/foreach/<project>.log
+        errors = qisrc.foreach.foreach(qiwt, qiwt.git_projects, args.command,
+                                       num_jobs=args.num_jobs,
+                                       ignore_errors=args.ignore_errors)
+    else:
+        c = 0
+        count = len(qiwt.git_projects)
+        for project in qiwt.git_projects:
+            c += 1
+            command = args.command[:]
+            ui.info(ui.green, "*", ui.reset, "(%d/%d)" % (c, count), ui.blue, project.src)
+            try:
+                qibuild.command.call(command, cwd=project.path)
+            except qibuild.command.CommandFailedException:
+                if args.ignore_errors:
+                    errors.append(project)
+                    continue
+                else:
+                    raise
     if not errors:
         return
     ui.error("Command failed on the following projects:")
@@ -11,33 +11,62 @@ Options are the same as in git grep, e.g.:
 """
 
 import sys
-import qibuild.log
 
 import qisrc
+import qisrc.parsers
 import qibuild
+import qibuild.parallel
 
 def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
+    qisrc.parsers.jobs_parser(parser)
+    parser.add_argument("--ordered", action="store_true",
+        help="with -j, display the results in the order of the projects, "
+             "instead of as soon as they are available")
     parser.add_argument("git_grep_opts", metavar="-- git grep options", nargs="*",
                         help="git grep options preceeded with -- to escape the leading '-'")
     parser.add_argument("pattern", metavar="PATTERN",
                         help="pattern to be matched")
+    parser.set_defaults(ordered=False)
 
 def do(args):
     """ Main entry point """
     qiwt = qisrc.open_worktree(args.worktree)
     git_grep_opts = args.git_grep_opts
     git_grep_opts.append(args.pattern)
-    logger = qibuild.log.get_logger(__name__)
-    retcode = 0
-    for project in qiwt.git_projects:
+    git_projects = qiwt.git_projects
+
+    def grep(project):
+        git = qisrc.git.Git(project.path)
+        return git.call("grep", *git_grep_opts, raises=False)
+
+    # The output of each project is displayed in one block,
+    # so that the lines of several projects never mix
+    results = dict()
+    to_display = [0]
+    retcode = [0]
+    def display(project, res):
+        (status, out) = res
         qibuild.ui.info(qibuild.ui.green,
                         "Looking in", project.src, "...",
                         qibuild.ui.reset)
-        git = qisrc.git.Git(project.path)
-        (status, out) = git.call("grep", *git_grep_opts, raises=False)
         print out
         if status != 0:
-            retcode = 1
-    sys.exit(retcode)
+            retcode[0] = 1
+
+    def on_done(project, res):
+        if not args.ordered:
+            display(project, res)
+            return
+        results[project.src] = res
+        while to_display[0] < len(git_projects):
+            next_project = git_projects[to_display[0]]
+            if next_project.src not in results:
+                break
+            display(next_project, results.pop(next_project.src))
+            to_display[0] += 1
+
+    qibuild.parallel.run_parallel(git_projects, grep,
+        num_jobs=args.num_jobs, on_done=on_done)
+    sys.exit(retcode[0])
@@ -8,10 +8,14 @@ import os
 
 import qibuild
 import qisrc
+import qisrc.mirror
+import qisrc.parsers
+import qisrc.sync
 
 def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
+    qisrc.parsers.clone_parser(parser)
     parser.add_argument("manifest_url", nargs="?")
     parser.add_argument("manifest_name", nargs="?",
         help="Name of the manifest. Useful if you have several manifests")
@@ -42,6 +46,7 @@ def do(args):
     if not manifest_url:
         return worktree
     manifest_is_a_regular_file = False
+    mirrors = qisrc.mirror.store_from_args(args)
     qibuild.ui.info(qibuild.ui.green, "initializing worktree:",
                     qibuild.ui.blue, worktree_root,
                     qibuild.ui.green, "using profile:",
@@ -52,8 +57,10 @@ def do(args):
     else:
         manifest = qisrc.sync.fetch_manifest(worktree,
             manifest_url, branch=branch, src=manifest_src,
-            profile=args.profile)
-    qisrc.sync.init_worktree(worktree, manifest, setup_review=args.setup_review)
+            profile=args.profile, mirrors=mirrors)
+    qisrc.sync.init_worktree(worktree, manifest, setup_review=args.setup_review,
+                             mirrors=mirrors, depth=args.depth,
+                             single_branch=args.single_branch)
     if not manifest_is_a_regular_file:
         worktree.set_manifest_project(manifest_src, args.profile)
     return worktree
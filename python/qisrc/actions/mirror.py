@@ -0,0 +1,46 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Create or update the shared git mirrors
+
+Without any url, every existing mirror is updated.
+The mirrors are used by ``qisrc init --mirror``,
+``qisrc add --mirror`` and ``qisrc sync --mirror``
+
+"""
+
+import sys
+
+import qibuild
+import qisrc.mirror
+import qisrc.parsers
+from qibuild import ui
+
+
+def configure_parser(parser):
+    """Configure parser for this action """
+    qibuild.parsers.default_parser(parser)
+    qisrc.parsers.jobs_parser(parser)
+    parser.add_argument("urls", metavar="URL", nargs="*",
+        help="url of a git repository to mirror")
+    parser.add_argument("--mirror-dir", dest="mirror_dir",
+        help="Where the git mirrors are. Default: ~/.cache/qi/git")
+
+def do(args):
+    """Main entry point"""
+    store = qisrc.mirror.MirrorStore(args.mirror_dir)
+    urls = args.urls or None
+    if urls is None and not store.get_urls():
+        ui.info("No mirror in", store.root)
+        return
+    errors = store.update_mirrors(urls, num_jobs=args.num_jobs)
+    if not errors:
+        return
+    print
+    ui.error("Fail to update some mirrors")
+    for (url, err) in errors:
+        ui.info(ui.blue, url)
+        print "-" * len(url)
+        print err
+    sys.exit(1)
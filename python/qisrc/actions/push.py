@@ -10,6 +10,7 @@ import sys
 from qibuild import ui
 import qibuild
 import qisrc
+import qisrc.review
 
 def configure_parser(parser):
     """Configure parser for this action """
@@ -7,16 +7,20 @@
 
 import os
 import sys
+import operator
 import qibuild.log
 
 import qibuild
+import qibuild.parallel
 import qisrc
+import qisrc.parsers
 
 LOGGER = qibuild.log.get_logger("qisrc.status")
 
 def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
+    qisrc.parsers.jobs_parser(parser)
     parser.add_argument("--untracked-files", "-u",
         dest="untracked_files",
         action="store_true",
@@ -44,17 +48,6 @@ def _pad(szold, sznew):
         return ""
     return " " * (szold - sznew)
 
-def stat_tracking_remote(git, branch, tracking):
-    behind = 0
-    ahead = 0
-    (ret, out) = git.call("rev-list", "--left-right", "%s..%s" % (tracking, branch), raises=False)
-    if ret == 0:
-        ahead = len(out.split())
-    (ret, out) = git.call("rev-list", "--left-right", "%s..%s" % (branch, tracking), raises=False)
-    if ret == 0:
-        behind = len(out.split())
-    return (ahead, behind)
-
 def do(args):
     """ Main method """
     qiwt = qisrc.open_worktree(args.worktree)
@@ -65,67 +58,69 @@ def do(args):
     git_projects = qiwt.git_projects
     manifests = qiwt.get_manifest_projects()
     git_projects = list(set(git_projects) - set(manifests))
+    git_projects.sort(key=operator.attrgetter("src"))
 
     sz = len(git_projects)
-    i = 1
-    oldsz = 0
-    incorrect_projs = list()
-    for git_project in git_projects:
-        git = qisrc.git.open(git_project.path)
+    progress = dict(done=0, oldsz=0)
+    def show_progress(git_project, status_):
+        progress["done"] += 1
+        i = progress["done"]
         if sys.stdout.isatty():
             src = git_project.src
             to_write = "checking (%d/%d)" % (i, sz)
             to_write += src
-            to_write += _pad(oldsz, len(src))
+            to_write += _pad(progress["oldsz"], len(src))
             sys.stdout.write(to_write + "\r")
             sys.stdout.flush()
-            oldsz = len(src)
+            progress["oldsz"] = len(src)
             if i == sz:
-                print "checking (%d/%d): done" % (i, sz), _pad(oldsz, 2)
-        i = i + 1
-        if git.is_valid():
-            clean = git.is_clean(untracked=args.untracked_files)
-
-            #clean worktree, but is the current branch sync with the remote one?
-            if clean:
-                branch = git.get_current_branch()
-                if branch != git_project.branch:
-                    incorrect_projs.append((git_project.src, branch, git_project.branch))
-                    incorrect.append(git_project)
-                tracking = git.get_tracking_branch()
-                (ahead, behind) = stat_tracking_remote(git, branch, tracking)
-                if ahead != 0 or behind != 0:
-                    clean = False
-
-            if args.show_branch or not clean:
-                gitrepo.append(git_project)
-            if not clean:
-                dirty.append(git_project)
+                print "checking (%d/%d): done" % (i, sz), _pad(progress["oldsz"], 2)
+
+    def get_status(git_project):
+        git = qisrc.git.open(git_project.path)
+        return git.get_status(untracked=args.untracked_files)
+
+    # One git process per project, run in a pool
+    statuses = qibuild.parallel.run_parallel(git_projects, get_status,
+        num_jobs=args.num_jobs, on_done=show_progress)
+    statuses = dict(zip(git_projects, statuses))
+
+    incorrect_projs = list()
+    for git_project in git_projects:
+        status = statuses[git_project]
+        if status is None:
+            continue
+        clean = status.clean
+
+        #clean worktree, but is the current branch sync with the remote one?
+        if clean:
+            if status.branch != git_project.branch:
+                incorrect_projs.append((git_project.src, status.branch, git_project.branch))
+                incorrect.append(git_project)
+            if status.ahead != 0 or status.behind != 0:
+                clean = False
+
+        if args.show_branch or not clean:
+            gitrepo.append(git_project)
+        if not clean:
+            dirty.append(git_project)
 
     LOGGER.info("Dirty projects: %d/%d", len(dirty), len(git_projects))
 
     max_len = _max_len(qiwt.root, gitrepo)
     for git_project in gitrepo:
-        git = qisrc.git.open(git_project.path)
+        status = statuses[git_project]
         shortpath = os.path.relpath(git_project.path, qiwt.root)
-        if git.is_valid():
-            branch = git.get_current_branch()
-            tracking = git.get_tracking_branch()
-            line = _add_pad(max_len, shortpath, " : %s tracking %s" %
-                (branch, tracking))
-            (ahead, behind) = stat_tracking_remote(git, branch, tracking)
-            LOGGER.info(line)
-            if ahead:
-                print(" ## Your branch is %d commits ahead" % ahead)
-            if behind:
-                print(" ## Your branch is %d commits behind" % behind)
-
-        if not git.is_clean(untracked=args.untracked_files):
-            if args.untracked_files:
-                (status_, out) = git.call("status", "-s", raises=False)
-            else:
-                (status_, out) = git.call("status", "-suno", raises=False)
-            nlines = [ x[:3] + shortpath + "/" + x[3:] for x in out.splitlines() if len(x.strip()) > 0 ]
+        line = _add_pad(max_len, shortpath, " : %s tracking %s" %
+            (status.branch, status.tracking))
+        LOGGER.info(line)
+        if status.ahead:
+            print(" ## Your branch is %d commits ahead" % status.ahead)
+        if status.behind:
+            print(" ## Your branch is %d commits behind" % status.behind)
+
+        if status.changes:
+            nlines = [ x[:3] + shortpath + "/" + x[3:] for x in status.changes ]
             print "\n".join(nlines)
 
     max_len = _max_len(qiwt.root, incorrect)
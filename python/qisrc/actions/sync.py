@@ -16,6 +16,10 @@ import qibuild.log
 
 import qisrc
 import qisrc.cmdparse
+import qisrc.manifest
+import qisrc.mirror
+import qisrc.parsers
+import qisrc.sync
 import qibuild
 from qibuild import ui
 
@@ -24,6 +28,8 @@ def configure_parser(parser):
     """Configure parser for this action """
     qibuild.parsers.worktree_parser(parser)
     qibuild.parsers.project_parser(parser)
+    qisrc.parsers.jobs_parser(parser)
+    qisrc.parsers.clone_parser(parser)
     parser.add_argument("--no-review", dest="setup_review", action="store_false",
         help="Do not setup projects for review")
     parser.set_defaults(setup_review=True)
@@ -34,7 +40,7 @@ def indent(text, num):
     lines = [" " * num + l for l in lines]
     return "\n".join(lines)
 
-def sync_all(worktree, args):
+def sync_all(worktree, args, fetch_plan=None):
     """ Fetch any manifest project, re init everything,
     re-create branch configurations, review setup and so on
 
@@ -49,7 +55,12 @@ def sync_all(worktree, args):
         git.pull(quiet=True)
         manifest_filename = manifest_project.profile + ".xml"
         manifest_xml = os.path.join(manifest_project.path, manifest_filename)
-        qisrc.sync.init_worktree(worktree, manifest_xml, setup_review=args.setup_review)
+        qisrc.sync.init_worktree(worktree, manifest_xml,
+                                 setup_review=args.setup_review,
+                                 fetch_plan=fetch_plan,
+                                 mirrors=qisrc.mirror.store_from_args(args),
+                                 depth=args.depth,
+                                 single_branch=args.single_branch)
 
 
 def do(args):
@@ -57,33 +68,23 @@ def do(args):
     worktree = qisrc.open_worktree(args.worktree)
     projects = qisrc.cmdparse.projects_from_args(args)
 
-    should_fetch_first = True
+    # Used to fetch each remote only once during the sync
+    fetch_plan = qisrc.sync.FetchPlan()
     if len(projects) == len(worktree.projects):
-        sync_all(worktree, args)
-        should_fetch_first = False
+        sync_all(worktree, args, fetch_plan=fetch_plan)
 
     git_projects = set()
     for project in projects:
         if project.git_project and not project.manifest:
             git_projects.add(project.git_project)
 
-    ui.info(ui.green, "Synchronizing projects ...")
     git_projects = list(git_projects)
     git_projects.sort(key = operator.attrgetter("src"))
-    errors = list()
-    project_count = len(git_projects)
-    for i, project in enumerate(git_projects):
-        if project_count != 1:
-            ui.info(
-                ui.green, "*", ui.reset, "(%2i/%2i)" %  (i+1, project_count),
-                ui.blue, project.src)
-        else:
-            ui.info(ui.bold, "Pulling", ui.blue, project.src)
-        git = qisrc.git.open(project.path)
-        error = git.update_branch(project.branch, project.remote,
-                                 fetch_first=True)
-        if error:
-            errors.append((project.src, error))
+    errors = qisrc.sync.sync_projects(git_projects, num_jobs=args.num_jobs,
+                                      fetch_plan=fetch_plan)
+    if fetch_plan.saved:
+        ui.info(ui.green, "Skipped", fetch_plan.saved,
+                "redundant fetches")
     if not errors:
         return
     print
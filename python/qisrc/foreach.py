@@ -0,0 +1,86 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Run the same command on several projects at the same time.
+
+Used by ``qisrc foreach -j`` and ``qibuild foreach -j``
+
+"""
+
+import os
+
+import qibuild.sh
+import qibuild.command
+import qibuild.parallel
+from qibuild import ui
+
+
+def get_log_file(worktree, project):
+    """ Where the output of the command run in the project goes
+
+    The log files follow the layout of the worktree, so that each
+    project gets its own
+
+    """
+    log_name = os.path.join(*project.src.split("/")) + ".log"
+    return os.path.join(worktree.root, ".qi", "foreach", log_name)
+
+
+def foreach(worktree, projects, command, num_jobs=1, ignore_errors=False):
+    """ Run the command in each project, running at most num_jobs
+    commands at the same time.
+
+    The output of each command goes to a log file in .qi/foreach,
+    and a line is displayed each time a command is over.
+
+    :param ignore_errors: if False, no new command is started
+        after the first failure, and the
+        :py:class:`qibuild.command.CommandFailedException` is re-raised
+        once the running commands are over.
+
+    :return: the list of the projects where the command failed
+
+    """
+    for project in projects:
+        log_dir = os.path.dirname(get_log_file(worktree, project))
+        qibuild.sh.mkdir(log_dir, recursive=True)
+    count = len(projects)
+    done = list()
+    errors = list()
+    # The first exception, re-raised at the end
+    # when errors are not ignored
+    failures = list()
+
+    def run(project):
+        if failures and not ignore_errors:
+            # Do not start anything new
+            return None
+        log_file = get_log_file(worktree, project)
+        try:
+            qibuild.command.call(command[:], cwd=project.path,
+                                 log_file=log_file)
+        except qibuild.command.CommandFailedException, e:
+            failures.append(e)
+            return False
+        return True
+
+    def show_progress(project, ok):
+        if ok is None:
+            return
+        done.append(project)
+        if ok:
+            status = [ui.green, "[OK]"]
+        else:
+            errors.append(project)
+            status = [ui.red, "[FAILED]", ui.reset,
+                      "see", get_log_file(worktree, project)]
+        summary = "(%i/%i, %i failed)" % (len(done), count, len(errors))
+        ui.info(*([ui.green, "*", ui.reset, summary,
+                  ui.blue, project.src] + status))
+
+    qibuild.parallel.run_parallel(projects, run, num_jobs=num_jobs,
+                                  on_done=show_progress)
+    if failures and not ignore_errors:
+        raise failures[0]
+    return errors
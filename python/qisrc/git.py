@@ -6,11 +6,13 @@
 
 """
 import os
+import re
 import contextlib
 import subprocess
 
 from qibuild import ui
 import qibuild.config
+import qisrc.gitdir
 
 class Git:
     """ The Git represent a git tree """
@@ -60,6 +62,11 @@ class Git:
         Return None if not found
 
         """
+        git_dir = qisrc.gitdir.open_git_dir(self.repo)
+        if git_dir:
+            value = git_dir.get_config(name)
+            if value is not qisrc.gitdir.UNKNOWN:
+                return value
         (status, out) = self.call("config", "--get", name,
             raises=False)
         if status != 0:
@@ -77,6 +84,12 @@ class Git:
         git symbolic-ref HEAD
         else: git name-rev --name-only --always HEAD
         """
+        if ref == "HEAD":
+            git_dir = qisrc.gitdir.open_git_dir(self.repo)
+            if git_dir:
+                head = git_dir.get_head()
+                if head is not qisrc.gitdir.UNKNOWN:
+                    return head
         (status, out) = self.call("symbolic-ref", ref, raises=False)
         lines = out.splitlines()
         if len(lines) < 1:
@@ -156,6 +169,11 @@ class Git:
         master -> tracking branch
 
         """
+        git_dir = qisrc.gitdir.open_git_dir(self.repo)
+        if git_dir:
+            branches = git_dir.get_local_branches()
+            if branches is not qisrc.gitdir.UNKNOWN:
+                return branches
         (status, out) = self.call("branch", "--no-color", raises=False)
         if status != 0:
             mess  = "Could not get the list of local branches\n"
@@ -173,6 +191,18 @@ class Git:
         (status, out) = self.call("show-ref", "--quiet", raises=False)
         return status == 0
 
+    def is_shallow(self):
+        """ Check if the repository has been cloned or
+        fetched with a limited depth
+
+        """
+        git_dir = qisrc.gitdir.open_git_dir(self.repo)
+        if git_dir:
+            return os.path.exists(os.path.join(git_dir.git_dir, "shallow"))
+        (status, out) = self.call("rev-parse", "--is-shallow-repository",
+                                  raises=False)
+        return status == 0 and out.strip() == "true"
+
     def is_clean(self, untracked=True):
         """
         Returns true if working dir is clean.
@@ -189,6 +219,25 @@ class Git:
             return False
         return True
 
+    def get_status(self, untracked=True):
+        """ Get the branch, the tracking branch, the number of commits
+        ahead and behind, and the local changes with only one call
+        to ``git status --porcelain --branch``
+
+        :param untracked: also list untracked files in the changes
+
+        :return: a :py:class:`RepoStatus`, or None if the repository
+            is not valid or has no commits yet
+
+        """
+        args = ["status", "--porcelain", "--branch"]
+        if not untracked:
+            args.append("--untracked-files=no")
+        (status, out) = self.call(*args, raises=False)
+        if status != 0:
+            return None
+        return parse_status(out)
+
     def set_remote(self, name, url):
         """
         Set a new remote with the given name and url
@@ -201,7 +250,8 @@ class Git:
         self.call("remote", "rm",  name, quiet=True, raises=False)
         self.call("remote", "add", name, url, quiet=True)
 
-    def set_tracking_branch(self, branch, remote_name, fetch_first=True, remote_branch=None):
+    def set_tracking_branch(self, branch, remote_name, fetch_first=True, remote_branch=None,
+                            fetch_plan=None):
         """
         Create a or update the configuration of a branch to track
         a given remote branch
@@ -212,6 +262,8 @@ class Git:
             will be the same of the branch name
         :param fetch_first: if you know you just have fetched, (such as when running
             qisrc sync -a), set this to ``False`` to save some time
+        :param fetch_plan: a :py:class:`qisrc.sync.FetchPlan`, used
+            to skip the fetch if the remote has already been fetched
 
         """
         if remote_branch is None:
@@ -228,12 +280,28 @@ class Git:
 
         if fetch_first:
             # Fetch just in case the branch just has been created
-            self.call("fetch", remote_name, quiet=True)
+            if fetch_plan:
+                fetch_plan.fetch(self, remote_name, quiet=True)
+            else:
+                self.call("fetch", remote_name, quiet=True)
+
+        # A single-branch clone only fetches the branch it was cloned
+        # with: start fetching this one too
+        (status, out) = self.call("rev-parse", "--verify", "--quiet",
+                                  "refs/remotes/%s" % remote_ref, raises=False)
+        if status != 0:
+            self.call("remote", "set-branches", "--add", remote_name,
+                      remote_branch, quiet=True)
+            refspec = "refs/heads/%s:refs/remotes/%s" % (remote_branch, remote_ref)
+            if self.is_shallow():
+                self.call("fetch", "--depth=1", remote_name, refspec, quiet=True)
+            else:
+                self.call("fetch", remote_name, refspec, quiet=True)
 
         # If the branch does not exist yet, create it at the right commit
         if not branch in self.get_local_branches():
             self.call("branch", branch, remote_ref, quiet=True)
-        self.call("branch", "--set-upstream", branch, remote_ref, quiet=True)
+        self.call("branch", "--set-upstream-to=%s" % remote_ref, branch, quiet=True)
 
     def update_branch(self, *args, **kwargs):
         """ Update the given branch to match the given remote branch
@@ -276,7 +344,10 @@ def _update_branch(git, branch, remote_name,
         remote_branch = branch
     remote_ref = "%s/%s" % (remote_name, remote_branch)
     if current_branch != branch:
-        _update_branch_if_ff(git, status, branch, remote_ref)
+        _update_branch_if_ff(git, status, branch, remote_name, remote_ref)
+        return status.mess
+    _deepen_to_merge_base(git, status, remote_name, branch, remote_ref)
+    if status.mess:
         return status.mess
     with _stash_changes(git, status):
         # _stash_changes can fail if we think the repo is clean,
@@ -306,9 +377,112 @@ def _update_branch(git, branch, remote_name,
             status.mess += out
     return status.mess
 
+class RepoStatus:
+    """ The state of a repository, see :py:meth:`Git.get_status`
+
+    """
+    def __init__(self):
+        # None when not on any branch
+        self.branch = None
+        # For instance "origin/master", None if there is no tracking branch
+        self.tracking = None
+        self.ahead = 0
+        self.behind = 0
+        # The lines of `git status --short`
+        self.changes = list()
+
+    @property
+    def clean(self):
+        """ True if there are no local changes """
+        return not self.changes
+
+
+_STATUS_BRANCH_RE = re.compile(r"""
+    ^(?P<branch>\S+?)
+    (\.\.\.(?P<tracking>\S+))?
+    (\s\[(?P<info>.*)\])?$""", re.VERBOSE)
+
+def parse_status(out):
+    """ Parse the output of ``git status --porcelain --branch``
+
+    >>> status = parse_status("## master...origin/master [ahead 1, behind 2]\\n M README")
+    >>> (status.branch, status.tracking, status.ahead, status.behind)
+    ('master', 'origin/master', 1, 2)
+    >>> status.changes
+    [' M README']
+
+    :return: a :py:class:`RepoStatus`, or None if there
+        are no commits yet
+
+    """
+    res = RepoStatus()
+    lines = out.splitlines()
+    for line in lines:
+        if not line.startswith("## "):
+            if line.strip():
+                res.changes.append(line)
+            continue
+        header = line[3:]
+        if header.startswith(("Initial commit on ", "No commits yet on ")):
+            return None
+        if header.startswith("HEAD (no branch)"):
+            continue
+        match = _STATUS_BRANCH_RE.match(header)
+        if not match:
+            continue
+        res.branch = match.group("branch")
+        res.tracking = match.group("tracking")
+        info = match.group("info")
+        if not info:
+            continue
+        for word in info.split(","):
+            word = word.split()
+            if len(word) != 2:
+                continue
+            if word[0] == "ahead":
+                res.ahead = int(word[1])
+            elif word[0] == "behind":
+                res.behind = int(word[1])
+    return res
+
+
 ###
 # Internal functions used by _update_branch()
 
+# How many commits to fetch the first time more history
+# is needed. Doubled each time it is not enough
+_DEEPEN_STEP = 50
+# Fetch the whole history instead after that many tries
+_DEEPEN_TRIES = 5
+
+def _deepen_to_merge_base(git, status, remote_name, local_ref, remote_ref):
+    """ In a shallow repository, the common ancestor of the local
+    and the remote branch may not have been fetched, and then
+    neither rebase nor merge can work: fetch more and more history
+    until it is found, or until the repository is no longer shallow
+
+    """
+    depth = _DEEPEN_STEP
+    for i in range(_DEEPEN_TRIES + 1):
+        if not git.is_shallow():
+            return
+        (ret, _) = git.call("merge-base", local_ref, remote_ref, raises=False)
+        if ret == 0:
+            return
+        if i == _DEEPEN_TRIES:
+            print "Fetching the whole history of %s ..." % remote_name
+            (ret, out) = git.call("fetch", "--unshallow", remote_name,
+                                  raises=False)
+        else:
+            print "Fetching %i more commits from %s ..." % (depth, remote_name)
+            (ret, out) = git.call("fetch", "--deepen=%i" % depth, remote_name,
+                                  raises=False)
+        if ret != 0:
+            status.mess += "Fetching more history failed\n"
+            status.mess += out
+            return
+        depth *= 2
+
 @contextlib.contextmanager
 def _stash_changes(git, status):
     """ Stash changes. To be used in a 'with' statement """
@@ -346,7 +520,7 @@ def _change_branch(git, status, branch):
             status.mess += "Checkout back to %s failed\n" % current_branch
             status.mess += out
 
-def _update_branch_if_ff(git, status, local_branch, remote_ref):
+def _update_branch_if_ff(git, status, local_branch, remote_name, remote_ref):
     """ Update a local branch with a remote branch if the
     merge is fast-forward
 
@@ -368,6 +542,9 @@ def _update_branch_if_ff(git, status, local_branch, remote_ref):
         return
 
     remote_sha1 = out.split()[0]
+    _deepen_to_merge_base(git, status, remote_name, local_sha1, remote_sha1)
+    if status.mess:
+        return
     (retcode, out) = git.call("merge-base", local_sha1, remote_sha1,
                                raises=False)
     if retcode != 0:
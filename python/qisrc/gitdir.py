@@ -0,0 +1,382 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Read refs and config values straight from the files of
+a .git directory, without running git.
+
+This is only meant to answer the simple questions
+:py:class:`qisrc.git.Git` asks all the time (what is the current
+branch, what is the value of this config key ...). Anything unusual
+(a .git file instead of a directory, includes in the config file,
+config given in the environment, a repository format or a ref storage
+other than the plain files ...) is reported as :py:data:`UNKNOWN`
+so that the caller can ask git instead.
+
+The parsed files are cached, and read again only when their
+inode, size or modification time change.
+
+"""
+
+import os
+import re
+import threading
+
+# Returned when the answer has to come from git itself
+UNKNOWN = object()
+
+# Environment variables changing where git reads things from
+_UNSUPPORTED_ENV = ["GIT_DIR", "GIT_WORK_TREE", "GIT_COMMON_DIR",
+                    "GIT_CONFIG", "GIT_CONFIG_PARAMETERS"]
+
+# Sections that only make sense in the config of a repository:
+# when a key is not there, there is no need to look in the
+# global configuration
+_LOCAL_SECTIONS = ["branch", "remote"]
+
+# Repository extensions that do not change where and how refs
+# and config are stored. (extensions.refstorage is also fine
+# when it is "files")
+_SUPPORTED_EXTENSIONS = ["noop", "objectformat", "partialclone",
+                         "preciousobjects"]
+
+_SECTION_RE = re.compile(r"""
+    ^\s*\[\s*
+    (?P<section>[A-Za-z0-9.-]+)
+    (\s+"(?P<subsection>([^"\\]|\\.)*)")?
+    \s*\]\s*([;#].*)?$""", re.VERBOSE)
+
+_VARIABLE_RE = re.compile(r"^\s*(?P<name>[A-Za-z][A-Za-z0-9-]*)\s*(?P<equal>=?)(?P<value>.*)$")
+
+_ESCAPES = {
+    "n"  : "\n",
+    "t"  : "\t",
+    "b"  : "\b",
+    '"'  : '"',
+    "\\" : "\\",
+}
+
+class ParseError(Exception):
+    """ Raised when a config file uses a syntax we do not handle """
+    pass
+
+
+def _stamp(path):
+    """ What we use to know if a file has changed.
+    Git always writes a new file and renames it,
+    so the inode changes even if size and mtime do not
+
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+def parse_value(text):
+    """ Parse the value of a config variable: handle quotes,
+    escapes, comments and surrounding whitespace
+
+    >>> parse_value(' "a ; b" c # comment')
+    'a ; b c'
+
+    """
+    res = list()
+    in_quote = False
+    # Whitespace at the end is removed, unless it was quoted
+    keep = 0
+    i = 0
+    text = text.lstrip()
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            i += 1
+            if i == len(text) or text[i] not in _ESCAPES:
+                raise ParseError("Invalid escape in %s" % text)
+            res.append(_ESCAPES[text[i]])
+            keep = len(res)
+        elif char == '"':
+            in_quote = not in_quote
+            keep = len(res)
+        elif char in ";#" and not in_quote:
+            break
+        else:
+            res.append(char)
+            if in_quote or not char.isspace():
+                keep = len(res)
+        i += 1
+    if in_quote:
+        raise ParseError("Unbalanced quotes in %s" % text)
+    return "".join(res[:keep])
+
+
+def parse_config(path):
+    """ Parse a git config file.
+
+    :return: a dict key -> list of values, where key is
+        section.[subsection.]name, with section and name in lower case.
+        A value is None when the variable has no '=' sign.
+
+    :raise: ParseError if the file uses something we do not
+        handle, such as includes
+
+    """
+    res = dict()
+    with open(path, "r") as fp:
+        lines = fp.read().splitlines()
+    prefix = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        stripped = line.strip()
+        if not stripped or stripped[0] in ";#":
+            continue
+        if stripped.startswith("["):
+            match = _SECTION_RE.match(line)
+            if not match:
+                raise ParseError("Could not parse: %s" % line)
+            section = match.group("section").lower()
+            subsection = match.group("subsection")
+            if section in ("include", "includeif") or \
+                    section.startswith("includeif"):
+                raise ParseError("includes are not supported")
+            if subsection is not None:
+                subsection = re.sub(r"\\(.)", r"\1", subsection)
+                prefix = "%s.%s" % (section, subsection)
+            else:
+                prefix = section
+            continue
+        match = _VARIABLE_RE.match(line)
+        if not match or prefix is None:
+            raise ParseError("Could not parse: %s" % line)
+        key = "%s.%s" % (prefix, match.group("name").lower())
+        if not match.group("equal"):
+            if match.group("value").strip() and \
+                    match.group("value").strip()[0] not in ";#":
+                raise ParseError("Could not parse: %s" % line)
+            value = None
+        else:
+            text = match.group("value")
+            # Handle line continuations
+            while text.endswith("\\") and \
+                    (len(text) - len(text.rstrip("\\"))) % 2 == 1:
+                if i == len(lines):
+                    raise ParseError("Unfinished line: %s" % line)
+                text = text[:-1] + lines[i]
+                i += 1
+            value = parse_value(text)
+        res.setdefault(key, list()).append(value)
+    return res
+
+
+def _normalize_key(name):
+    """ Lower the case of the section and of the
+    variable name, but not of the subsection
+
+    """
+    parts = name.split(".")
+    if len(parts) < 2:
+        return None
+    parts[0] = parts[0].lower()
+    parts[-1] = parts[-1].lower()
+    return ".".join(parts)
+
+
+def _env_config():
+    """ Config set with GIT_CONFIG_COUNT, GIT_CONFIG_KEY_<n>
+    and GIT_CONFIG_VALUE_<n>. They win over every file.
+
+    """
+    res = dict()
+    try:
+        count = int(os.environ.get("GIT_CONFIG_COUNT", "0"))
+    except ValueError:
+        return None
+    for i in range(count):
+        key = os.environ.get("GIT_CONFIG_KEY_%i" % i)
+        value = os.environ.get("GIT_CONFIG_VALUE_%i" % i)
+        if key is None or value is None:
+            return None
+        res[_normalize_key(key)] = value
+    return res
+
+
+class GitDir:
+    """ Read the files of a .git directory.
+
+    Use :py:func:`open_git_dir` to get one.
+
+    """
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self._lock = threading.Lock()
+        # path -> (stamp, parsed contents)
+        self._cache = dict()
+
+    def _cached(self, path, parse):
+        """ Return parse(path), calling it again only if
+        the file has changed.
+
+        """
+        stamp = _stamp(path)
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry and entry[0] == stamp:
+                return entry[1]
+        if stamp is None:
+            res = None
+        else:
+            res = parse(path)
+        with self._lock:
+            self._cache[path] = (stamp, res)
+        return res
+
+    def get_head(self):
+        """ Get the contents of HEAD.
+
+        :return: the name of the ref HEAD points to (for instance
+            refs/heads/master), None if HEAD is detached, or UNKNOWN
+
+        """
+        def parse(path):
+            with open(path, "r") as fp:
+                return fp.read().strip()
+        head = self._cached(os.path.join(self.git_dir, "HEAD"), parse)
+        if head is None:
+            return UNKNOWN
+        if head.startswith("ref:"):
+            return head[4:].strip()
+        if re.match("^[0-9a-f]{40}$", head):
+            return None
+        return UNKNOWN
+
+    def _read_config(self):
+        """ Return the parsed config file of the repository,
+        or UNKNOWN
+
+        """
+        def parse(path):
+            try:
+                return parse_config(path)
+            except ParseError:
+                return UNKNOWN
+        config = self._cached(os.path.join(self.git_dir, "config"), parse)
+        if config is None:
+            return UNKNOWN
+        return config
+
+    def is_supported(self):
+        """ Whether the repository format is one we know how to
+        read: version 0 or 1, with refs stored in plain files, and
+        no extension changing where the config is read from
+
+        """
+        config = self._read_config()
+        if config is UNKNOWN:
+            return False
+        version = (config.get("core.repositoryformatversion") or ["0"])[-1]
+        if version not in ("0", "1"):
+            return False
+        for (key, values) in config.iteritems():
+            if not key.startswith("extensions."):
+                continue
+            extension = key[len("extensions."):]
+            if extension == "refstorage":
+                if values[-1] is None or values[-1].lower() != "files":
+                    return False
+            elif extension not in _SUPPORTED_EXTENSIONS:
+                return False
+        return True
+
+    def get_config(self, name):
+        """ Get a config value.
+
+        :return: the value, None if it is not set, or UNKNOWN
+
+        """
+        key = _normalize_key(name)
+        if key is None:
+            return UNKNOWN
+        env_config = _env_config()
+        if env_config is None:
+            return UNKNOWN
+        if key in env_config:
+            return env_config[key]
+        config = self._read_config()
+        if config is UNKNOWN:
+            return UNKNOWN
+        values = config.get(key)
+        if values:
+            value = values[-1]
+            if value is None:
+                return UNKNOWN
+            return value
+        if key.split(".")[0] in _LOCAL_SECTIONS:
+            return None
+        # May be in the global config
+        return UNKNOWN
+
+    def get_local_branches(self):
+        """ Get the sorted list of the local branches, from the
+        loose refs and from packed-refs
+
+        :return: the list, or UNKNOWN if refs/heads is not
+            a directory
+
+        """
+        def parse(path):
+            res = list()
+            with open(path, "r") as fp:
+                for line in fp:
+                    if line.startswith(("#", "^")):
+                        continue
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1].startswith("refs/heads/"):
+                        res.append(parts[1][11:])
+            return res
+        packed = self._cached(os.path.join(self.git_dir, "packed-refs"), parse)
+        branches = set(packed or list())
+        heads = os.path.join(self.git_dir, "refs", "heads")
+        if not os.path.isdir(heads):
+            return UNKNOWN
+        for (root, dirs_, files) in os.walk(heads):
+            for filename in files:
+                if filename.endswith(".lock"):
+                    continue
+                full_path = os.path.join(root, filename)
+                rel_path = os.path.relpath(full_path, heads)
+                branches.add(rel_path.replace(os.sep, "/"))
+        return sorted(branches)
+
+
+_GIT_DIRS = dict()
+_GIT_DIRS_LOCK = threading.Lock()
+
+def open_git_dir(repo):
+    """ Get the :py:class:`GitDir` for the given repository.
+
+    :return: None if the files can not be read directly,
+        (repo/.git is not a directory, it is a linked worktree,
+        the environment changes where git looks for them, or the
+        repository format is not supported)
+
+    """
+    for name in _UNSUPPORTED_ENV:
+        if os.environ.get(name):
+            return None
+    git_dir = os.path.join(repo, ".git")
+    if not os.path.isdir(git_dir):
+        return None
+    if os.path.exists(os.path.join(git_dir, "commondir")):
+        return None
+    git_dir = os.path.abspath(git_dir)
+    with _GIT_DIRS_LOCK:
+        res = _GIT_DIRS.get(git_dir)
+        if res is None:
+            res = GitDir(git_dir)
+            _GIT_DIRS[git_dir] = res
+    if not res.is_supported():
+        return None
+    return res
@@ -0,0 +1,170 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" An on-disk cache of the parsed qiproject.xml files of a worktree.
+
+Every `qisrc` and `qibuild` command needs the names, dependencies and
+subprojects of every project of the worktree, so the results of
+parsing each qiproject.xml file are stored in .qi/qiproject.cache,
+along with the modification time, the size and the inode of the file.
+
+Only the files that changed since the last command are parsed again,
+and the others are not even opened.
+
+A file could be changed again in the same second without its size
+changing, so, like git does for its index, entries for files modified
+less than :py:data:`_RACY_DELAY` seconds before they were parsed also
+hold a checksum of the file, which is checked until the file is old
+enough to be trusted.
+
+"""
+
+import os
+import time
+import hashlib
+import cPickle as pickle
+
+from qibuild import ui
+import qibuild.sh
+import qixml
+
+# Bump this when the format of the entries changes
+_VERSION = 3
+
+# How old a file must be, in seconds, for its modification time
+# to be trusted. Leaves room for coarse timestamps and for the
+# clock of a network file system
+_RACY_DELAY = 3
+
+
+def parse_qiproject_xml(qiproject_xml):
+    """ Parse a qiproject.xml file.
+
+    :return: a dict with the following keys:
+
+      * name: the name of the project, or None
+      * depends: the list of buildtime dependencies
+      * rdepends: the list of runtime dependencies
+      * subprojects: the list of the src of the subprojects
+
+    """
+    tree = qixml.read(qiproject_xml)
+    root = tree.getroot()
+    res = {
+        "name" : None,
+        "depends" : list(),
+        "rdepends" : list(),
+        "subprojects" : list(),
+    }
+    if root.tag == "project":
+        res["name"] = root.get("name")
+    for depends_elem in root.findall("depends"):
+        buildtime = qixml.parse_bool_attr(depends_elem, "buildtime")
+        runtime   = qixml.parse_bool_attr(depends_elem, "runtime")
+        dep_names = qixml.parse_list_attr(depends_elem, "names")
+        if buildtime:
+            res["depends"].extend(dep_names)
+        if runtime:
+            res["rdepends"].extend(dep_names)
+    for project_elem in root.findall("project"):
+        src = qixml.parse_required_attr(project_elem, "src",
+                                        xml_path=qiproject_xml)
+        res["subprojects"].append(src)
+    return res
+
+
+def _checksum(path):
+    """ The sha1 of the contents of a file, or None
+    if it can not be read
+
+    """
+    try:
+        with open(path, "rb") as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+    except IOError:
+        return None
+
+
+class QiProjectIndex:
+    """ Cache the result of :py:func:`parse_qiproject_xml`
+    for every qiproject.xml file of a worktree
+
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        """ Read the cache from disk, starting from scratch
+        if it does not exist or can not be read
+
+        """
+        self._entries = dict()
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "rb") as fp:
+                (version, entries) = pickle.load(fp)
+        except Exception, e:
+            ui.debug("Ignoring", self.cache_path, ":", e)
+            return
+        if version == _VERSION:
+            self._entries = entries
+
+    def read(self, qiproject_xml):
+        """ Get the parsed contents of a qiproject.xml file.
+
+        :return: a dict, see :py:func:`parse_qiproject_xml`, or
+          None if the file does not exist
+
+        """
+        if self._entries is None:
+            self._load()
+        try:
+            stat = os.stat(qiproject_xml)
+        except OSError:
+            if self._entries.pop(qiproject_xml, None):
+                self._dirty = True
+            return None
+        stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        racy = stat.st_mtime >= time.time() - _RACY_DELAY
+        entry = self._entries.get(qiproject_xml)
+        if entry and entry[0] == stamp:
+            (_, checksum, res) = entry
+            if checksum is None:
+                return res
+            if _checksum(qiproject_xml) == checksum:
+                if not racy:
+                    # Old enough now: no need to check again
+                    self._entries[qiproject_xml] = (stamp, None, res)
+                    self._dirty = True
+                return res
+        checksum = None
+        if racy:
+            checksum = _checksum(qiproject_xml)
+        res = parse_qiproject_xml(qiproject_xml)
+        self._entries[qiproject_xml] = (stamp, checksum, res)
+        self._dirty = True
+        return res
+
+    def save(self):
+        """ Write the cache back to disk, if something changed """
+        if not self._dirty:
+            return
+        to_write = self.cache_path + ".%i.tmp" % os.getpid()
+        try:
+            qibuild.sh.mkdir(os.path.dirname(self.cache_path), recursive=True)
+            with open(to_write, "wb") as fp:
+                pickle.dump((_VERSION, self._entries), fp,
+                            pickle.HIGHEST_PROTOCOL)
+            # rename is atomic on POSIX, but fails on Windows
+            # when the destination exists
+            if os.path.exists(self.cache_path) and os.name == "nt":
+                os.remove(self.cache_path)
+            os.rename(to_write, self.cache_path)
+        except (IOError, OSError), e:
+            ui.debug("Could not write", self.cache_path, ":", e)
+            return
+        self._dirty = False
@@ -131,6 +131,10 @@ class Manifest():
                 continue
             if not project.revision:
                 project.revision = remote.revision
+            if project.depth is None:
+                project.depth = remote.depth
+            if project.single_branch is None:
+                project.single_branch = remote.single_branch
             project.fetch_url = git_url_join(remote.fetch, project.name)
             if project.review:
                 project.review_url = git_url_join(remote.review, project.name)
@@ -147,6 +151,15 @@ class Manifest():
         res += "   projects: %s\n" % self.projects
         return res
 
+def _parse_depth(xml_element):
+    """ Parse the optional 'depth' attribute of a <project>
+    or a <remote> tag
+
+    """
+    if xml_element.get("depth") is None:
+        return None
+    return qixml.parse_int_attr(xml_element, "depth")
+
 class Project:
     """ Wrapper for the <project> tag inside a manifest
     XML file
@@ -158,6 +171,10 @@ class Project:
         self.review = False
         self.remote = None
         self.revision = None
+        # Clone only this number of commits (None or 0 for
+        # the whole history), and only the revision branch
+        self.depth = None
+        self.single_branch = None
         # Set during manifest parsing
         self.fetch_url = None
         self.review_url = None
@@ -176,6 +193,9 @@ class Project:
         self.remote = xml_element.get("remote")
         if not self.remote:
             self.remote = "origin"
+        self.depth = _parse_depth(xml_element)
+        self.single_branch = qixml.parse_bool_attr(xml_element, "single_branch",
+                                                   default=None)
 
     def __repr__(self):
         res = "<Project %s remote: %s fetch: %s review:%s>" % \
@@ -193,6 +213,9 @@ class Remote:
         self.fetch = None
         self.review = None
         self.revision = None
+        # Defaults for the projects using this remote
+        self.depth = None
+        self.single_branch = False
 
     def parse(self, xml_element):
         self.name = xml_element.get("name")
@@ -203,6 +226,8 @@ class Remote:
         self.revision = xml_element.get("revision")
         if not self.revision:
             self.revision = "master"
+        self.depth = _parse_depth(xml_element)
+        self.single_branch = qixml.parse_bool_attr(xml_element, "single_branch")
 
     def __repr__(self):
         res = "<Remote %s fetch: %s on %s, review:%s>" % \
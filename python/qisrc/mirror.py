@@ -0,0 +1,189 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" A store of bare git mirrors, shared by every worktree
+of the machine.
+
+When a store is given to :py:func:`qisrc.sync.clone_project`,
+repositories are cloned with ``--reference`` to their mirror
+and ``--dissociate``: only the objects missing from the mirror are
+downloaded, and the new clone does not depend on the mirror
+afterwards, so mirrors can be updated or removed at any time.
+
+Mirrors are created the first time they are needed,
+and updated with ``qisrc mirror``
+
+"""
+
+import os
+import hashlib
+import threading
+
+import qibuild.sh
+import qibuild.parallel
+import qisrc.git
+from qibuild import ui
+
+MIRRORS_PATH = "~/.cache/qi/git"
+
+
+def get_mirror_name(url):
+    """ Get the name of the mirror of a url: the name of
+    the repository, followed by a hash of the full url
+
+    >>> get_mirror_name("git@example.com:lib/foo.git")
+    'foo-318c73e681.git'
+
+    """
+    name = url.rstrip("/").split("/")[-1].split(":")[-1]
+    if name.endswith(".git"):
+        name = name[:-4]
+    name = "".join(x if x.isalnum() or x in "-_." else "_" for x in name)
+    digest = hashlib.sha1(url).hexdigest()[:10]
+    return "%s-%s.git" % (name, digest)
+
+
+class MirrorStore:
+    """ A directory containing bare mirrors of git
+    repositories, keyed by url
+
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = MIRRORS_PATH
+        self.root = qibuild.sh.to_native_path(root)
+        self._lock = threading.Lock()
+        # url -> lock, so that a mirror is never created
+        # twice at the same time
+        self._url_locks = dict()
+
+    def get_path(self, url):
+        """ Where the mirror of a url is, whether it exists or not """
+        return os.path.join(self.root, get_mirror_name(url))
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def get_mirror(self, url, create=True):
+        """ Get the path to the mirror of a url.
+
+        :param create: create the mirror if it does not exist yet
+
+        :return: None if there is no mirror, or if it could
+            not be created
+
+        """
+        path = self.get_path(url)
+        with self._url_lock(url):
+            if os.path.isdir(path):
+                return path
+            if not create:
+                return None
+            (retcode, out) = self.create_mirror(url)
+        if retcode != 0:
+            ui.warning("Could not create mirror of", url, "\n" + out)
+            return None
+        return path
+
+    def create_mirror(self, url):
+        """ Clone a new mirror of a url.
+
+        The mirror is cloned in a temporary directory, then
+        renamed, so that a mirror is never seen half-created by
+        other processes using the same store.
+
+        :return: a (retcode, output) tuple
+
+        """
+        path = self.get_path(url)
+        qibuild.sh.mkdir(self.root, recursive=True)
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        qibuild.sh.rm(tmp_path)
+        ui.info(ui.green, "Creating mirror:", ui.reset, url, "->", path)
+        git = qisrc.git.Git(tmp_path)
+        (retcode, out) = git.clone("--mirror", "--quiet", url, raises=False)
+        if retcode != 0:
+            qibuild.sh.rm(tmp_path)
+            return (retcode, out)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Created by someone else in the mean time
+            qibuild.sh.rm(tmp_path)
+            if not os.path.isdir(path):
+                raise
+        return (0, out)
+
+    def update_mirror(self, url):
+        """ Fetch every ref of the mirror of a url,
+        creating it if it does not exist
+
+        :return: a (retcode, output) tuple
+
+        """
+        path = self.get_path(url)
+        with self._url_lock(url):
+            if not os.path.isdir(path):
+                return self.create_mirror(url)
+            git = qisrc.git.Git(path)
+            return git.call("fetch", "--prune", "--quiet", "origin",
+                            raises=False)
+
+    def get_urls(self):
+        """ Get the sorted list of the urls of the mirrors
+        of the store
+
+        """
+        res = list()
+        if not os.path.isdir(self.root):
+            return res
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith(".git") or not os.path.isdir(path):
+                continue
+            url = qisrc.git.Git(path).get_config("remote.origin.url")
+            if url:
+                res.append(url)
+        res.sort()
+        return res
+
+    def update_mirrors(self, urls=None, num_jobs=1):
+        """ Update several mirrors, running at most num_jobs
+        git commands at the same time.
+
+        :param urls: the urls to update. Every mirror of the
+            store is updated when not given
+
+        :return: a list of (url, error message) for the mirrors
+            that could not be updated, sorted by url
+
+        """
+        if urls is None:
+            urls = self.get_urls()
+        errors = list()
+        done = list()
+        def on_done(url, res):
+            (retcode, out) = res
+            done.append(url)
+            ui.info(ui.green, "*", ui.reset,
+                    "(%2i/%2i)" % (len(done), len(urls)),
+                    ui.blue, url)
+            if retcode != 0:
+                errors.append((url, out))
+        qibuild.parallel.run_parallel(urls, self.update_mirror,
+                                      num_jobs=num_jobs, on_done=on_done)
+        return sorted(errors)
+
+
+def store_from_args(args):
+    """ Get the :py:class:`MirrorStore` to use from the
+    command line arguments (see :py:func:`qisrc.parsers.clone_parser`)
+
+    :return: None if mirrors should not be used
+
+    """
+    if not args.use_mirror and not args.mirror_dir:
+        return None
+    return MirrorStore(args.mirror_dir)
@@ -11,3 +11,36 @@ def worktree_parser(parser):
     parser.add_argument("-w", "--worktree", "--work-tree", dest="worktree",
         help="Use a specific work tree path.")
 
+
+def jobs_parser(parser):
+    """ Parser settings for every action able to work on
+    several git projects at the same time
+    """
+    parser.add_argument("-j", dest="num_jobs", type=int,
+        help="Number of git commands to run at the same time")
+    parser.set_defaults(num_jobs=1)
+
+
+def clone_parser(parser):
+    """ Parser settings for every action cloning git projects
+    """
+    parser.add_argument("--mirror", dest="use_mirror", action="store_true",
+        help="Clone new projects using the shared git mirrors, "
+             "creating the missing ones")
+    parser.add_argument("--mirror-dir", dest="mirror_dir",
+        help="Where the git mirrors are. Implies --mirror. "
+             "Default: ~/.cache/qi/git")
+    parser.add_argument("--depth", dest="depth", type=int,
+        help="Only clone this number of commits of new projects, "
+             "0 for the whole history. "
+             "Overrides the depth set in the manifest")
+    parser.add_argument("--single-branch", dest="single_branch",
+        action="store_true",
+        help="Only clone and fetch the branch of each new project. "
+             "Overrides the manifest")
+    parser.add_argument("--no-single-branch", dest="single_branch",
+        action="store_false",
+        help="Clone and fetch every branch of the new projects. "
+             "Overrides the manifest")
+    parser.set_defaults(use_mirror=False, mirror_dir=None, depth=None,
+                        single_branch=None)
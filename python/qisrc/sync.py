@@ -7,8 +7,10 @@
 """
 
 import os
+import threading
 
 import qibuild.sh
+import qibuild.parallel
 import qisrc.manifest
 import qisrc.review
 import qisrc.git
@@ -17,19 +19,21 @@ from qibuild import ui
 
 def fetch_manifest(worktree, manifest_git_url, branch="master",
     profile="default",
-    src="manifest/default"):
+    src="manifest/default", mirrors=None):
     """ Fetch the manifest for a worktree
 
     :param manifest_git_url: A git repository containing a
         'manifest.xml' file, ala repo
     :param branch: The branch to use
     :param src: The path where to store the clone of the manifest
+    :param mirrors: a :py:class:`qisrc.mirror.MirrorStore` to clone from
 
     Note: every changes made by the user directly in the manifest repo
     will be lost!
 
     """
-    clone_project(worktree, manifest_git_url, src=src, skip_if_exists=True)
+    clone_project(worktree, manifest_git_url, src=src, skip_if_exists=True,
+                  mirrors=mirrors)
     # Make sure manifest project is on the correct, up to date branch:
     manifest = worktree.get_project(src)
     git = qisrc.git.open(manifest.path)
@@ -47,12 +51,69 @@ def fetch_manifest(worktree, manifest_git_url, branch="master",
     return manifest_file
 
 
-def init_worktree(worktree, manifest_location, setup_review=True):
+class FetchPlan:
+    """ Remember which remotes have been fetched in which
+    repositories during a sync, so that each remote is
+    fetched only once.
+
+    ``saved`` is the number of fetches that were skipped
+
+    """
+    def __init__(self):
+        # (repo, remote) -> True
+        self._fetched = dict()
+        self._lock = threading.Lock()
+        self.saved = 0
+
+    def _key(self, repo, remote_name):
+        return (os.path.realpath(repo), remote_name)
+
+    def mark_fetched(self, repo, remote_name):
+        """ Tell the plan the remote is up to date,
+        for instance because the repository was just cloned
+
+        """
+        with self._lock:
+            self._fetched[self._key(repo, remote_name)] = True
+
+    def fetch(self, git, remote_name, **kwargs):
+        """ Call git fetch, unless the remote has already been
+        fetched.
+
+        kwargs are passed to :py:meth:`qisrc.git.Git.call`
+
+        """
+        key = self._key(git.repo, remote_name)
+        with self._lock:
+            if key in self._fetched:
+                self.saved += 1
+                ui.debug("Already fetched", remote_name, "in", git.repo)
+                if kwargs.get("raises") is False:
+                    return (0, "")
+                return None
+        res = git.call("fetch", remote_name, **kwargs)
+        if kwargs.get("raises") is not False or res[0] == 0:
+            self.mark_fetched(git.repo, remote_name)
+        return res
+
+
+def init_worktree(worktree, manifest_location, setup_review=True,
+                  fetch_plan=None, mirrors=None, depth=None,
+                  single_branch=None):
     """ (re)-intianlize a worktree given a manifest location.
     Clonie any missing repository, set the correct
     remote and tracking branch on every repository
 
     :param setup_review: Also set up the projects for review
+    :param fetch_plan: a :py:class:`FetchPlan`, to avoid
+        fetching the same remotes several times
+    :param mirrors: a :py:class:`qisrc.mirror.MirrorStore`, used
+        to clone the missing repositories
+    :param depth: clone the missing repositories with this depth
+        (0 for the whole history), instead of the one set in the
+        manifest
+    :param single_branch: if not None, whether to clone only the
+        branch of each project, instead of what the manifest says
     """
     errors = list()
     manifest = qisrc.manifest.load(manifest_location)
@@ -61,46 +122,59 @@ def init_worktree(worktree, manifest_location, setup_review=True):
     project_count = len(manifest.projects)
     ui.info(ui.green, "Initializing worktree ...")
     setup_ok = True
-    for i, project in enumerate(manifest.projects):
-        ui.info(
-            ui.green, "*", ui.reset, "(%2i/%2i)" % (i+1, project_count),
-            ui.blue, project.name)
-        # Use the same branch for the project as the branch
-        # for the manifest, unless explicitely set:
-        p_revision = project.revision
-        p_url = project.fetch_url
-        p_remote = project.remote
-        p_src = project.path
-        clone_project(worktree, p_url,
-                      src=p_src,
-                      branch=p_revision,
-                      remote=p_remote,
-                      skip_if_exists=True)
-        wt_project = worktree.get_project(p_src)
-        p_path = wt_project.path
-        if project.review and setup_review and setup_ok:
-            worktree.set_project_review(p_src, True)
-            # If setup failed once, no point in trying for every project
-            setup_ok = qisrc.review.setup_project(p_path, project.name,
-                                                  project.review_url, p_revision)
-        git = qisrc.git.Git(p_path)
-        git.set_remote(p_remote, p_url)
-        git.set_tracking_branch(p_revision, p_remote)
-        cur_branch = git.get_current_branch()
-        if cur_branch != p_revision:
-            if not cur_branch:
-                ui.warning("Project", project.name, "is on a detached HEAD",
-                    "but should be on", p_revision)
-            else:
-                ui.warning("Project", project.name, "is on", cur_branch,
-                    "but should be on", p_revision)
-        worktree.set_git_project_config(p_src, p_remote, p_revision)
+    # Write and reload worktree.xml only once, at the end
+    with worktree.batch():
+        for i, project in enumerate(manifest.projects):
+            ui.info(
+                ui.green, "*", ui.reset, "(%2i/%2i)" % (i+1, project_count),
+                ui.blue, project.name)
+            # Use the same branch for the project as the branch
+            # for the manifest, unless explicitely set:
+            p_revision = project.revision
+            p_url = project.fetch_url
+            p_remote = project.remote
+            p_src = project.path
+            p_depth = depth
+            if p_depth is None:
+                p_depth = project.depth
+            p_single_branch = single_branch
+            if p_single_branch is None:
+                p_single_branch = project.single_branch
+            clone_project(worktree, p_url,
+                          src=p_src,
+                          branch=p_revision,
+                          remote=p_remote,
+                          skip_if_exists=True,
+                          fetch_plan=fetch_plan,
+                          mirrors=mirrors,
+                          depth=p_depth,
+                          single_branch=p_single_branch)
+            wt_project = worktree.get_project(p_src)
+            p_path = wt_project.path
+            if project.review and setup_review and setup_ok:
+                worktree.set_project_review(p_src, True)
+                # If setup failed once, no point in trying for every project
+                setup_ok = qisrc.review.setup_project(p_path, project.name,
+                                                      project.review_url, p_revision)
+            git = qisrc.git.Git(p_path)
+            git.set_remote(p_remote, p_url)
+            git.set_tracking_branch(p_revision, p_remote, fetch_plan=fetch_plan)
+            cur_branch = git.get_current_branch()
+            if cur_branch != p_revision:
+                if not cur_branch:
+                    ui.warning("Project", project.name, "is on a detached HEAD",
+                        "but should be on", p_revision)
+                else:
+                    ui.warning("Project", project.name, "is on", cur_branch,
+                        "but should be on", p_revision)
+            worktree.set_git_project_config(p_src, p_remote, p_revision)
     if not setup_ok:
         qisrc.review.warn_gerrit()
 
 
 def clone_project(worktree, url, src=None, branch=None, remote="origin",
-    skip_if_exists=False):
+    skip_if_exists=False, fetch_plan=None, mirrors=None, depth=None,
+    single_branch=False):
     """ Add a project to a worktree given its url.
 
     If src is not given, it will be guessed from the url
@@ -108,6 +182,17 @@ def clone_project(worktree, url, src=None, branch=None, remote="origin",
     If skip_if_exists is False, an error message will be
     raised if the project already exists
 
+    If fetch_plan is given, the remote of the new clone is
+    marked as fetched
+
+    If mirrors is given (a :py:class:`qisrc.mirror.MirrorStore`),
+    the objects are taken from the mirror of the url, created
+    if needed, and only the missing ones are downloaded
+
+    If depth is given and not 0, only this number of commits is cloned.
+    If single_branch is True, only the branch is cloned, and
+    the other remote branches are not fetched afterwards
+
     """
     should_add = True
     if not src:
@@ -149,9 +234,90 @@ def clone_project(worktree, url, src=None, branch=None, remote="origin",
     dirname = os.path.dirname(path)
     qibuild.sh.mkdir(dirname, recursive=True)
     git = qisrc.git.Git(path)
+    clone_args = [url]
+    if mirrors:
+        reference = mirrors.get_mirror(url)
+        if reference:
+            clone_args += ["--reference", reference, "--dissociate"]
+    if depth:
+        clone_args += ["--depth", str(depth)]
+        # --depth implies --single-branch
+        if not single_branch:
+            clone_args.append("--no-single-branch")
+    elif single_branch:
+        clone_args.append("--single-branch")
     if branch:
-        git.clone(url, "-b", branch, "-o", remote)
+        git.clone(*(clone_args + ["-b", branch, "-o", remote]))
     else:
-        git.clone(url, "-o", remote)
+        git.clone(*(clone_args + ["-o", remote]))
+    if fetch_plan:
+        fetch_plan.mark_fetched(path, remote)
     if should_add:
         worktree.add_project(path)
+
+
+def sync_projects(git_projects, num_jobs=1, fetch_plan=None):
+    """ Update every git project with its remote branch.
+
+    Every remote is fetched first, running at most num_jobs
+    fetches at the same time, then each local branch is
+    rebased or fast-forwarded (see :py:meth:`qisrc.git.Git.update_branch`),
+    again num_jobs projects at a time.
+
+    :param fetch_plan: a :py:class:`FetchPlan`. Remotes that
+        were already fetched during this sync are not fetched again.
+
+    :return: a list of (src, error message) for the projects
+        that could not be updated, sorted by src
+
+    """
+    errors = dict()
+    project_count = len(git_projects)
+    if project_count == 1:
+        ui.info(ui.bold, "Pulling", ui.blue, git_projects[0].src)
+
+    def show_progress(project, done, total):
+        if project_count != 1:
+            ui.info(ui.green, "*", ui.reset,
+                    "(%2i/%2i)" % (len(done), total),
+                    ui.blue, project.src)
+
+    def fetch(project):
+        git = qisrc.git.open(project.path)
+        if fetch_plan:
+            return fetch_plan.fetch(git, project.remote, raises=False)
+        return git.call("fetch", project.remote, raises=False)
+
+    fetched = list()
+    def on_fetched(project, res):
+        (ret, out) = res
+        fetched.append(project)
+        show_progress(project, fetched, project_count)
+        if out:
+            print out
+        if ret != 0:
+            errors[project.src] = "Fetch failed\n" + out
+
+    if project_count != 1:
+        ui.info(ui.green, "Fetching projects ...")
+    qibuild.parallel.run_parallel(git_projects, fetch,
+                                  num_jobs=num_jobs, on_done=on_fetched)
+
+    def update(project):
+        git = qisrc.git.open(project.path)
+        return git.update_branch(project.branch, project.remote,
+                                 fetch_first=False)
+
+    to_update = [x for x in git_projects if x.src not in errors]
+    updated = list()
+    def on_updated(project, error):
+        updated.append(project)
+        show_progress(project, updated, len(to_update))
+        if error:
+            errors[project.src] = error
+
+    if project_count != 1:
+        ui.info(ui.green, "Synchronizing projects ...")
+    qibuild.parallel.run_parallel(to_update, update,
+                                  num_jobs=num_jobs, on_done=on_updated)
+    return sorted(errors.items())
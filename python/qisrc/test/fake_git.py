@@ -27,6 +27,9 @@ class FakeGit(qisrc.git.Git):
     def set_config(self, name, value):
         FakeGit.repo_configs[self.repo][name] = value
 
+    def is_shallow(self):
+        return FakeGit.repo_configs[self.repo].get("shallow", False)
+
     def add_result(self, cmd, retcode, out):
         """ Add an expected result for the given command
 
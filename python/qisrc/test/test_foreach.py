@@ -0,0 +1,84 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Automatic testing for qisrc.foreach
+
+"""
+
+import pytest
+
+import qibuild.command
+import qisrc.foreach
+
+
+class FakeWorkTree:
+    def __init__(self, root):
+        self.root = root
+
+class FakeProject:
+    def __init__(self, src, path):
+        self.src = src
+        self.path = path
+
+def create_projects(tmpdir, *names):
+    worktree = FakeWorkTree(tmpdir.strpath)
+    projects = list()
+    for src in names:
+        path = tmpdir.join(*src.split("/")).ensure(dir=True)
+        projects.append(FakeProject(src, path.strpath))
+    return (worktree, projects)
+
+# Fails in the projects named "fail..."
+COMMAND = ["sh", "-c", 'basename `pwd`; case `basename $PWD` in fail*) exit 1;; esac']
+
+def test_logs(tmpdir):
+    (worktree, projects) = create_projects(tmpdir, "a", "lib/b", "lib_b", "c")
+    errors = qisrc.foreach.foreach(worktree, projects, COMMAND, num_jobs=4)
+    assert errors == list()
+    for (project, name) in zip(projects, ["a", "b", "lib_b", "c"]):
+        log_file = qisrc.foreach.get_log_file(worktree, project)
+        with open(log_file, "r") as fp:
+            assert fp.read() == name + "\n"
+
+def test_ignore_errors(tmpdir):
+    (worktree, projects) = create_projects(tmpdir, "a", "fail1", "b", "fail2")
+    errors = qisrc.foreach.foreach(worktree, projects, COMMAND, num_jobs=2,
+                                   ignore_errors=True)
+    assert sorted(x.src for x in errors) == ["fail1", "fail2"]
+
+def test_stop_on_error(tmpdir):
+    (worktree, projects) = create_projects(tmpdir, "fail", "a", "b", "c")
+    # pylint: disable-msg=E1101
+    with pytest.raises(qibuild.command.CommandFailedException):
+        qisrc.foreach.foreach(worktree, projects, COMMAND, num_jobs=1)
+    # Nothing should have been started after the failure
+    for name in ["a", "b", "c"]:
+        assert not tmpdir.join(".qi", "foreach", name + ".log").check()
+
+def test_stop_on_error_parallel(tmpdir, monkeypatch):
+    # The failure happens while other commands are running:
+    # they are waited for, but nothing new is started
+    go_file = tmpdir.join("go")
+    (worktree, projects) = create_projects(tmpdir,
+                                           "a", "b", "fail", "c", "d", "e")
+    command = ["sh", "-c", """
+basename `pwd`
+case `basename $PWD` in fail*) exit 1;; esac
+i=0
+while [ ! -f %s ] && [ $i -lt 200 ]; do sleep 0.05; i=$((i+1)); done
+""" % go_file.strpath]
+    # Let the others finish once the failure has been reported
+    real_info = qisrc.foreach.ui.info
+    def info(*args):
+        if "[FAILED]" in args:
+            go_file.write("")
+        real_info(*args)
+    monkeypatch.setattr(qisrc.foreach.ui, "info", info)
+    # pylint: disable-msg=E1101
+    with pytest.raises(qibuild.command.CommandFailedException):
+        qisrc.foreach.foreach(worktree, projects, command, num_jobs=3)
+    for name in ["a", "b", "fail"]:
+        assert tmpdir.join(".qi", "foreach", name + ".log").check()
+    for name in ["c", "d", "e"]:
+        assert not tmpdir.join(".qi", "foreach", name + ".log").check()
@@ -467,3 +467,34 @@ def test_submodules(tmpdir):
     bar = foo.join("bar")
     assert qisrc.git.is_submodule(bar.strpath)
     assert not qisrc.git.is_submodule(foo.strpath)
+
+def test_get_status(tmpdir):
+    bar_url = create_git_repo(tmpdir.strpath, "bar")
+    work = tmpdir.mkdir("work")
+    bar_src = work.join("bar").strpath
+    git = qisrc.git.Git(bar_src)
+    git.clone(bar_url)
+    status = git.get_status()
+    assert status.branch == "master"
+    assert status.tracking == "origin/master"
+    assert (status.ahead, status.behind) == (0, 0)
+    assert status.clean
+
+    push_file(tmpdir.strpath, "bar", "README", "bar v2\n")
+    git.fetch()
+    write_readme(bar_src, "unstaged\n")
+    work.join("bar", "untracked").write("")
+    status = git.get_status()
+    assert status.behind == 1
+    assert status.changes == [" M README", "?? untracked"]
+    status = git.get_status(untracked=False)
+    assert status.changes == [" M README"]
+
+    git.checkout("-f", "HEAD~0", "--detach")
+    assert git.get_status().branch is None
+
+def test_get_status_invalid(tmpdir):
+    git = qisrc.git.Git(tmpdir.strpath)
+    assert git.get_status() is None
+    git.init()
+    assert git.get_status() is None
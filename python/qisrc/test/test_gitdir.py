@@ -0,0 +1,146 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Automatic testing for qisrc.gitdir
+
+"""
+
+import qisrc.git
+import qisrc.gitdir
+from qisrc.gitdir import UNKNOWN
+
+from qisrc.test.test_git import write_readme
+
+
+def create_repo(tmpdir):
+    git = qisrc.git.Git(tmpdir.strpath)
+    git.init()
+    write_readme(tmpdir.strpath, "readme\n")
+    git.add(".")
+    git.commit("-m", "initial commit")
+    return git
+
+def from_git(git, name):
+    """ What git config --get says """
+    (status, out) = git.call("config", "--get", name, raises=False)
+    if status != 0:
+        return None
+    return out
+
+
+def test_parse_value():
+    assert qisrc.gitdir.parse_value("foo") == "foo"
+    assert qisrc.gitdir.parse_value("  foo bar  ; comment") == "foo bar"
+    assert qisrc.gitdir.parse_value('" foo " # comment') == " foo "
+    assert qisrc.gitdir.parse_value(r'a\tb\"c\\') == 'a\tb"c\\'
+
+def test_parse_config(tmpdir):
+    config = tmpdir.join("config")
+    config.write(r"""
+# A comment
+[core]
+    repositoryformatversion = 0
+    Bare = false
+[remote "Origin"]
+    url = git@foo:bar.git
+    fetch = +refs/heads/*:refs/remotes/origin/*
+    fetch = +refs/tags/*:refs/tags/*
+[branch "master"] ; another comment
+    remote = origin
+    merge = refs/heads/\
+master
+""")
+    res = qisrc.gitdir.parse_config(config.strpath)
+    assert res["core.bare"] == ["false"]
+    assert res["remote.Origin.url"] == ["git@foo:bar.git"]
+    assert len(res["remote.Origin.fetch"]) == 2
+    assert res["branch.master.merge"] == ["refs/heads/master"]
+
+def test_same_answers_as_git(tmpdir):
+    git = create_repo(tmpdir)
+    git.call("remote", "add", "origin", "git@foo:bar.git")
+    git.set_config("branch.master.remote", "origin")
+    git.set_config("branch.master.merge", "refs/heads/master")
+    git.set_config("foo.bar", '  spaces " and quotes" ')
+    git.checkout("-b", "devel/next")
+    git.checkout("-b", "spam")
+    git_dir = qisrc.gitdir.open_git_dir(tmpdir.strpath)
+    for name in ["branch.master.remote", "branch.master.merge",
+                 "remote.origin.url", "Remote.origin.URL",
+                 "foo.bar", "branch.nope.remote"]:
+        assert git_dir.get_config(name) == from_git(git, name)
+    (_, out) = git.call("symbolic-ref", "HEAD", raises=False)
+    assert git_dir.get_head() == out
+    assert git.get_current_branch() == "spam"
+    assert git_dir.get_local_branches() == \
+        ["devel/next", "master", "spam"]
+
+    # Branches are still found once packed
+    git.call("pack-refs", "--all")
+    git.call("branch", "packed")
+    assert git_dir.get_local_branches() == \
+        ["devel/next", "master", "packed", "spam"]
+
+    # Detached HEAD
+    git.checkout("-q", "HEAD~0", "--detach")
+    assert git_dir.get_head() is None
+    assert git.get_current_branch() is None
+
+def test_cache_is_invalidated(tmpdir):
+    git = create_repo(tmpdir)
+    git_dir = qisrc.gitdir.open_git_dir(tmpdir.strpath)
+    assert git_dir.get_config("remote.origin.url") is None
+    git.set_config("remote.origin.url", "git@foo:bar.git")
+    assert git_dir.get_config("remote.origin.url") == "git@foo:bar.git"
+    git.set_config("remote.origin.url", "git@foo:baz.git")
+    assert git_dir.get_config("remote.origin.url") == "git@foo:baz.git"
+
+def test_fallback(tmpdir):
+    git = create_repo(tmpdir)
+    git_dir = qisrc.gitdir.open_git_dir(tmpdir.strpath)
+    # Could be in the global config:
+    assert git_dir.get_config("user.name") is UNKNOWN
+    tmpdir.join("other.cfg").write("[remote \"origin\"]\n  url = included\n")
+    git.set_config("include.path", tmpdir.join("other.cfg").strpath)
+    assert git_dir.get_config("remote.origin.url") is UNKNOWN
+    assert git.get_config("remote.origin.url") == "included"
+    # Not a .git directory:
+    assert qisrc.gitdir.open_git_dir(tmpdir.join("nope").strpath) is None
+
+def test_unsupported_repository_format(tmpdir):
+    create_repo(tmpdir)
+    assert qisrc.gitdir.open_git_dir(tmpdir.strpath)
+    config = tmpdir.join(".git", "config")
+    orig = config.read()
+    def set_format(version, extensions):
+        """ Not using git config: it refuses to run in
+        repositories it does not support
+
+        """
+        to_write = orig.replace("repositoryformatversion = 0",
+                                "repositoryformatversion = %s" % version)
+        to_write += "[extensions]\n"
+        for (name, value) in extensions:
+            to_write += "\t%s = %s\n" % (name, value)
+        config.write(to_write)
+        return qisrc.gitdir.open_git_dir(tmpdir.strpath)
+
+    assert set_format(1, [("objectFormat", "sha1"), ("refStorage", "files")])
+    assert set_format(1, [("refStorage", "reftable")]) is None
+    assert set_format(1, [("worktreeConfig", "true")]) is None
+    assert set_format(2, list()) is None
+    assert set_format(0, list())
+
+def test_refs_heads_is_not_a_directory(tmpdir):
+    git = create_repo(tmpdir)
+    git.call("branch", "devel")
+    git.call("pack-refs", "--all")
+    git_dir = qisrc.gitdir.open_git_dir(tmpdir.strpath)
+    heads = tmpdir.join(".git", "refs", "heads")
+    heads.remove()
+    heads.write("")
+    assert git_dir.get_local_branches() is UNKNOWN
+    # Git is asked instead:
+    (_, out) = git.call("branch", "--no-color", raises=False)
+    assert git.get_local_branches() == [x[2:] for x in out.splitlines()]
@@ -0,0 +1,62 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Automatic testing for qisrc grep
+
+"""
+
+import pytest
+
+import qibuild.cmdparse
+import qisrc.git
+import qisrc.worktree
+
+
+def create_worktree(tmpdir):
+    """ Create a worktree with a few git projects,
+    the spam pattern is not found in the last one
+
+    """
+    worktree = qisrc.worktree.create(tmpdir.strpath)
+    contents = {
+        "a" : "spam\neggs\n",
+        "lib/b" : "eggs\nspam\nspam\n",
+        "c" : "spam\n",
+        "d" : "eggs\n",
+    }
+    for src in sorted(contents):
+        project_dir = tmpdir.join(*src.split("/")).ensure(dir=True)
+        project_dir.join("file.txt").write(contents[src])
+        git = qisrc.git.Git(project_dir.strpath)
+        git.init(quiet=True)
+        git.add("file.txt")
+        git.commit("-m", "initial commit", quiet=True)
+        worktree.add_project(src)
+    return worktree
+
+def run_grep(capsys, worktree, *args):
+    """ Run qisrc grep, return its exit code and output """
+    args = ["-w", worktree.root] + list(args) + ["spam"]
+    # pylint: disable-msg=E1101
+    with pytest.raises(SystemExit) as e:
+        qibuild.cmdparse.run_action("qisrc.actions.grep", args)
+    (out, _err) = capsys.readouterr()
+    return (e.value.code, out)
+
+def test_parallel_ordered(tmpdir, capsys):
+    worktree = create_worktree(tmpdir)
+    (retcode, out) = run_grep(capsys, worktree, "-j", "1")
+    assert retcode == 1
+    assert "lib/b" in out
+    assert out.count("spam") == 4
+    for num_jobs in ["2", "4"]:
+        assert run_grep(capsys, worktree, "-j", num_jobs, "--ordered") == \
+            (retcode, out)
+
+def test_parallel_unordered(tmpdir, capsys):
+    worktree = create_worktree(tmpdir)
+    (retcode, out) = run_grep(capsys, worktree, "-j", "1")
+    (parallel_retcode, parallel_out) = run_grep(capsys, worktree, "-j", "4")
+    assert parallel_retcode == retcode
+    assert sorted(parallel_out.splitlines()) == sorted(out.splitlines())
@@ -146,6 +146,22 @@ class ManifestTestCase(unittest.TestCase):
         project = manifest.get_project("bar/foo.git")
         self.assertEqual(project.path, "bar/foo")
 
+    def test_parse_depth(self):
+        xml = """
+<manifest>
+  <remote fetch="ssh://git@all" depth="1" />
+  <remote name="full" fetch="ssh://git@full" />
+  <project name="a" single_branch="true" />
+  <project name="b" depth="0" />
+  <project name="c" remote="full" />
+</manifest>
+"""
+        manifest = qisrc.manifest.load(StringIO(xml))
+        (a, b, c) = manifest.projects
+        self.assertEqual((a.depth, a.single_branch), (1, True))
+        self.assertEqual((b.depth, b.single_branch), (0, False))
+        self.assertEqual((c.depth, c.single_branch), (None, False))
+
 
 
 
@@ -0,0 +1,53 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Automatic testing for qisrc.mirror
+
+"""
+
+import os
+
+import qisrc.git
+import qisrc.mirror
+import qisrc.sync
+import qisrc.worktree
+
+from qisrc.test.test_git import create_git_repo
+from qisrc.test.test_git import push_file
+from qisrc.test.test_git import read_readme
+
+
+def test_clone_with_mirror(tmpdir):
+    url = "file://" + create_git_repo(tmpdir.strpath, "foo")
+    store = qisrc.mirror.MirrorStore(tmpdir.join("mirrors").strpath)
+    assert store.get_mirror(url, create=False) is None
+    worktree = qisrc.worktree.create(tmpdir.join("work").strpath)
+    qisrc.sync.clone_project(worktree, url, src="foo", mirrors=store)
+
+    mirror_path = store.get_mirror(url, create=False)
+    assert os.path.isdir(mirror_path)
+    assert store.get_urls() == [url]
+    foo = worktree.get_project("foo")
+    assert read_readme(foo.path) == "foo\n"
+    # The clone does not depend on the mirror
+    alternates = os.path.join(foo.path, ".git", "objects", "info", "alternates")
+    assert not os.path.exists(alternates)
+    assert qisrc.git.Git(foo.path).get_config("remote.origin.url") == url
+
+def test_update_mirrors(tmpdir):
+    url = "file://" + create_git_repo(tmpdir.strpath, "foo")
+    store = qisrc.mirror.MirrorStore(tmpdir.join("mirrors").strpath)
+    assert store.update_mirrors(num_jobs=2) == list()
+    assert store.update_mirrors([url], num_jobs=2) == list()
+    push_file(tmpdir.strpath, "foo", "bar.txt", "bar\n")
+    assert store.update_mirrors(num_jobs=2) == list()
+    mirror_git = qisrc.git.Git(store.get_path(url))
+    (_, out) = mirror_git.call("log", "-1", "--format=%s", "master",
+                               raises=False)
+    assert out == "added bar.txt"
+
+    nope = "file://" + tmpdir.join("nope.git").strpath
+    errors = store.update_mirrors([url, nope], num_jobs=2)
+    assert [x[0] for x in errors] == [nope]
+    assert not os.path.exists(store.get_path(nope))
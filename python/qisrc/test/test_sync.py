@@ -9,8 +9,14 @@ from StringIO import StringIO
 
 import pytest
 
+try:
+    import argparse
+except ImportError:
+    from qibuild.external import argparse
+
 import qisrc.sync
 import qisrc.git
+import qisrc.parsers
 import qibuild.sh
 
 from qisrc.test.test_git import create_git_repo
@@ -18,6 +24,7 @@ from qisrc.test.test_git import create_git_repo_with_submodules
 from qisrc.test.test_git import create_broken_submodules
 from qisrc.test.test_git import read_readme
 from qisrc.test.test_git import push_file
+from qisrc.test.fake_git import FakeGit
 
 
 # pylint: disable-msg=E1101
@@ -236,6 +243,150 @@ class SyncTestCase(unittest.TestCase):
         qisrc.sync.init_worktree(worktree, manifest)
         self.assertEqual(len(worktree.git_projects), 3)
 
+    def test_sync_projects(self):
+        manifest_url = create_git_repo(self.tmp, "manifest")
+        for name in ["foo", "bar", "baz"]:
+            create_git_repo(self.tmp, name)
+        xml = """
+<manifest>
+    <remote name="origin" fetch="{tmp}/srv" />
+    <project name="foo.git" path="foo" />
+    <project name="bar.git" path="bar" />
+    <project name="baz.git" path="baz" />
+</manifest>
+"""
+        xml = xml.format(tmp=self.tmp)
+        push_file(self.tmp, "manifest", "default.xml", xml)
+        work = os.path.join(self.tmp, "work")
+        worktree = qisrc.worktree.create(work)
+        manifest = qisrc.sync.fetch_manifest(worktree, manifest_url)
+        qisrc.sync.init_worktree(worktree, manifest)
+        push_file(self.tmp, "foo", "README", "foo v2\n")
+        push_file(self.tmp, "bar", "README", "bar v2\n")
+        baz = worktree.get_project("baz")
+        qisrc.git.Git(baz.path).set_remote("origin", "/does/not/exist")
+        git_projects = [worktree.get_project(x).git_project
+                        for x in ["bar", "baz", "foo"]]
+        errors = qisrc.sync.sync_projects(git_projects, num_jobs=3)
+        self.assertEqual([x[0] for x in errors], ["baz"])
+        self.assertTrue(errors[0][1].startswith("Fetch failed"))
+        self.assertEqual(read_readme(worktree.get_project("foo").path),
+                         "foo v2\n")
+        self.assertEqual(read_readme(worktree.get_project("bar").path),
+                         "bar v2\n")
+
+    def test_fetch_once(self):
+        manifest_url = create_git_repo(self.tmp, "manifest")
+        create_git_repo(self.tmp, "foo")
+        create_git_repo(self.tmp, "bar")
+        xml = """
+<manifest>
+    <remote name="origin" fetch="{tmp}/srv" />
+    <project name="foo.git" path="foo" />
+    <project name="bar.git" path="bar" />
+</manifest>
+"""
+        xml = xml.format(tmp=self.tmp)
+        push_file(self.tmp, "manifest", "default.xml", xml)
+        work = os.path.join(self.tmp, "work")
+        worktree = qisrc.worktree.create(work)
+        manifest = qisrc.sync.fetch_manifest(worktree, manifest_url)
+        fetch_plan = qisrc.sync.FetchPlan()
+        qisrc.sync.init_worktree(worktree, manifest, fetch_plan=fetch_plan)
+        git_projects = [worktree.get_project(x).git_project
+                        for x in ["bar", "foo"]]
+        errors = qisrc.sync.sync_projects(git_projects, fetch_plan=fetch_plan)
+        self.assertEqual(errors, list())
+        # Both projects were just cloned
+        self.assertEqual(fetch_plan.saved, 2)
+
+    def test_shallow_clones(self):
+        create_git_repo(self.tmp, "foo", with_release_branch=True)
+        create_git_repo(self.tmp, "bar", with_release_branch=True)
+        push_file(self.tmp, "foo", "README", "foo v2\n")
+        # Shallow clones are only possible with file:// urls
+        xml = """
+<manifest>
+    <remote name="origin" fetch="file://{tmp}/srv" depth="1" />
+    <project name="foo.git" path="foo" single_branch="true" />
+    <project name="bar.git" path="bar" depth="0" />
+</manifest>
+"""
+        manifest = StringIO(xml.format(tmp=self.tmp))
+        worktree = qisrc.worktree.create(os.path.join(self.tmp, "work"))
+        qisrc.sync.init_worktree(worktree, manifest)
+        foo_git = qisrc.git.Git(worktree.get_project("foo").path)
+        bar_git = qisrc.git.Git(worktree.get_project("bar").path)
+        self.assertTrue(foo_git.is_shallow())
+        self.assertFalse(bar_git.is_shallow())
+        self.assertEqual(foo_git.get_config("remote.origin.fetch"),
+                         "+refs/heads/master:refs/remotes/origin/master")
+
+        # Track a branch that was not cloned
+        foo_git.set_tracking_branch("release-1.12", "origin")
+        self.assertEqual(foo_git.get_tracking_branch("release-1.12"),
+                         "origin/release-1.12")
+        self.assertTrue(foo_git.is_shallow())
+
+        # Rebase a local commit on top of new remote commits
+        push_file(self.tmp, "foo", "foo.txt", "foo\n")
+        with open(os.path.join(foo_git.repo, "bar.txt"), "w") as fp:
+            fp.write("bar\n")
+        foo_git.add("bar.txt")
+        foo_git.commit("-m", "local commit", quiet=True)
+        foo = worktree.get_project("foo")
+        errors = qisrc.sync.sync_projects([foo])
+        self.assertEqual(errors, list())
+        self.assertTrue(os.path.exists(os.path.join(foo.path, "foo.txt")))
+        self.assertTrue(foo_git.is_shallow())
+
+    def test_override_shallow_clones(self):
+        create_git_repo(self.tmp, "foo", with_release_branch=True)
+        push_file(self.tmp, "foo", "README", "foo v2\n")
+        xml = """
+<manifest>
+    <remote name="origin" fetch="file://{tmp}/srv" depth="1" />
+    <project name="foo.git" path="foo" single_branch="true" />
+</manifest>
+"""
+        manifest = StringIO(xml.format(tmp=self.tmp))
+        worktree = qisrc.worktree.create(os.path.join(self.tmp, "work"))
+        # What the command line says wins, even to turn things off
+        qisrc.sync.init_worktree(worktree, manifest, depth=0,
+                                 single_branch=False)
+        foo_git = qisrc.git.Git(worktree.get_project("foo").path)
+        self.assertFalse(foo_git.is_shallow())
+        self.assertEqual(foo_git.get_config("remote.origin.fetch"),
+                         "+refs/heads/*:refs/remotes/origin/*")
+
+    def test_clone_parser(self):
+        parser = argparse.ArgumentParser()
+        qisrc.parsers.clone_parser(parser)
+        args = parser.parse_args([])
+        self.assertEqual((args.depth, args.single_branch), (None, None))
+        args = parser.parse_args(["--depth", "0", "--no-single-branch"])
+        self.assertEqual((args.depth, args.single_branch), (0, False))
+        args = parser.parse_args(["--single-branch"])
+        self.assertEqual(args.single_branch, True)
+
+
+def test_fetch_plan():
+    git = FakeGit("repo")
+    git.add_result("fetch", 1, "Remote end hung up unexpectedly")
+    git.add_result("fetch", 0, "")
+    fetch_plan = qisrc.sync.FetchPlan()
+    (retcode, _) = fetch_plan.fetch(git, "origin", raises=False)
+    assert retcode == 1
+    # A failed fetch does not count
+    (retcode, _) = fetch_plan.fetch(git, "origin", raises=False)
+    assert retcode == 0
+    (retcode, _) = fetch_plan.fetch(git, "origin", raises=False)
+    assert retcode == 0
+    fetch_plan.mark_fetched("repo", "gerrit")
+    fetch_plan.fetch(git, "gerrit")
+    git.check()
+    assert fetch_plan.saved == 2
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -118,3 +118,30 @@ def test_fetch_fails():
     assert "Fetch failed" in error
     assert "github.com" in error
     git.check()
+
+def test_shallow_deepen():
+    git = FakeGit("shallow")
+    git.set_config("shallow", True)
+    git.add_result("symbolic-ref", 0, "refs/heads/master")
+    git.add_result("fetch", 0, "")
+    # No common ancestor in the fetched history:
+    git.add_result("merge-base", 1, "")
+    git.add_result("fetch", 0, "")
+    git.add_result("merge-base", 0, "base_sha1")
+    git.add_result("status", 0, "")
+    git.add_result("rebase", 0, "")
+    error = git.update_branch("master", "origin")
+    assert not error
+    git.check()
+    assert ("fetch", "--deepen=50", "origin") in [x[0] for x in git.calls]
+
+def test_shallow_deepen_fails():
+    git = FakeGit("shallow")
+    git.set_config("shallow", True)
+    git.add_result("symbolic-ref", 0, "refs/heads/master")
+    git.add_result("fetch", 0, "")
+    git.add_result("merge-base", 1, "")
+    git.add_result("fetch", 128, "the remote end hung up unexpectedly")
+    error = git.update_branch("master", "origin")
+    assert "Fetching more history failed" in error
+    git.check()
@@ -8,6 +8,7 @@
 
 import os
 import tempfile
+import time
 import unittest
 import pytest
 
@@ -50,6 +51,28 @@ class WorktreeTestCase(unittest.TestCase):
         foo = worktree.get_project("foo")
         self.assertEquals(foo.src, "foo")
 
+    def test_get_project(self):
+        xml = """
+<worktree>
+    <project src="lib/libqi" />
+</worktree>
+"""
+        worktree = self.create_worktee(xml)
+        libqi = worktree.get_project("lib/libqi")
+        self.assertEquals(libqi.src, "lib/libqi")
+        # By native path, with or without a trailing slash
+        libqi_path = os.path.join(self.tmp, "lib", "libqi")
+        self.assertTrue(worktree.get_project(libqi_path) is libqi)
+        self.assertTrue(worktree.get_project(libqi_path + os.sep) is libqi)
+        self.assertTrue(worktree.get_project("lib/nope") is None)
+        self.assertRaises(Exception, worktree.get_project, "lib/nope",
+                          raises=True)
+        # The index is updated after a change
+        worktree.add_project("foo")
+        self.assertEquals(worktree.get_project("foo").src, "foo")
+        worktree.remove_project("lib/libqi")
+        self.assertTrue(worktree.get_project(libqi_path) is None)
+
     def test_add_git_project(self):
         xml = "<worktree />"
         worktree = self.create_worktee(xml)
@@ -259,6 +282,114 @@ def test_nested_qiprojects(tmpdir):
     assert c_proj.git_project.src == a_proj.src
 
 
+def test_qiproject_index(tmpdir, monkeypatch):
+    a_project = tmpdir.mkdir("a")
+    worktree_xml = tmpdir.mkdir(".qi").join("worktree.xml")
+    worktree_xml.write("""
+<worktree>
+    <project src="a" />
+</worktree>
+""")
+    a_xml = a_project.join("qiproject.xml")
+    a_xml.write("""
+<project name="a">
+    <depends buildtime="true" names="b" />
+    <project src="b" />
+</project>
+""")
+    a_project.mkdir("b")
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert tmpdir.join(".qi", "qiproject.cache").check(file=True)
+    assert worktree.index.read(a_xml.strpath) == {
+        "name" : "a",
+        "depends" : ["b"],
+        "rdepends" : list(),
+        "subprojects" : ["b"],
+    }
+
+    # Nothing changed: nothing should be parsed
+    parsed = list()
+    real_parse = qisrc.index.parse_qiproject_xml
+    def fake_parse(qiproject_xml):
+        parsed.append(qiproject_xml)
+        return real_parse(qiproject_xml)
+    monkeypatch.setattr(qisrc.index, "parse_qiproject_xml", fake_parse)
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert parsed == list()
+    assert len(worktree.projects) == 2
+
+    # Changing the file invalidates the entry:
+    a_xml.write('<project name="a" />\n')
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert parsed == [a_xml.strpath]
+    assert len(worktree.projects) == 1
+
+    # Even when its size and modification time are the same,
+    # since the file has just been modified:
+    stat = os.stat(a_xml.strpath)
+    with open(a_xml.strpath, "r+") as fp:
+        fp.write('<project name="c" />\n')
+    os.utime(a_xml.strpath, (stat.st_atime, stat.st_mtime))
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert parsed == [a_xml.strpath, a_xml.strpath]
+    assert worktree.index.read(a_xml.strpath)["name"] == "c"
+
+    # Old files are not even read:
+    opened = list()
+    real_checksum = qisrc.index._checksum
+    def fake_checksum(path):
+        opened.append(path)
+        return real_checksum(path)
+    monkeypatch.setattr(qisrc.index, "_checksum", fake_checksum)
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert opened == [a_xml.strpath]
+    old = time.time() - 60
+    os.utime(a_xml.strpath, (old, old))
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert parsed == [a_xml.strpath] * 3
+    del opened[:]
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert opened == list()
+    assert parsed == [a_xml.strpath] * 3
+
+def test_batch(tmpdir, monkeypatch):
+    for name in ["a", "b", "c"]:
+        tmpdir.mkdir(name)
+    tmpdir.join("a").mkdir(".git")
+    worktree = qisrc.worktree.create(tmpdir.strpath)
+    worktree_xml = tmpdir.join(".qi", "worktree.xml")
+    loads = list()
+    real_load = worktree.load
+    def counting_load():
+        loads.append(True)
+        real_load()
+    monkeypatch.setattr(worktree, "load", counting_load)
+    with worktree.batch():
+        worktree.add_project("a")
+        worktree.add_project(tmpdir.join("b").strpath)
+        worktree.set_git_project_config("a", "gerrit", "next")
+        with worktree.batch():
+            worktree.set_project_review("a", True)
+        worktree.add_project("c")
+        worktree.remove_project("c")
+        # Changes are visible, but not written yet
+        a_project = worktree.get_project("a")
+        assert a_project.remote == "gerrit"
+        assert a_project.branch == "next"
+        assert a_project.review
+        assert worktree.git_projects == [a_project]
+        assert worktree.get_project("b").path == tmpdir.join("b").strpath
+        assert worktree.get_project("c") is None
+        assert "project" not in worktree_xml.read()
+        assert loads == list()
+    assert len(loads) == 1
+    worktree = qisrc.worktree.open_worktree(tmpdir.strpath)
+    assert [p.src for p in worktree.projects] == ["a", "b"]
+    a_project = worktree.get_project("a")
+    assert (a_project.remote, a_project.branch) == ("gerrit", "next")
+    assert a_project.review
+
 def test_create_in_git_dir(tmpdir):
     a_git = tmpdir.mkdir("a_git_project")
     a_manifest = tmpdir.join("a_manifest.xml")
@@ -7,12 +7,14 @@
 """
 
 import os
+import contextlib
 import qibuild.log
 import operator
 
 from qibuild import ui
 import qibuild.sh
 import qisrc.git
+import qisrc.index
 import qixml
 from qixml import etree
 
@@ -43,6 +45,17 @@ class WorkTree:
         self.projects = list()
         self.git_projects = list()
         self.buildable_projects = list()
+        # src -> project and native path -> project,
+        # see _update_index()
+        self._projects_by_src = dict()
+        self._projects_by_path = dict()
+        # Parsing results of every qiproject.xml, shared with
+        # qibuild.toc.Toc, so that they are read only once
+        cache_path = os.path.join(self.root, ".qi", "qiproject.cache")
+        self.index = qisrc.index.QiProjectIndex(cache_path)
+        # See batch()
+        self._batch_depth = 0
+        self._batch_dirty = False
         self.load()
 
     def load(self):
@@ -63,10 +76,21 @@ class WorkTree:
             self.xml_tree = qixml.read(worktree_xml)
             self.parse_projects()
             self.parse_buildable_projects()
+            self.index.save()
 
         self.projects.sort(key=operator.attrgetter("src"))
         self.buildable_projects.sort(key=operator.attrgetter("src"))
         self.git_projects.sort(key=operator.attrgetter("src"))
+        self._update_index()
+
+    def _update_index(self):
+        """ Make get_project() find the projects without
+        looking at each of them. Must be called each time
+        self.projects changes
+
+        """
+        self._projects_by_src = dict((p.src, p) for p in self.projects)
+        self._projects_by_path = dict((p.path, p) for p in self.projects)
 
     def get_manifest_projects(self):
         """ Get the projects mark as beeing 'manifest' projects
@@ -74,11 +98,52 @@ class WorkTree:
         """
         return [p for p in self.projects if p.manifest]
 
+    @contextlib.contextmanager
+    def batch(self):
+        """ Apply several changes to the worktree, writing
+        worktree.xml and loading it again only once at the end.
+        To be used in a 'with' statement::
+
+            with worktree.batch():
+                worktree.add_project("foo")
+                worktree.set_git_project_config("foo", "origin", "master")
+
+        In the 'with' block, the projects added are already
+        returned by get_project(), but their subprojects and the
+        buildable_projects list are only updated at the end.
+
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._batch_dirty:
+                self._batch_dirty = False
+                self.dump()
+                self.load()
+
+    def _changed(self):
+        """ Called after each change of the xml tree:
+        write and reload now, or at the end of the batch
+
+        """
+        if self._batch_depth:
+            self._batch_dirty = True
+        else:
+            self.dump()
+            self.load()
+
     def update_project_config(self, src, key, value):
         """ Update the project configuration """
         for elem in self.xml_tree.findall("project"):
             if elem.get("src") == src:
                 elem.set(key, value)
+                if self._batch_depth:
+                    # Keep the project up to date until the next load()
+                    project = self.get_project(src)
+                    if project:
+                        project.parse(elem)
 
     def set_manifest_project(self, src, profile="default"):
         """ Mark a project as being a manifest project
@@ -87,8 +152,7 @@ class WorkTree:
         project = self.get_project(src, raises=True)
         self.update_project_config(project.src, "manifest", "true")
         self.update_project_config(project.src, "profile", profile)
-        self.dump()
-        self.load()
+        self._changed()
 
     def set_git_project_config(self, src, remote, branch):
         """ Set the 'remote' and the 'branch' attributes of a
@@ -98,15 +162,13 @@ class WorkTree:
         project = self.get_project(src, raises=True)
         self.update_project_config(project.src, "remote", remote)
         self.update_project_config(project.src, "branch", branch)
-        self.dump()
-        self.load()
+        self._changed()
 
     def set_project_review(self, src, review):
         """ Mark a project as being under code review """
         project = self.get_project(src, raises=True)
         self.update_project_config(project.src, "review", "true")
-        self.dump()
-        self.load()
+        self._changed()
 
     def dump(self):
         """
@@ -128,7 +190,7 @@ class WorkTree:
             project = Project()
             project.parse(project_elem)
             self.set_path(project)
-            project.parse_qiproject_xml()
+            project.parse_qiproject_xml(self.index)
             self.projects.append(project)
 
         # Now parse the subprojects
@@ -151,7 +213,7 @@ class WorkTree:
             sub_project.src = os.path.join(project.src, sub_project_src)
             sub_project.src = qibuild.sh.to_posix_path(sub_project.src)
             self.set_path(sub_project)
-            sub_project.parse_qiproject_xml()
+            sub_project.parse_qiproject_xml(self.index)
             if project.git_project:
                 sub_project.git_project = project.git_project
             res.append(sub_project)
@@ -190,18 +252,19 @@ class WorkTree:
 
         """
         if os.path.isabs(src):
+            res = self._projects_by_path.get(src)
+            if res:
+                return res
             src = os.path.relpath(src, self.root)
             src = qibuild.sh.to_posix_path(src)
-        p_srcs = [p.src for p in self.projects]
-        if not src in p_srcs:
-            if not raises:
-                return None
-            mess  = "No project in '%s'\n" % src
-            mess += "Know projects are in %s" % ", ".join(p_srcs)
-            raise Exception(mess)
-        match = [p for p in self.projects if p.src == src]
-        res = match[0]
-        return res
+        res = self._projects_by_src.get(src)
+        if res:
+            return res
+        if not raises:
+            return None
+        mess  = "No project in '%s'\n" % src
+        mess += "Know projects are in %s" % ", ".join(p.src for p in self.projects)
+        raise Exception(mess)
 
     def add_project(self, src):
         """ Add a project to a worktree
@@ -214,17 +277,26 @@ class WorkTree:
         if os.path.isabs(src):
             src = os.path.relpath(src, self.root)
             src = qibuild.sh.to_posix_path(src)
-        p_srcs = [p.src for p in self.projects]
-        if src in p_srcs:
+        if src in self._projects_by_src:
             mess  = "Project in %s already in worktree in %s" % (src, self.root)
             raise Exception(mess)
 
         project = Project()
         project.src = src
         root_elem = self.xml_tree.getroot()
-        root_elem.append(project.xml_elem())
-        self.dump()
-        self.load()
+        project_elem = project.xml_elem()
+        root_elem.append(project_elem)
+        if self._batch_depth:
+            project.parse(project_elem)
+            self.set_path(project)
+            project.parse_qiproject_xml(self.index)
+            if os.path.exists(os.path.join(project.path, ".git")):
+                project.git_project = project
+                self.git_projects.append(project)
+            self.projects.append(project)
+            self._projects_by_src[project.src] = project
+            self._projects_by_path[project.path] = project
+        self._changed()
 
     def remove_project(self, src, from_disk=False):
         """ Remove a project from a worktree
@@ -239,8 +311,7 @@ class WorkTree:
         if os.path.isabs(src):
             src = os.path.relpath(src, self.root)
             src = qibuild.sh.to_posix_path(src)
-        p_srcs = [p.src for p in self.projects]
-        if src not in p_srcs:
+        if src not in self._projects_by_src:
             raise Exception("No such project: %s" % src)
         root_elem = self.xml_tree.getroot()
         for project_elem in root_elem.findall("project"):
@@ -249,8 +320,12 @@ class WorkTree:
                     to_remove = self.get_project(src).path
                     qibuild.sh.rm(to_remove)
                 root_elem.remove(project_elem)
-        self.dump()
-        self.load()
+        if self._batch_depth:
+            for project_list in (self.projects, self.git_projects,
+                                 self.buildable_projects):
+                project_list[:] = [x for x in project_list if x.src != src]
+            self._update_index()
+        self._changed()
 
 
 
@@ -384,15 +459,16 @@ class Project:
         self.remote = xml_elem.get("remote", "origin")
         self.branch = xml_elem.get("branch", "master")
 
-    def parse_qiproject_xml(self):
+    def parse_qiproject_xml(self, index=None):
         qiproject_xml = os.path.join(self.path, "qiproject.xml")
-        if not os.path.exists(qiproject_xml):
-            return
-        tree = qixml.read(qiproject_xml)
-        project_elems = tree.findall("project")
-        for project_elem in project_elems:
-            src = qixml.parse_required_attr(project_elem, "src", xml_path=qiproject_xml)
-            self.subprojects.append(src)
+        if index:
+            qiproject = index.read(qiproject_xml)
+        elif os.path.exists(qiproject_xml):
+            qiproject = qisrc.index.parse_qiproject_xml(qiproject_xml)
+        else:
+            qiproject = None
+        if qiproject:
+            self.subprojects.extend(qiproject["subprojects"])
 
     def xml_elem(self):
         res = etree.Element("project")
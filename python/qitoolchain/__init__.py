@@ -12,6 +12,8 @@ import qibuild
 
 from qitoolchain.toolchain import Toolchain, Package
 from qitoolchain.toolchain import get_tc_names, get_tc_config_path
+from qitoolchain import store
+from qitoolchain import cache
 from qitoolchain import remote
 from qitoolchain import feed
 from qitoolchain import version
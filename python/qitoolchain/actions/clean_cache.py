@@ -2,7 +2,13 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
-""" Clean a toolchain cache """
+""" Clean a toolchain cache
+
+With --max-size or --max-age, only remove the archives that
+are not used by any toolchain, the least recently used first,
+from the caches of every toolchain
+
+"""
 
 import os
 import sys
@@ -21,6 +27,14 @@ def configure_parser(parser):
         help="Print what would be done")
     parser.add_argument("-f", action="store_false", dest="dry_run",
         help="Do the cleaning")
+    parser.add_argument("--max-size", dest="max_size",
+        help="Remove the least recently used archives until the caches "
+             "are smaller than this size (for instance 10G)")
+    parser.add_argument("--max-age", dest="max_age", type=float,
+        help="Remove the archives not used for more than this number of days")
+    parser.add_argument("--save", action="store_true",
+        help="Also apply --max-size and --max-age after each toolchain update. "
+             "The settings not given are left as they are. Needs -f")
     parser.set_defaults(dry_run=True)
 
 
@@ -29,6 +43,9 @@ def do(args):
 
     """
     dry_run = args.dry_run
+    if args.max_size is not None or args.max_age is not None:
+        evict(args)
+        return
     tc = qitoolchain.get_toolchain(args.name)
     tc_cache = tc.cache
 
@@ -48,3 +65,28 @@ def do(args):
         sys.stdout.flush()
         qibuild.sh.rm(dir_to_rm)
     ui.info(ui.green, "done")
+
+
+def evict(args):
+    """ Remove the archives not used any more, following
+    --max-size and --max-age
+
+    """
+    max_size = None
+    if args.max_size is not None:
+        max_size = qitoolchain.cache.parse_size(args.max_size)
+    usage = qitoolchain.cache.CacheUsage()
+    removed = usage.evict(max_size=max_size, max_age=args.max_age,
+                          dry_run=args.dry_run)
+    size = qitoolchain.cache.format_size(sum(x.size for x in removed))
+    if args.dry_run:
+        for entry in removed:
+            ui.info(entry.path, "(%s)" %
+                    qitoolchain.cache.format_size(entry.size))
+        print "Would remove %i archives (%s)" % (len(removed), size)
+        print "Use -f to proceed"
+        return
+    if args.save:
+        qitoolchain.cache.set_policy(max_size=args.max_size,
+                                     max_age=args.max_age)
+    ui.info(ui.green, "Removed %i archives (%s)" % (len(removed), size))
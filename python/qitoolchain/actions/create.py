@@ -28,6 +28,10 @@ def configure_parser(parser):
         action="store_true")
     parser.add_argument("--dry-run", action="store_true",
         help="Print what would be done")
+    parser.add_argument("-j", dest="num_jobs", type=int,
+        default=qitoolchain.feed.DOWNLOAD_JOBS,
+        help="Number of packages to download at the same time. "
+             "Default: %(default)s")
 
 def do(args):
     """Main entry point
@@ -70,7 +74,8 @@ def do(args):
     toolchain = qitoolchain.Toolchain(tc_name)
     if feed:
         ui.info(ui.green, "Updating toolchain", tc_name, "with feed:", feed)
-        toolchain.parse_feed(feed, dry_run=dry_run)
+        toolchain.parse_feed(feed, dry_run=dry_run,
+                             num_jobs=args.num_jobs)
 
     if args.default:
         toc.config.set_default_config(tc_name)
@@ -23,6 +23,10 @@ def configure_parser(parser):
         nargs="?")
     parser.add_argument("--dry-run", action="store_true",
         help="Print what would be done")
+    parser.add_argument("-j", dest="num_jobs", type=int,
+        default=qitoolchain.feed.DOWNLOAD_JOBS,
+        help="Number of packages to download at the same time. "
+             "Default: %(default)s")
 
 def do(args):
     """Main entry point
@@ -40,7 +44,8 @@ def do(args):
                 mess += "Pleas check configuration or specifiy a feed on the command line\n"
                 raise Exception(mess)
         ui.info(ui.green, "Updating toolchain", tc_name, "with", feed)
-        toolchain.parse_feed(feed, dry_run=dry_run)
+        toolchain.parse_feed(feed, dry_run=dry_run,
+                             num_jobs=args.num_jobs)
     else:
         tc_names = qitoolchain.get_tc_names()
         i = 0
@@ -54,4 +59,5 @@ def do(args):
                 continue
             ui.info(ui.green, "Reading", tc_feed)
             toolchain = qitoolchain.Toolchain(tc_name)
-            toolchain.parse_feed(tc_feed, dry_run=dry_run)
+            toolchain.parse_feed(tc_feed, dry_run=dry_run,
+                                 num_jobs=args.num_jobs)
@@ -0,0 +1,423 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Accounting and eviction of the archives downloaded by qitoolchain.
+
+Archives are either in the cache of a toolchain, or in the
+store shared by every toolchain (see :py:mod:`qitoolchain.store`).
+Each time :py:func:`qitoolchain.feed.parse_feed` uses an archive,
+the time and the package using it are recorded in ``.usage.cache``,
+at the root of the caches. Several processes may update it at the
+same time: each of them merges its changes with what is on disk while
+holding ``.usage.cache.lock``.
+
+``qitoolchain clean-cache --max-size --max-age`` then removes the
+archives that have not been used for too long, and the least recently
+used ones until the caches are small enough. The same policy is applied
+after every toolchain update if it is set in the toolchains config file::
+
+    [cache]
+    max_size = 10G
+    max_age = 30
+
+An archive still used by a package of a toolchain is never removed.
+
+"""
+
+import os
+import time
+import ConfigParser
+import cPickle as pickle
+
+from qibuild import ui
+import qibuild.sh
+import qitoolchain.store
+import qitoolchain.toolchain
+
+USAGE_NAME = ".usage.cache"
+# Bump this when the format of the usage file changes
+_VERSION = 1
+_UNITS = {"K" : 1024, "M" : 1024 ** 2, "G" : 1024 ** 3, "T" : 1024 ** 4}
+
+
+def parse_size(value):
+    """ Parse a size in bytes, with an optional unit
+
+    >>> parse_size("1.5K")
+    1536
+    >>> parse_size("10G") == 10 * 1024 ** 3
+    True
+
+    :raise: Exception if the size is invalid
+
+    """
+    value = value.strip().upper()
+    if value.endswith("B"):
+        value = value[:-1]
+    factor = 1
+    if value and value[-1] in _UNITS:
+        factor = _UNITS[value[-1]]
+        value = value[:-1]
+    try:
+        res = int(float(value) * factor)
+    except ValueError:
+        res = -1
+    if res < 0:
+        raise Exception("Invalid size: '%s'" % value)
+    return res
+
+
+def format_size(size):
+    """ Format a size in bytes for humans
+
+    >>> format_size(3 * 1024 ** 2)
+    '3.0M'
+
+    """
+    for unit in ["T", "G", "M", "K"]:
+        if size >= _UNITS[unit]:
+            return "%.1f%s" % (float(size) / _UNITS[unit], unit)
+    return "%iB" % size
+
+
+def get_policy():
+    """ Get the eviction policy from the toolchains config file
+
+    :return: a (max_size, max_age) tuple. max_size is in bytes,
+        max_age in days, and both may be None
+
+    """
+    config = ConfigParser.RawConfigParser()
+    config.read(qitoolchain.toolchain.get_tc_config_path())
+    max_size = None
+    max_age = None
+    if config.has_option("cache", "max_size"):
+        max_size = parse_size(config.get("cache", "max_size"))
+    if config.has_option("cache", "max_age"):
+        max_age = float(config.get("cache", "max_age"))
+    return (max_size, max_age)
+
+
+def set_policy(max_size=None, max_age=None):
+    """ Save the eviction policy in the toolchains config file.
+    Settings set to None are left as they are
+
+    """
+    cfg_path = qitoolchain.toolchain.get_tc_config_path()
+    config = ConfigParser.RawConfigParser()
+    config.read(cfg_path)
+    if not config.has_section("cache"):
+        config.add_section("cache")
+    for (key, value) in [("max_size", max_size), ("max_age", max_age)]:
+        if value is not None:
+            config.set("cache", key, value)
+    with open(cfg_path, "w") as fp:
+        config.write(fp)
+
+
+def clear_policy():
+    """ Remove the eviction policy from the toolchains config file """
+    cfg_path = qitoolchain.toolchain.get_tc_config_path()
+    config = ConfigParser.RawConfigParser()
+    config.read(cfg_path)
+    if not config.remove_section("cache"):
+        return
+    with open(cfg_path, "w") as fp:
+        config.write(fp)
+
+
+def _get_tree_size(path):
+    """ Get the size of the files in a directory """
+    res = 0
+    for (root, _dirs, files) in os.walk(path):
+        for name in files:
+            full_path = os.path.join(root, name)
+            if not os.path.islink(full_path):
+                res += os.path.getsize(full_path)
+    return res
+
+
+class CacheEntry:
+    """ An archive of the cache
+
+    :param path: the path of the archive, relative to the root
+        of the caches
+    :param checksum: the checksum of the archive, if it is
+        in the shared store
+
+    """
+    def __init__(self, path, size, last_use, checksum=None):
+        self.path = path
+        self.size = size
+        self.last_use = last_use
+        self.checksum = checksum
+
+    def __repr__(self):
+        return "<CacheEntry %s (%s)>" % (self.path, format_size(self.size))
+
+
+class CacheUsage:
+    """ Record when archives are used, and remove the
+    ones that are not used anymore
+
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = qitoolchain.toolchain.get_cache_root()
+        self.root = qibuild.sh.to_native_path(root)
+        self.usage_path = os.path.join(self.root, USAGE_NAME)
+        # relative path -> (last use, set of (toolchain, package))
+        self._entries = None
+        # The toolchains for which every archive in use was recorded
+        self._toolchains = None
+        # The changes not saved yet, replayed on top of what
+        # other processes saved in the mean time, see save()
+        self._changes = list()
+
+    def _read(self):
+        """ Read the usage file, starting from scratch if
+        it does not exist or can not be read
+
+        :return: a (entries, toolchains) tuple
+
+        """
+        if not os.path.exists(self.usage_path):
+            return (dict(), set())
+        try:
+            with open(self.usage_path, "rb") as fp:
+                (version, entries, toolchains) = pickle.load(fp)
+        except Exception, e:
+            ui.debug("Ignoring", self.usage_path, ":", e)
+            return (dict(), set())
+        if version != _VERSION:
+            return (dict(), set())
+        return (entries, toolchains)
+
+    def _load(self):
+        """ Read the usage file, and apply the changes
+        not saved yet
+
+        """
+        (self._entries, self._toolchains) = self._read()
+        for change in self._changes:
+            self._apply(change)
+
+    def _apply(self, change):
+        """ Apply a change made by record() or by evict()
+        to self._entries and self._toolchains
+
+        """
+        if change[0] == "record":
+            (_, rel_path, when, user) = change
+            # The package does not use the archive it used before anymore
+            for (_last_use, users) in self._entries.itervalues():
+                users.discard(user)
+            (_last_use, users) = self._entries.get(rel_path, (None, set()))
+            users.add(user)
+            self._entries[rel_path] = (when, users)
+            self._toolchains.add(user[0])
+        elif change[0] == "remove":
+            (_, rel_path) = change
+            self._entries.pop(rel_path, None)
+
+    def _change(self, *change):
+        """ Apply a change now, and remember it for save() """
+        if self._entries is None:
+            self._load()
+        self._apply(change)
+        self._changes.append(change)
+
+    def record(self, archive, tc_name, package_name, when=None):
+        """ Record that an archive is used by a package
+        of a toolchain
+
+        """
+        if when is None:
+            when = time.time()
+        rel_path = os.path.relpath(archive, self.root)
+        self._change("record", rel_path, when, (tc_name, package_name))
+
+    def save(self):
+        """ Write the usage file back to disk, if something changed.
+
+        The file is read again and the changes are applied on top
+        of it, so that changes saved by other processes since it was
+        first read are not lost
+
+        """
+        if not self._changes:
+            return
+        to_write = self.usage_path + ".%i.tmp" % os.getpid()
+        try:
+            qibuild.sh.mkdir(self.root, recursive=True)
+            with qibuild.sh.FileLock(self.usage_path + ".lock"):
+                self._load()
+                with open(to_write, "wb") as fp:
+                    pickle.dump((_VERSION, self._entries, self._toolchains),
+                                fp, pickle.HIGHEST_PROTOCOL)
+                if os.path.exists(self.usage_path) and os.name == "nt":
+                    os.remove(self.usage_path)
+                os.rename(to_write, self.usage_path)
+        except (IOError, OSError), e:
+            ui.debug("Could not write", self.usage_path, ":", e)
+            return
+        self._changes = list()
+
+    def get_entries(self):
+        """ Get every archive of the caches, including the
+        interrupted downloads
+
+        :return: a list of :py:class:`CacheEntry`, the least
+            recently used first
+
+        """
+        if self._entries is None:
+            self._load()
+        res = list()
+        if not os.path.isdir(self.root):
+            return res
+        store = qitoolchain.store.PackageStore(
+            os.path.join(self.root, qitoolchain.store.STORE_NAME))
+        for (root, dirs, files) in os.walk(self.root):
+            rel_root = os.path.relpath(root, self.root)
+            depth = 0
+            if rel_root != ".":
+                depth = len(rel_root.split(os.sep))
+            if depth == 0:
+                continue
+            parts = rel_root.split(os.sep)
+            in_store = parts[0] == qitoolchain.store.STORE_NAME
+            if in_store and depth >= 2 and parts[1] != "archives":
+                dirs[:] = list()
+                continue
+            # Archives are in <toolchain>/<xx>/ or
+            # in .store/archives/<algo>/<xx>/
+            if (in_store and depth != 4) or (not in_store and depth != 2):
+                continue
+            for name in files:
+                if name.endswith((".lock", ".validator")):
+                    continue
+                full_path = os.path.join(root, name)
+                rel_path = os.path.join(rel_root, name)
+                stat = os.stat(full_path)
+                size = stat.st_size
+                (last_use, _users) = self._entries.get(rel_path,
+                                                       (stat.st_mtime, None))
+                checksum = None
+                if in_store and not name.endswith(".part"):
+                    algo = parts[2]
+                    digest = os.path.basename(root) + name.split(".")[0]
+                    checksum = "%s:%s" % (algo, digest)
+                    extracted = store.get_package_path(checksum)
+                    if os.path.isdir(extracted):
+                        size += _get_tree_size(extracted)
+                res.append(CacheEntry(rel_path, size, last_use,
+                                      checksum=checksum))
+        res.sort(key=lambda x: x.last_use)
+        return res
+
+    def _get_referenced(self, entries):
+        """ Get the entries used by a package of a toolchain """
+        if self._entries is None:
+            self._load()
+        users = set()
+        checksums = set()
+        tc_names = qitoolchain.toolchain.get_tc_names()
+        for tc_name in tc_names:
+            packages_conf = qitoolchain.toolchain.get_packages_config(tc_name)
+            for (package_name, package_conf) in packages_conf.iteritems():
+                users.add((tc_name, package_name))
+                if package_conf.get("checksum"):
+                    checksums.add(package_conf.get("checksum"))
+        res = list()
+        for entry in entries:
+            if entry.path.endswith(".part"):
+                continue
+            (_last_use, entry_users) = self._entries.get(entry.path,
+                                                         (None, set()))
+            if entry_users & users or entry.checksum in checksums:
+                res.append(entry)
+                continue
+            # Archives of toolchains updated before the usage was
+            # recorded may still be in use: keep them
+            top = entry.path.split(os.sep)[0]
+            if top in tc_names and top not in self._toolchains:
+                res.append(entry)
+        return res
+
+    def evict(self, max_size=None, max_age=None, dry_run=False):
+        """ Remove the archives that are not used by any toolchain
+        and have not been used for more than max_age days, then
+        the least recently used ones until the total size is
+        below max_size bytes
+
+        Extracted packages of the store are removed with their archive.
+        Archives being downloaded by another process are kept.
+
+        :return: the list of the removed :py:class:`CacheEntry`
+
+        """
+        entries = self.get_entries()
+        referenced = set(x.path for x in self._get_referenced(entries))
+        candidates = [x for x in entries if x.path not in referenced]
+        now = time.time()
+        to_remove = list()
+        if max_age is not None:
+            to_remove = [x for x in candidates
+                         if now - x.last_use > max_age * 24 * 3600]
+        if max_size is not None:
+            total = sum(x.size for x in entries)
+            total -= sum(x.size for x in to_remove)
+            for entry in candidates:
+                if total <= max_size:
+                    break
+                if entry in to_remove:
+                    continue
+                to_remove.append(entry)
+                total -= entry.size
+        if dry_run:
+            return to_remove
+        store = qitoolchain.store.PackageStore(
+            os.path.join(self.root, qitoolchain.store.STORE_NAME))
+        removed = list()
+        for entry in to_remove:
+            full_path = os.path.join(self.root, entry.path)
+            # Same lock as qitoolchain.remote.download()
+            if full_path.endswith(".part"):
+                full_path = full_path[:-len(".part")]
+            lock = qibuild.sh.FileLock(full_path + ".lock")
+            if not lock.acquire(blocking=False):
+                ui.debug("Not removing", entry.path, "(in use)")
+                continue
+            try:
+                ui.debug("Removing", entry.path)
+                qibuild.sh.rm(os.path.join(self.root, entry.path))
+                # Along with what identifies the version being
+                # downloaded, see qitoolchain.remote
+                if entry.path.endswith(".part"):
+                    qibuild.sh.rm(os.path.join(self.root,
+                                               entry.path + ".validator"))
+                if entry.checksum:
+                    qibuild.sh.rm(store.get_package_path(entry.checksum))
+            finally:
+                lock.remove()
+            if entry.path in self._entries:
+                self._change("remove", entry.path)
+            removed.append(entry)
+        self.save()
+        return removed
+
+
+def auto_evict():
+    """ Apply the policy of the toolchains config file, if any
+
+    """
+    (max_size, max_age) = get_policy()
+    if max_size is None and max_age is None:
+        return
+    removed = CacheUsage().evict(max_size=max_size, max_age=max_age)
+    if removed:
+        ui.info(ui.green, "Removed", len(removed),
+                "unused archives from the cache",
+                "(%s)" % format_size(sum(x.size for x in removed)))
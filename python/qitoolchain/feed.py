@@ -9,13 +9,27 @@
 import os
 import sys
 import hashlib
+import threading
 import urlparse
+import StringIO
+import cPickle as pickle
 from xml.etree import ElementTree
 
 from qibuild import ui
 import qibuild
+import qibuild.parallel
 import qitoolchain
+import qitoolchain.cache
+import qitoolchain.store
 
+# Number of packages downloaded at the same time
+DOWNLOAD_JOBS = 4
+# In the toolchains cache, see FeedCache
+FEEDS_CACHE_NAME = ".feeds.cache"
+# Bump this when the format of the feeds cache changes
+_FEEDS_CACHE_VERSION = 1
+# In the cache of each toolchain, see is_up_to_date
+UPDATE_STAMP_NAME = "feeds.stamp"
 
 
 def raise_parse_error(package_tree, feed, message):
@@ -30,33 +44,125 @@ def raise_parse_error(package_tree, feed, message):
     raise Exception(mess)
 
 
-def tree_from_feed(feed_location):
+def read_feed(feed_location, feed_cache=None):
+    """ Returns the contents of a feed
+
+    :param feed_cache: a :py:class:`FeedCache`, used to
+        only download remote feeds that changed
+
+    """
+    if os.path.exists(feed_location):
+        with open(feed_location, "r") as fp:
+            return fp.read()
+    if feed_cache:
+        return feed_cache.read(feed_location)
+    fp = qitoolchain.remote.open_remote_location(feed_location)
+    try:
+        return fp.read()
+    finally:
+        fp.close()
+
+
+def tree_from_feed(feed_location, feed_cache=None, contents=None):
     """ Returns an ElementTree object from an
     feed location
 
+    :param contents: the contents of the feed, if already read
+
     """
-    fp = None
     tree = None
     try:
-        if os.path.exists(feed_location):
-            fp = open(feed_location, "r")
-        else:
-            fp = qitoolchain.remote.open_remote_location(feed_location)
+        if contents is None:
+            contents = read_feed(feed_location, feed_cache=feed_cache)
         tree = ElementTree.ElementTree()
-        tree.parse(fp)
+        tree.parse(StringIO.StringIO(contents))
     except Exception:
         ui.error("Could not parser", feed_location)
         raise
-    finally:
-        if fp:
-            fp.close()
     return tree
 
 
-def handle_package(package, package_tree, toolchain):
+class FeedCache:
+    """ Keep the last version of every remote feed, with its
+    ETag and Last-Modified headers, so that a feed is only
+    downloaded again when the server says it changed.
+
+    """
+    def __init__(self, cache_path=None):
+        if cache_path is None:
+            cache_path = os.path.join(qitoolchain.toolchain.get_cache_root(),
+                                      FEEDS_CACHE_NAME)
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        # url -> (contents, etag, last_modified)
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        """ Read the cache from disk, starting from scratch
+        if it does not exist or can not be read
+
+        """
+        self._entries = dict()
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "rb") as fp:
+                (version, entries) = pickle.load(fp)
+        except Exception, e:
+            ui.debug("Ignoring", self.cache_path, ":", e)
+            return
+        if version == _FEEDS_CACHE_VERSION:
+            self._entries = entries
+
+    def read(self, url):
+        """ Get the contents of a remote feed, sending
+        a conditional request if it is in the cache
+
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(url)
+        (contents, etag, last_modified) = (None, None, None)
+        if entry:
+            (contents, etag, last_modified) = entry
+        res = qitoolchain.remote.read_if_modified(url, etag=etag,
+                                                  last_modified=last_modified)
+        if res is None:
+            ui.debug("Not modified:", url)
+            return contents
+        with self._lock:
+            if res != entry:
+                self._entries[url] = res
+                self._dirty = True
+        return res[0]
+
+    def save(self):
+        """ Write the cache back to disk, if something changed """
+        if not self._dirty:
+            return
+        to_write = self.cache_path + ".%i.tmp" % os.getpid()
+        try:
+            qibuild.sh.mkdir(os.path.dirname(self.cache_path), recursive=True)
+            with open(to_write, "wb") as fp:
+                pickle.dump((_FEEDS_CACHE_VERSION, self._entries), fp,
+                            pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(self.cache_path) and os.name == "nt":
+                os.remove(self.cache_path)
+            os.rename(to_write, self.cache_path)
+        except (IOError, OSError), e:
+            ui.debug("Could not write", self.cache_path, ":", e)
+            return
+        self._dirty = False
+
+
+def handle_package(package, package_tree, toolchain, package_path=None):
     """ Handle a package.
 
-    It is has an url, download and extract it.
+    :param package_path: where the package has been extracted,
+        if it has an url. Remote packages are downloaded and
+        extracted by :py:func:`fetch_remote_packages`
 
     Update the package given as first parameter
     """
@@ -67,8 +173,9 @@ def handle_package(package, package_tree, toolchain):
         raise_parse_error(package_tree, feed, "Missing 'name' attribute")
 
     package.name = name
-    if package_tree.get("url"):
-        handle_remote_package(feed, package, package_tree, toolchain)
+    package.checksum = get_package_checksum(package_tree)
+    if package_path:
+        package.path = package_path
     if package_tree.get("directory"):
         handle_local_package(package, package_tree)
     if package_tree.get("toolchain_file"):
@@ -78,38 +185,98 @@ def handle_package(package, package_tree, toolchain):
     if cmake_generator:
         toolchain.cmake_generator = cmake_generator
 
-def handle_remote_package(feed, package, package_tree, toolchain):
-    """ Set package.path of the given package,
-    downloading it and extracting it if necessary.
-
-    """
+def get_package_url(package_tree):
+    """ Get the full url of a remote package """
+    # feed attribue of package_tree is set during parsing
+    feed = package_tree.get("feed")
     package_url = package_tree.get("url")
-    package_name = package_tree.get("name")
-
     if "://"  in feed:
         # package_url may be relative to the feed url:
         package_url = urlparse.urljoin(feed, package_url)
+    return package_url
+
+def get_package_checksum(package_tree):
+    """ Get the checksum of the archive of a package,
+    normalized as ``<algorithm>:<lower case digest>``
+
+    :return: None if the feed does not give any
+
+    """
+    checksum = package_tree.get("checksum")
+    if not checksum:
+        return None
+    try:
+        return "%s:%s" % qitoolchain.store.parse_checksum(checksum)
+    except Exception, e:
+        raise_parse_error(package_tree, package_tree.get("feed"), str(e))
+
+def get_archive_extension(package_url):
+    """ Get the extension of an archive, including
+    the ``.tar`` part of ``.tar.gz`` archives
+
+    >>> get_archive_extension("http://example.com/foo-1.0.tar.gz")
+    '.tar.gz'
+
+    """
+    extension = package_url.rsplit(".", 1)[1]
+    if package_url.endswith(".tar." + extension):
+        return ".tar." + extension
+    return "." + extension
 
+def get_archive_path(toolchain, package_url, checksum=None):
+    """ Get the path where the archive of a remote package
+    is stored: in the store shared by every toolchain if
+    its checksum is known, in the cache of the toolchain
+    otherwise
+
+    """
+    extension = get_archive_extension(package_url)
+    if checksum:
+        store = qitoolchain.store.PackageStore()
+        return store.get_archive_path(checksum, extension)
     # We use a sha1 for the url to be sure to not downlad the
     # same package twice
     # pylint: disable-msg=E1101
     archive_name = hashlib.sha1(package_url).hexdigest()
     top = archive_name[:2]
-    rest = archive_name[2:]
-    extension = package_url.rsplit(".", 1)[1]
-    if package_url.endswith(".tar." + extension):
-        rest += ".tar"
-    rest += "." + extension
-    output = toolchain.cache
-    output = os.path.join(output, top)
-    message = (ui.green, "Downloading", ui.blue, package_url)
-    package_archive = qitoolchain.remote.download(package_url,
-        output,
-        output_name=rest,
+    rest = archive_name[2:] + extension
+    return os.path.join(toolchain.cache, top, rest)
+
+def download_package(toolchain, package_tree, message=True):
+    """ Download the archive of a remote package, unless
+    it is already in the cache of the toolchain
+
+    :return: the path to the archive
+
+    """
+    package_url = get_package_url(package_tree)
+    checksum = get_package_checksum(package_tree)
+    archive_path = get_archive_path(toolchain, package_url, checksum=checksum)
+    if message:
+        message = (ui.green, "Downloading", ui.blue, package_url)
+        callback = qitoolchain.remote.callback
+    else:
+        # Progress bars of several downloads cannot
+        # be displayed at the same time
+        message = None
+        callback = None
+    return qitoolchain.remote.download(package_url,
+        os.path.dirname(archive_path),
+        output_name=os.path.basename(archive_path),
         clobber=False,
-        message=message)
+        callback=callback,
+        message=message,
+        checksum=checksum)
+
+def extract_package(toolchain, package_name, package_archive):
+    """ Extract a package archive in the packages path
+    of the toolchain, unless it is already extracted and
+    up to date
+
+    :return: the path to the extracted package
 
-    ui.info(ui.green, "Adding package", ui.blue, package.name)
+    """
+    ui.info(ui.green, "Adding package", ui.blue, package_name)
     packages_path = qitoolchain.toolchain.get_default_packages_path(toolchain.name)
     should_skip = False
     dest = os.path.join(packages_path, package_name)
@@ -139,7 +306,86 @@ def handle_remote_package(feed, package, package_tree, toolchain):
             mess = str(err)
             mess += "\nPlease fix the archive and try again"
             raise Exception(mess)
-    package.path = dest
+    return dest
+
+def install_remote_package(toolchain, package_tree, package_archive,
+                           previous=None):
+    """ Put the contents of a downloaded archive in the packages
+    path of the toolchain.
+
+    When the checksum of the archive is known, the archive is
+    extracted in the store shared by every toolchain, and
+    linked in the packages path, unless previous (the package
+    as it was in the toolchain before) comes from the same archive.
+
+    :return: the path to the package
+
+    """
+    name = package_tree.get("name")
+    checksum = get_package_checksum(package_tree)
+    if not checksum:
+        return extract_package(toolchain, name, package_archive)
+    packages_path = qitoolchain.toolchain.get_default_packages_path(toolchain.name)
+    dest = os.path.abspath(os.path.join(packages_path, name))
+    if previous and previous.checksum == checksum and os.path.isdir(dest):
+        return dest
+    ui.info(ui.green, "Adding package", ui.blue, name)
+    store = qitoolchain.store.PackageStore()
+    try:
+        store.install(checksum, package_archive, dest)
+    except qibuild.archive.InvalidArchive, err:
+        mess = str(err)
+        mess += "\nPlease fix the archive and try again"
+        raise Exception(mess)
+    return dest
+
+def fetch_remote_packages(toolchain, package_trees, num_jobs=DOWNLOAD_JOBS,
+                          previous=None, usage=None):
+    """ Download the archives of the remote packages, at most
+    num_jobs at the same time, and extract each of them as soon
+    as it is downloaded, while the others are still downloading.
+
+    :param previous: a dict name -> package, with the packages
+        of the toolchain before the feed was parsed
+
+    :param usage: a :py:class:`qitoolchain.cache.CacheUsage` used
+        to record that the archives are used by the toolchain
+
+    :return: a dict package name -> path of the extracted package
+
+    """
+    if previous is None:
+        previous = dict()
+    remote_trees = [x for x in package_trees if x.get("url")]
+    res = dict()
+    if not remote_trees:
+        return res
+    def install(package_tree, package_archive):
+        name = package_tree.get("name")
+        if usage:
+            usage.record(package_archive, toolchain.name, name)
+        res[name] = install_remote_package(toolchain, package_tree,
+                                           package_archive,
+                                           previous=previous.get(name))
+    if num_jobs == 1:
+        for package_tree in remote_trees:
+            package_archive = download_package(toolchain, package_tree)
+            install(package_tree, package_archive)
+        return res
+    # Only the archives that are not there yet are downloaded
+    for package_tree in remote_trees:
+        package_url = get_package_url(package_tree)
+        archive_path = get_archive_path(toolchain, package_url,
+            checksum=get_package_checksum(package_tree))
+        if not os.path.exists(archive_path):
+            ui.info(ui.green, "Downloading", ui.blue, package_url)
+    def download(package_tree):
+        return download_package(toolchain, package_tree, message=False)
+    def on_done(package_tree, package_archive):
+        install(package_tree, package_archive)
+    qibuild.parallel.run_parallel(remote_trees, download,
+                                  num_jobs=num_jobs, on_done=on_done)
+    return res
 
 
 def handle_local_package(package, package_tree):
@@ -169,16 +415,114 @@ def handle_toochain_file(package, package_tree):
         tc_file = qitoolchain.remote.download(toolchain_file, package_path)
         package.toolchain_file = tc_file
 
+def get_update_stamp(toolchain, feeds_digest):
+    """ Get a stamp identifying the feeds a toolchain was
+    updated with, and the resulting packages
+
+    """
+    digest = hashlib.sha1(feeds_digest)
+    for package in sorted(toolchain.packages, key=lambda x: x.name):
+        digest.update("%s\n%s\n" % (package.name, package.path))
+    return digest.hexdigest()
+
+def write_update_stamp(toolchain, feeds_digest):
+    """ Remember the feeds the toolchain was just updated with """
+    stamp_path = os.path.join(toolchain.cache, UPDATE_STAMP_NAME)
+    with open(stamp_path, "w") as fp:
+        fp.write(get_update_stamp(toolchain, feeds_digest))
+
+def is_up_to_date(toolchain, feeds_digest):
+    """ Whether the toolchain was last updated with the same feeds,
+    and its packages were not changed since
+
+    """
+    stamp_path = os.path.join(toolchain.cache, UPDATE_STAMP_NAME)
+    if not os.path.exists(stamp_path):
+        return False
+    with open(stamp_path, "r") as fp:
+        stamp = fp.read().strip()
+    if stamp != get_update_stamp(toolchain, feeds_digest):
+        return False
+    return all(os.path.exists(x.path) for x in toolchain.packages)
+
+
+def record_usage(toolchain, package_trees):
+    """ Record that the archives of the remote packages
+    are still used by the toolchain
+
+    """
+    usage = qitoolchain.cache.CacheUsage()
+    for package_tree in package_trees:
+        if not package_tree.get("url"):
+            continue
+        archive = get_archive_path(toolchain, get_package_url(package_tree),
+                                   checksum=get_package_checksum(package_tree))
+        usage.record(archive, toolchain.name, package_tree.get("name"))
+    usage.save()
+
+
 class ToolchainFeedParser:
     """ A class to handle feed parsing
 
+    :param feed_cache: a :py:class:`FeedCache` to use for
+        remote feeds
+    :param num_jobs: number of feeds to download at the same time
+
     """
-    def __init__(self):
+    def __init__(self, feed_cache=None, num_jobs=1):
         self.packages = list()
         # A dict name -> version used to only keep the latest
         # version
         self.blacklist = list()
         self._versions = dict()
+        self.feed_cache = feed_cache
+        self.num_jobs = num_jobs
+        # feed -> contents, filled by self.fetch()
+        self._contents = dict()
+        # A hash of every parsed feed
+        self._digest = hashlib.sha1()
+
+    def get_digest(self):
+        """ Get a hash of the locations and the contents of
+        every parsed feed
+
+        """
+        return self._digest.hexdigest()
+
+    def fetch(self, feed):
+        """ Read a feed and all the feeds it includes, reading
+        all the feeds of a same level at the same time
+
+        """
+        to_fetch = [feed]
+        while to_fetch:
+            def read(feed_location):
+                return read_feed(feed_location, feed_cache=self.feed_cache)
+            results = qibuild.parallel.run_parallel(to_fetch, read,
+                                                    num_jobs=self.num_jobs)
+            next_fetch = list()
+            for (feed_location, contents) in zip(to_fetch, results):
+                self._contents[feed_location] = contents
+                tree = tree_from_feed(feed_location, contents=contents)
+                for feed_url in self._get_feed_urls(feed_location, tree):
+                    if feed_url in self._contents or feed_url in next_fetch:
+                        continue
+                    next_fetch.append(feed_url)
+            to_fetch = next_fetch
+
+    @staticmethod
+    def _get_feed_urls(feed, tree):
+        """ Get the urls of the feeds included in a feed """
+        res = list()
+        feeds = tree.findall("feed")
+        for feed_tree in feeds:
+            feed_url = feed_tree.get("url")
+            if feed_url:
+                # feed_url can be relative to feed:
+                if not "://" in feed_url:
+                    feed_url = urlparse.urljoin(feed, feed_url)
+                res.append(feed_url)
+        return res
 
     def get_packages(self):
         """ Get the parsed packages """
@@ -213,20 +557,20 @@ class ToolchainFeedParser:
     def parse(self, feed):
         """ Recursively parse the feed, filling the self.packages
 
+        Feeds already read by :py:meth:`fetch` are not read again
+
         """
-        tree = tree_from_feed(feed)
+        contents = self._contents.get(feed)
+        if contents is None:
+            contents = read_feed(feed, feed_cache=self.feed_cache)
+        self._digest.update("%s\n%i\n%s" % (feed, len(contents), contents))
+        tree = tree_from_feed(feed, contents=contents)
         package_trees = tree.findall("package")
         for package_tree in package_trees:
             package_tree.set("feed", feed)
             self.append_package(package_tree)
-        feeds = tree.findall("feed")
-        for feed_tree in feeds:
-            feed_url = feed_tree.get("url")
-            if feed_url:
-                # feed_url can be relative to feed:
-                if not "://" in feed_url:
-                    feed_url = urlparse.urljoin(feed, feed_url)
-                self.parse(feed_url)
+        for feed_url in self._get_feed_urls(feed, tree):
+            self.parse(feed_url)
         select_tree = tree.find("select")
         if select_tree is not None:
             blacklist_trees = select_tree.findall("blacklist")
@@ -236,18 +580,46 @@ class ToolchainFeedParser:
                     self.blacklist.append(name)
 
 
-def parse_feed(toolchain, feed, qibuild_cfg, dry_run=False):
+def parse_feed(toolchain, feed, qibuild_cfg, dry_run=False, num_jobs=None):
     """ Helper for toolchain.parse_feed
 
+    :param num_jobs: number of packages (and feeds) to download at
+        the same time. Default: :py:data:`DOWNLOAD_JOBS`
+
+    Nothing is done if the feeds did not change since the
+    last time the toolchain was updated. Otherwise, the packages
+    of the toolchain are only changed once every package of
+    the feed is ready, see :py:meth:`qitoolchain.Toolchain.update_packages`
+
     """
-    # Reset toolchain.packages:
-    package_names = [package.name for package in toolchain.packages]
-    for package_name in package_names:
-        toolchain.remove_package(package_name)
-    parser = ToolchainFeedParser()
-    parser.parse(feed)
+    if num_jobs is None:
+        num_jobs = DOWNLOAD_JOBS
+    feed_cache = FeedCache()
+    parser = ToolchainFeedParser(feed_cache=feed_cache, num_jobs=num_jobs)
+    try:
+        parser.fetch(feed)
+        parser.parse(feed)
+    finally:
+        feed_cache.save()
     package_trees = parser.get_packages()
+    if not dry_run and is_up_to_date(toolchain, parser.get_digest()):
+        ui.info(ui.green, "Toolchain", ui.blue, toolchain.name,
+                ui.green, "is up to date")
+        record_usage(toolchain, package_trees)
+        return
+    previous = dict((x.name, x) for x in toolchain.packages)
+    new_packages = list()
     errors = list()
+    package_paths = dict()
+    usage = qitoolchain.cache.CacheUsage()
+    if not dry_run:
+        try:
+            package_paths = fetch_remote_packages(toolchain, package_trees,
+                                                  num_jobs=num_jobs,
+                                                  previous=previous,
+                                                  usage=usage)
+        finally:
+            usage.save()
     for package_tree in package_trees:
         package = qitoolchain.Package(None, None)
         if dry_run:
@@ -269,15 +641,23 @@ def parse_feed(toolchain, feed, qibuild_cfg, dry_run=False):
                 print "Would add ", package_name, "from", package_url
             continue
         else:
-            handle_package(package, package_tree, toolchain)
+            package_path = package_paths.get(package_tree.get("name"))
+            handle_package(package, package_tree, toolchain,
+                           package_path=package_path)
         if package.path is None:
             mess  = "could guess package path from this configuration:\n"
             mess += ElementTree.tostring(package_tree)
             mess += "Please make sure you have at least an url or a directory\n"
             ui.warning(mess)
             continue
-        if not dry_run:
-            toolchain.add_package(package)
+        new_packages.append(package)
+
+    if not dry_run:
+        (added, removed, changed) = toolchain.update_packages(new_packages)
+        if added or removed or changed:
+            ui.info(ui.green, "Updated", ui.blue, toolchain.name, ui.reset,
+                    "(%i added, %i removed, %i changed)" %
+                    (len(added), len(removed), len(changed)))
 
     if dry_run and errors:
         print "Errors when parsing %s\n" % feed
@@ -293,3 +673,9 @@ def parse_feed(toolchain, feed, qibuild_cfg, dry_run=False):
         config.cmake.generator = toolchain.cmake_generator
         qibuild_cfg.add_config(config)
         qibuild_cfg.write()
+
+    if not dry_run:
+        write_update_stamp(toolchain, parser.get_digest())
+        # Now that the packages in use are known, the cache
+        # may be cleaned
+        qitoolchain.cache.auto_evict()
@@ -9,13 +9,20 @@ downloading package or reading configs from URLs
 
 import os
 import sys
+import base64
 import ftplib
+import hashlib
+import httplib
+import socket
+import threading
+import urllib
 import urlparse
 import urllib2
 import StringIO
 
 from qibuild import ui
 import qibuild
+import qitoolchain.store
 
 
 def callback(total, done):
@@ -57,10 +64,12 @@ def get_ftp_access(server_name):
         return (access.username, access.password, access.root)
 
 
-def authenticated_urlopen(location):
+def authenticated_urlopen(location, headers=None):
     """ A wrapper around urlopen adding authentication information
     if provided by the user.
 
+    :param headers: a dict of additional headers to send
+
     """
     passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
     #pylint: disable-msg=E1103
@@ -74,6 +83,8 @@ def authenticated_urlopen(location):
     authhandler = urllib2.HTTPBasicAuthHandler(passman)
     opener = urllib2.build_opener(authhandler)
     urllib2.install_opener(opener)
+    if headers:
+        return urllib2.urlopen(urllib2.Request(location, headers=headers))
     return urllib2.urlopen(location)
 
 def open_remote_location(location):
@@ -104,12 +115,419 @@ def open_remote_location(location):
         return authenticated_urlopen(location)
 
 
+def read_if_modified(location, etag=None, last_modified=None):
+    """ Read a file from an url, unless it has not changed since
+    it was last read
+
+    :param etag: the ETag header of the last response
+    :param last_modified: the Last-Modified header of the last response
+
+    :return: None if the server answered 304 Not Modified, a
+        (contents, etag, last_modified) tuple otherwise
+
+    """
+    #pylint: disable-msg=E1103
+    if urlparse.urlsplit(location).scheme == "ftp":
+        fp = open_remote_location(location)
+        return (fp.read(), None, None)
+    headers = dict()
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        fp = authenticated_urlopen(location, headers=headers)
+    except urllib2.HTTPError, e:
+        if e.code == 304:
+            return None
+        raise
+    try:
+        return (fp.read(), fp.info().getheader("etag"),
+                fp.info().getheader("last-modified"))
+    finally:
+        fp.close()
+
+
+class DownloadError(Exception):
+    """ Raised when a download fails in a way that retrying
+    will not fix (404, permission denied ...)
+
+    """
+    pass
+
+
+class ConnectionPool:
+    """ Keep HTTP connections open once a download is over, so that
+    the next download from the same server does not need a new
+    connection (and a new TLS handshake)
+
+    A connection is only used by one thread at a time.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (scheme, netloc) -> list of idle connections
+        self._idle = dict()
+
+    def get(self, scheme, netloc):
+        """ Get an idle connection to the server, or a new one """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, timeout=_TIMEOUT)
+        return httplib.HTTPConnection(netloc, timeout=_TIMEOUT)
+
+    def put(self, scheme, netloc, conn):
+        """ Give back a connection whose last response has been
+        completely read
+
+        """
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), list()).append(conn)
+
+    def close(self):
+        """ Close every idle connection """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = dict()
+
+_POOL = ConnectionPool()
+# Seconds without receiving anything before giving up
+_TIMEOUT = 60
+_MAX_REDIRECTS = 5
+_BUFF_SIZE = 100 * 1024
+
+
+def _get_auth_headers(server_name):
+    """ The Authorization header for the server, if
+    the user has set a username and a password
+
+    """
+    access = get_server_access(server_name)
+    if access is None or access.username is None or access.password is None:
+        return dict()
+    credentials = "%s:%s" % (access.username, access.password)
+    return {"Authorization" : "Basic " + base64.b64encode(credentials)}
+
+
+def _http_get(url, offset, if_range=None):
+    """ Send a GET request using a connection from the pool,
+    following redirects, and asking only for what is after
+    offset if offset is not 0, as long as the file still
+    matches the if_range validator
+
+    :return: a (url, connection, response) tuple
+
+    """
+    for i_ in range(_MAX_REDIRECTS + 1):
+        url_split = urlparse.urlsplit(url)
+        #pylint: disable-msg=E1103
+        (scheme, netloc) = (url_split.scheme, url_split.netloc)
+        path = url_split.path or "/"
+        if url_split.query:
+            path += "?" + url_split.query
+        headers = _get_auth_headers(netloc)
+        if offset:
+            headers["Range"] = "bytes=%i-" % offset
+            headers["If-Range"] = if_range
+        conn = _POOL.get(scheme, netloc)
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+        except:
+            conn.close()
+            raise
+        if response.status not in (301, 302, 303, 307, 308):
+            return (url, conn, response)
+        location = response.getheader("location")
+        response.read()
+        _release(url, conn, response)
+        if not location:
+            raise DownloadError("Redirected from %s to nowhere" % url)
+        url = urlparse.urljoin(url, location)
+    raise DownloadError("Too many redirects")
+
+
+def _release(url, conn, response):
+    """ Put the connection back in the pool if it can be used again """
+    url_split = urlparse.urlsplit(url)
+    if response.will_close:
+        conn.close()
+    else:
+        #pylint: disable-msg=E1103
+        _POOL.put(url_split.scheme, url_split.netloc, conn)
+
+
+def _parse_content_range(value):
+    """ Get the first byte and the total size from a
+    Content-Range header
+
+    >>> _parse_content_range("bytes 100-199/200")
+    (100, 200)
+
+    """
+    try:
+        (unit, rest) = value.split(None, 1)
+        (byte_range, total) = rest.split("/")
+        start = int(byte_range.split("-")[0])
+        if total == "*":
+            return (start, None)
+        return (start, int(total))
+    except ValueError:
+        return (None, None)
+
+
+class ChecksumError(Exception):
+    """ Raised when a downloaded file does not have the
+    expected checksum
+
+    """
+    pass
+
+
+def _new_digest(algo, part_name=None):
+    """ Get a new hash object for the given algorithm,
+    updated with the contents of part_name if given
+
+    :return: None if algo is None
+
+    """
+    if algo is None:
+        return None
+    digest = hashlib.new(algo)
+    if part_name:
+        with open(part_name, "rb") as fp:
+            while True:
+                data = fp.read(_BUFF_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+    return digest
+
+
+def _get_validator_name(part_name):
+    """ The file holding what identifies the version of the
+    file being downloaded to part_name
+
+    """
+    return part_name + ".validator"
+
+
+def _read_validator(part_name):
+    """ Get the validator stored by :py:func:`_write_validator`,
+    or None
+
+    """
+    try:
+        with open(_get_validator_name(part_name), "r") as fp:
+            return fp.read().strip() or None
+    except IOError:
+        return None
+
+
+def _write_validator(part_name, validator):
+    """ Remember which version of the file is being
+    downloaded to part_name, so that the download is only
+    resumed if the file has not changed since
+
+    """
+    validator_name = _get_validator_name(part_name)
+    if validator is None:
+        qibuild.sh.rm(validator_name)
+        return
+    with open(validator_name, "w") as fp:
+        fp.write(validator + "\n")
+
+
+def _remove_part(part_name):
+    """ Remove a partial download """
+    qibuild.sh.rm(part_name)
+    qibuild.sh.rm(_get_validator_name(part_name))
+
+
+def _get_http_validator(response):
+    """ Get the value to send in If-Range to resume the
+    download of the file of the response: the ETag, unless it
+    is a weak one, or the Last-Modified date
+
+    """
+    etag = response.getheader("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.getheader("last-modified")
+
+
+def _download_http(url, part_name, callback, algo=None):
+    """ Download url to part_name, starting from the end of
+    part_name if it already exists and the file has not changed
+    since part_name was started (an If-Range header is sent
+    along with the Range, so the server answers with the whole
+    file if the validator does not match anymore)
+
+    :return: the hash object of the whole file, if algo is given
+
+    """
+    offset = 0
+    if_range = None
+    if os.path.exists(part_name):
+        if_range = _read_validator(part_name)
+        # Without a validator, there is no way to know if
+        # part_name is still a prefix of the file
+        if if_range:
+            offset = os.path.getsize(part_name)
+    (url, conn, response) = _http_get(url, offset, if_range=if_range)
+    try:
+        if response.status == 416:
+            # What we have is not a prefix of the file: start again
+            response.read()
+            _remove_part(part_name)
+            raise IOError("Could not resume download")
+        if response.status == 206:
+            (start, size) = _parse_content_range(
+                response.getheader("content-range", ""))
+            if start != offset:
+                response.read()
+                _remove_part(part_name)
+                raise IOError("Could not resume download")
+            mode = "ab"
+            digest = _new_digest(algo, part_name)
+        elif response.status == 200:
+            # Either a new download, or the file has changed
+            # since part_name was started
+            offset = 0
+            size = response.getheader("content-length")
+            if size is not None:
+                size = int(size)
+            mode = "wb"
+            digest = _new_digest(algo)
+            _write_validator(part_name, _get_http_validator(response))
+        else:
+            raise DownloadError("HTTP Error %i: %s" % (response.status,
+                                                       response.reason))
+        xferd = offset
+        with open(part_name, mode) as dest_file:
+            while True:
+                data = response.read(_BUFF_SIZE)
+                if not data:
+                    break
+                xferd += len(data)
+                if callback and size:
+                    callback(size, xferd)
+                if digest:
+                    digest.update(data)
+                dest_file.write(data)
+        if size is not None and xferd < size:
+            raise httplib.IncompleteRead("%i bytes" % xferd, size - xferd)
+    except:
+        conn.close()
+        raise
+    _release(url, conn, response)
+    return digest
+
+
+def _download_ftp(url, part_name, callback, algo=None):
+    """ Download url to part_name with ftplib, starting from
+    the end of part_name if it already exists.
+
+    We cannot use urllib2 here because it has no support
+    for username/password for ftp
+
+    """
+    url_split = urlparse.urlsplit(url)
+    #pylint: disable-msg=E1103
+    server_name = url_split.netloc
+    (username, password, root) = get_ftp_access(server_name)
+    ftp = ftplib.FTP(server_name, username, password)
+    try:
+        if root:
+            ftp.cwd(root)
+        #pylint: disable-msg=E1103
+        size = ftp.size(url_split.path)
+        # Use the modification time and the size of the file as
+        # a validator, when the server supports MDTM
+        try:
+            validator = "%s %s" % (ftp.sendcmd("MDTM " + url_split.path),
+                                   size)
+        except ftplib.error_perm:
+            validator = None
+        offset = 0
+        if os.path.exists(part_name) and validator and \
+                _read_validator(part_name) == validator:
+            offset = os.path.getsize(part_name)
+        if size is None or offset >= size:
+            offset = 0
+        if not offset:
+            _write_validator(part_name, validator)
+        class Tranfert:
+            pass
+        Tranfert.xferd = offset
+        if offset:
+            digest = _new_digest(algo, part_name)
+        else:
+            digest = _new_digest(algo)
+        with open(part_name, "ab" if offset else "wb") as dest_file:
+            def retr_callback(data):
+                Tranfert.xferd += len(data)
+                if callback:
+                    callback(size, Tranfert.xferd)
+                if digest:
+                    digest.update(data)
+                dest_file.write(data)
+            #pylint: disable-msg=E1103
+            cmd = "RETR " + url_split.path
+            ftp.retrbinary(cmd, retr_callback, rest=offset or None)
+    finally:
+        ftp.close()
+    return digest
+
+
+def _download_other(url, part_name, callback, algo=None):
+    """ Download url to part_name with urllib2 (file:// urls,
+    or when going through a proxy), always from the start
+
+    """
+    url_obj = authenticated_urlopen(url)
+    try:
+        size = url_obj.headers.dict.get('content-length')
+        if size is not None:
+            size = int(size)
+        xferd = 0
+        digest = _new_digest(algo)
+        with open(part_name, "wb") as dest_file:
+            while True:
+                data = url_obj.read(_BUFF_SIZE)
+                if not data:
+                    break
+                xferd += len(data)
+                if callback and size:
+                    callback(size, xferd)
+                if digest:
+                    digest.update(data)
+                dest_file.write(data)
+        if size is not None and xferd < size:
+            raise httplib.IncompleteRead("%i bytes" % xferd, size - xferd)
+    finally:
+        url_obj.close()
+    return digest
+
+
 def download(url, output_dir, output_name=None,
             callback=callback, clobber=True,
-            message=None):
+            message=None, retries=3, checksum=None):
     """ Download a file from an url, and save it
     in output_dir.
 
+    The file is first written to a ``.part`` file, renamed
+    when the download is over. For http, https and ftp urls, an
+    interrupted download resumes where it stopped, either
+    right away (up to ``retries`` times) or the next time
+    this function is called with the same url, unless the file
+    has changed on the server in the meantime.
+
     :param output_name: The name of the file will be the basename of the url,
         unless output_name is given
 
@@ -122,6 +540,15 @@ def download(url, output_dir, output_name=None,
     :param clobber: If False, the file won't be overwritten if it
         already exists (True by default)
 
+    :param checksum: If given, the expected checksum of the file,
+        as in ``sha256:<hexdigest>``. It is computed while the file
+        is downloaded, and the file is removed if it does not match.
+
+    Several processes may download the same file at the same time,
+    for instance to the store shared by every toolchain: the first
+    one downloads it while holding ``<file>.lock``, and the others
+    wait for it to be over. The lock file is removed afterwards.
+
     :return: the path to the downloaded file
 
     """
@@ -132,74 +559,87 @@ def download(url, output_dir, output_name=None,
         dest_name = url.split("/")[-1]
         dest_name = os.path.join(output_dir, dest_name)
 
-    error = None
-
     if os.path.exists(dest_name) and not clobber:
         return dest_name
 
+    lock = qibuild.sh.FileLock(dest_name + ".lock")
+    lock.acquire()
+    try:
+        # Someone else may have downloaded it while we were waiting
+        if os.path.exists(dest_name) and not clobber:
+            return dest_name
+        _download(url, dest_name, callback, message=message,
+                  retries=retries, checksum=checksum)
+    finally:
+        lock.remove()
+    return dest_name
+
+
+def _download(url, dest_name, callback, message=None, retries=3,
+              checksum=None):
+    """ Helper for :py:func:`download`, called with the
+    lock of dest_name held
+
+    """
     if message:
         ui.info(*message)
-    try:
-        dest_file = open(dest_name, "wb")
-    except Exception, e:
-        mess  = "Could not save %s to %s\n" % (url, dest_name)
-        mess += "Error was %s" % e
-        raise Exception(mess)
 
-    url_split = urlparse.urlsplit(url)
-    url_obj = None
+    part_name = dest_name + ".part"
     #pylint: disable-msg=E1103
-    server_name = url_split.netloc
-    try:
-        #pylint: disable-msg=E1103
-        if url_split.scheme == "ftp":
-        # We cannot use urllib2 here because it has no support
-        # for username/password for ftp, so we will use ftplib
-        # here.
-            #pylint: disable-msg=E1103
-
-            (username, password, root) = get_ftp_access(server_name)
-            ftp = ftplib.FTP(server_name, username, password)
-            if root:
-                ftp.cwd(root)
-            class Tranfert:
-                pass
-            #pylint: disable-msg=E1103
-            size = ftp.size(url_split.path)
-            Tranfert.xferd = 0
-            def retr_callback(data):
-                Tranfert.xferd += len(data)
-                if callback:
-                    callback(size, Tranfert.xferd)
-                dest_file.write(data)
-            #pylint: disable-msg=E1103
-            cmd = "RETR " + url_split.path
-            ftp.retrbinary(cmd, retr_callback)
-        else:
-            url_obj = authenticated_urlopen(url)
-            content_length = url_obj.headers.dict['content-length']
-            size = int(content_length)
-            buff_size = 100 * 1024
-            xferd = 0
-            while xferd < size:
-                data = url_obj.read(buff_size)
-                if not data:
-                    break
-                xferd += len(data)
-                if callback:
-                    callback(size, xferd)
-                dest_file.write(data)
-    except Exception, e:
-        error  = "Could not download file from %s\n to %s\n" % (url, dest_name)
-        error += "Error was: %s" % e
-    finally:
-        dest_file.close()
-        if url_obj:
-            url_obj.close()
-    if error:
-        qibuild.sh.rm(dest_name)
-        raise Exception(error)
+    scheme = urlparse.urlsplit(url).scheme
+    resumable = True
+    if scheme == "ftp":
+        fetch = _download_ftp
+    elif scheme in ("http", "https") and not urllib.getproxies().get(scheme):
+        fetch = _download_http
+    else:
+        fetch = _download_other
+        resumable = False
 
-    return dest_name
+    algo = None
+    expected = None
+    if checksum:
+        (algo, expected) = qitoolchain.store.parse_checksum(checksum)
 
+    error = None
+    attempt = 0
+    while True:
+        resumed = os.path.exists(part_name)
+        try:
+            digest = fetch(url, part_name, callback, algo=algo)
+            if digest and digest.hexdigest() != expected:
+                _remove_part(part_name)
+                mess  = "Checksum mismatch: expected %s:%s, got %s:%s" % (
+                    algo, expected, algo, digest.hexdigest())
+                raise ChecksumError(mess)
+            break
+        except ChecksumError, e:
+            # The beginning of the file may come from an older
+            # version of the file: try again from scratch
+            if resumed and attempt < retries:
+                attempt += 1
+                continue
+            error = e
+        except DownloadError, e:
+            error = e
+        except (IOError, EnvironmentError, httplib.HTTPException,
+                ftplib.Error, socket.error), e:
+            attempt += 1
+            if resumable and attempt <= retries:
+                ui.debug("Resuming download of", url, "after:", e)
+                continue
+            error = e
+        except Exception, e:
+            error = e
+        break
+    if error:
+        if not resumable:
+            _remove_part(part_name)
+        mess  = "Could not download file from %s\n to %s\n" % (url, dest_name)
+        mess += "Error was: %s" % error
+        raise Exception(mess)
 
+    if os.path.exists(dest_name) and os.name == "nt":
+        os.remove(dest_name)
+    os.rename(part_name, dest_name)
+    qibuild.sh.rm(_get_validator_name(part_name))
@@ -0,0 +1,165 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" A store of package archives shared by every toolchain,
+keyed by the checksum of the archives.
+
+Feeds may give the checksum of a package archive::
+
+    <package name="boost" url="boost.tar.gz"
+             checksum="sha256:5f2a...." />
+
+Such an archive is downloaded only once, whatever its url and the
+number of toolchains using it, and the checksum is verified
+while it is downloaded.
+It is also extracted only once, in the store, and every file of the
+extracted package is then hard-linked into the packages path of
+each toolchain.
+
+Packages without checksum are still downloaded in the cache of each
+toolchain, see :py:func:`qitoolchain.feed.fetch_remote_packages`
+
+"""
+
+import os
+import hashlib
+import shutil
+
+import qibuild.sh
+import qibuild.archive
+from qibuild import ui
+import qitoolchain.toolchain
+
+STORE_NAME = ".store"
+
+
+def parse_checksum(checksum):
+    """ Split a checksum from a feed into an algorithm
+    and a hexadecimal digest
+
+    >>> parse_checksum("sha1:DA39A3EE5E6B4B0D3255BFEF95601890AFD80709")
+    ('sha1', 'da39a3ee5e6b4b0d3255bfef95601890afd80709')
+
+    :raise: Exception if the checksum is invalid
+
+    """
+    if not ":" in checksum:
+        raise Exception("Invalid checksum: '%s'\n"
+                        "Expecting <algorithm>:<digest>" % checksum)
+    (algo, digest) = checksum.split(":", 1)
+    algo = algo.lower()
+    digest = digest.lower()
+    try:
+        expected_size = hashlib.new(algo).digest_size * 2
+    except ValueError:
+        raise Exception("Invalid checksum: '%s'\n"
+                        "Unknown algorithm: %s" % (checksum, algo))
+    if len(digest) != expected_size or \
+            digest.strip("0123456789abcdef"):
+        raise Exception("Invalid checksum: '%s'\n"
+                        "Not a %s digest" % (checksum, algo))
+    return (algo, digest)
+
+
+def get_store_path():
+    """ Get the default path of the store, next to
+    the caches of the toolchains
+
+    """
+    return os.path.join(qitoolchain.toolchain.get_cache_root(), STORE_NAME)
+
+
+def link_tree(src, dest):
+    """ Re-create the directory src in dest, with hard links
+    to the files of src instead of copies.
+
+    Files are copied when they cannot be linked (not on the
+    same file system, or no hard links on this platform).
+    Symlinks are copied as is.
+
+    """
+    for (root, dirs, files) in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        new_root = os.path.normpath(os.path.join(dest, rel_root))
+        qibuild.sh.mkdir(new_root, recursive=True)
+        for name in dirs + files:
+            fsrc = os.path.join(root, name)
+            fdest = os.path.join(new_root, name)
+            if os.path.islink(fsrc):
+                os.symlink(os.readlink(fsrc), fdest)
+            elif name in files:
+                try:
+                    os.link(fsrc, fdest)
+                except (OSError, AttributeError):
+                    shutil.copy2(fsrc, fdest)
+
+
+class PackageStore:
+    """ A directory containing package archives, and the result
+    of their extraction, keyed by checksum
+
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = get_store_path()
+        self.root = qibuild.sh.to_native_path(root)
+
+    def get_archive_path(self, checksum, extension):
+        """ Where the archive with the given checksum
+        is stored, whether it exists or not
+
+        :param extension: the extension of the archive
+            (for instance ``.tar.gz``)
+
+        """
+        (algo, digest) = parse_checksum(checksum)
+        return os.path.join(self.root, "archives", algo, digest[:2],
+                            digest[2:] + extension)
+
+    def get_package_path(self, checksum):
+        """ Where the archive with the given checksum is
+        extracted, whether it exists or not
+
+        """
+        (algo, digest) = parse_checksum(checksum)
+        return os.path.join(self.root, "packages", "%s-%s" % (algo, digest))
+
+    def extract(self, checksum, archive):
+        """ Extract an archive in the store, unless
+        it already is
+
+        The archive is extracted in a temporary directory first,
+        so that a package is never seen half-extracted.
+
+        :return: the path to the extracted package
+
+        """
+        path = self.get_package_path(checksum)
+        if os.path.isdir(path):
+            return path
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        qibuild.sh.rm(tmp_path)
+        qibuild.sh.mkdir(tmp_path, recursive=True)
+        try:
+            algo = qibuild.archive.guess_algo(archive)
+            extract_path = qibuild.archive.extract(archive, tmp_path,
+                                                   algo=algo, quiet=True)
+            os.rename(extract_path, path)
+        except OSError:
+            # Extracted by someone else in the mean time
+            if not os.path.isdir(path):
+                raise
+        finally:
+            qibuild.sh.rm(tmp_path)
+        return path
+
+    def install(self, checksum, archive, dest):
+        """ Extract an archive in the store if needed, and
+        replace dest with links to the extracted files
+
+        """
+        src = self.extract(checksum, archive)
+        ui.debug("Linking", src, "->", dest)
+        qibuild.sh.rm(dest)
+        link_tree(src, dest)
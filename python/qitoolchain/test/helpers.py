@@ -0,0 +1,106 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Helpers shared by the qitoolchain tests
+
+"""
+
+import os
+import hashlib
+import tempfile
+import unittest
+
+import mock
+
+import qibuild
+import qibuild.archive
+import qitoolchain
+
+
+def get_package(tc, name):
+    """ Get a package of a toolchain by name """
+    return [x for x in tc.packages if x.name == name][0]
+
+
+class ToolchainTestCase(unittest.TestCase):
+    """ Run each test with empty toolchains config, caches and
+    qibuild config, all in self.tmp
+
+    Packages and feeds are written in self.srv
+
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="test-qitoolchain")
+        self.srv = os.path.join(self.tmp, "srv")
+        os.mkdir(self.srv)
+        qitoolchain.toolchain.CONFIG_PATH = os.path.join(self.tmp, "config")
+        qitoolchain.toolchain.CACHE_PATH  = os.path.join(self.tmp, "cache")
+        qitoolchain.toolchain.SHARE_PATH  = os.path.join(self.tmp, "share")
+        self.cfg_patcher = mock.patch('qibuild.config.get_global_cfg_path')
+        qibuild_xml = os.path.join(self.tmp, "qibuild.xml")
+        with open(qibuild_xml, "w") as fp:
+            fp.write("<qibuild />")
+        self.get_cfg_path = self.cfg_patcher.start()
+        self.get_cfg_path.return_value = qibuild_xml
+
+    def tearDown(self):
+        qibuild.sh.rm(self.tmp)
+        self.cfg_patcher.stop()
+
+    def create_package(self, name, files=None, links=None):
+        """ Create <name>.tar.gz in self.srv
+
+        :param files: a dict relative path -> contents. By default,
+            the package only contains <name>.txt
+        :param links: a dict relative path -> target of the
+            symlinks to add
+
+        :return: the checksum of the archive
+
+        """
+        if files is None:
+            files = {name + ".txt" : name + "\n"}
+        package_dir = os.path.join(self.tmp, "packages", name)
+        qibuild.sh.rm(package_dir)
+        qibuild.sh.mkdir(package_dir, recursive=True)
+        for (rel_path, contents) in files.iteritems():
+            full_path = os.path.join(package_dir, rel_path)
+            qibuild.sh.mkdir(os.path.dirname(full_path), recursive=True)
+            with open(full_path, "wb") as fp:
+                fp.write(contents)
+        for (rel_path, target) in (links or dict()).iteritems():
+            os.symlink(target, os.path.join(package_dir, rel_path))
+        archive = qibuild.archive.compress(package_dir, algo="gzip",
+                                           quiet=True)
+        qibuild.sh.install(archive, self.srv, quiet=True)
+        with open(archive, "rb") as fp:
+            return "sha1:" + hashlib.sha1(fp.read()).hexdigest()
+
+    def write_feed(self, name, packages, feeds=None):
+        """ Write a feed in self.srv
+
+        :param packages: a list of package names, to use
+            <name>.tar.gz without checksum, or of
+            (name, url, checksum) tuples
+        :param feeds: a list of urls of feeds to include
+
+        :return: the path to the feed
+
+        """
+        to_write = "<toolchain>\n"
+        for feed in (feeds or list()):
+            to_write += '<feed url="%s" />\n' % feed
+        for package in packages:
+            if isinstance(package, basestring):
+                package = (package, package + ".tar.gz", None)
+            (package_name, url, checksum) = package
+            to_write += '<package name="%s" url="%s"' % (package_name, url)
+            if checksum:
+                to_write += ' checksum="%s"' % checksum
+            to_write += " />\n"
+        to_write += "</toolchain>\n"
+        feed = os.path.join(self.srv, name)
+        with open(feed, "w") as fp:
+            fp.write(to_write)
+        return feed
@@ -0,0 +1,240 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+"""Automatic testing for qitoolchain.cache
+
+"""
+
+import os
+import time
+import unittest
+
+import qibuild
+import qibuild.cmdparse
+import qitoolchain
+import qitoolchain.cache
+import qitoolchain.store
+from qitoolchain.test.helpers import ToolchainTestCase
+
+
+class CacheTestCase(ToolchainTestCase):
+    def create_version(self, name, version, size=1000):
+        """ Create <name>-<version>.tar.gz in self.srv,
+        return its checksum
+
+        """
+        return self.create_package("%s-%s" % (name, version),
+                                   files={name + ".bin" : os.urandom(size)})
+
+    def update(self, tc_name, packages):
+        """ Update a toolchain with a feed, packages is a
+        list of (name, version, checksum)
+
+        """
+        feed = self.write_feed("feed.xml",
+            [(name, "%s-%s.tar.gz" % (name, version), checksum)
+             for (name, version, checksum) in packages])
+        tc = qitoolchain.Toolchain(tc_name)
+        tc.parse_feed("file://" + qibuild.sh.to_posix_path(feed))
+        return tc
+
+    def get_paths(self):
+        usage = qitoolchain.cache.CacheUsage()
+        return [x.path for x in usage.get_entries()]
+
+    def test_parse_size(self):
+        self.assertEquals(qitoolchain.cache.parse_size("100"), 100)
+        self.assertEquals(qitoolchain.cache.parse_size("2m"), 2 * 1024 ** 2)
+        self.assertEquals(qitoolchain.cache.parse_size("1GB"), 1024 ** 3)
+        self.assertRaises(Exception, qitoolchain.cache.parse_size, "big")
+        self.assertRaises(Exception, qitoolchain.cache.parse_size, "-1")
+
+    def test_evict_least_recently_used(self):
+        for version in ["1", "2", "3"]:
+            self.create_version("foo", version)
+        self.create_version("bar", "1")
+        self.update("tc", [("foo", "1", None), ("bar", "1", None)])
+        self.update("tc", [("foo", "2", None), ("bar", "1", None)])
+        self.update("tc", [("foo", "3", None), ("bar", "1", None)])
+        paths = self.get_paths()
+        self.assertEquals(len(paths), 4)
+
+        usage = qitoolchain.cache.CacheUsage()
+        total = sum(x.size for x in usage.get_entries())
+        # Just enough room for everything but foo-1
+        removed = usage.evict(max_size=total - 1)
+        self.assertEquals([x.path for x in removed], paths[:1])
+        # Everything that is not used
+        removed = usage.evict(max_size=0)
+        self.assertEquals([x.path for x in removed], paths[1:2])
+        self.assertEquals(sorted(self.get_paths()), sorted(paths[2:]))
+
+        # The remaining packages can still be used
+        self.update("tc", [("foo", "3", None), ("bar", "1", None)])
+        self.assertEquals(sorted(self.get_paths()), sorted(paths[2:]))
+
+    def test_max_age(self):
+        self.create_version("foo", "1")
+        self.create_version("foo", "2")
+        self.update("tc", [("foo", "1", None)])
+        self.update("tc", [("foo", "2", None)])
+        usage = qitoolchain.cache.CacheUsage()
+        self.assertEquals(usage.evict(max_age=1), list())
+        (old, new) = self.get_paths()
+        # Pretend foo-1 was used by a toolchain that does not exist anymore
+        usage.record(os.path.join(usage.root, old), "old", "foo",
+                     when=time.time() - 2 * 24 * 3600)
+        usage.save()
+        usage = qitoolchain.cache.CacheUsage()
+        removed = usage.evict(max_age=1, dry_run=True)
+        self.assertEquals([x.path for x in removed], [old])
+        self.assertEquals(self.get_paths(), [old, new])
+        usage.evict(max_age=1)
+        self.assertEquals(self.get_paths(), [new])
+
+    def test_shared_by_toolchains(self):
+        self.create_version("foo", "1")
+        self.create_version("foo", "2")
+        self.update("tc1", [("foo", "1", None)])
+        self.update("tc2", [("foo", "1", None)])
+        self.update("tc1", [("foo", "2", None)])
+        usage = qitoolchain.cache.CacheUsage()
+        removed = usage.evict(max_size=0)
+        # foo-1 of tc1 is not used anymore, foo-1 of tc2 is
+        self.assertEquals(len(removed), 1)
+        self.assertTrue(removed[0].path.startswith("tc1"))
+        self.assertEquals(len(self.get_paths()), 2)
+
+    def test_store(self):
+        checksum1 = self.create_version("foo", "1")
+        checksum2 = self.create_version("foo", "2")
+        self.update("tc1", [("foo", "1", checksum1)])
+        self.update("tc2", [("foo", "1", checksum1)])
+        store = qitoolchain.store.PackageStore()
+        extracted1 = store.get_package_path(checksum1)
+        self.assertTrue(os.path.isdir(extracted1))
+        entries = qitoolchain.cache.CacheUsage().get_entries()
+        self.assertEquals([x.checksum for x in entries], [checksum1])
+        # The extracted files count
+        self.assertTrue(entries[0].size > 1000)
+
+        self.update("tc1", [("foo", "2", checksum2)])
+        self.assertEquals(qitoolchain.cache.CacheUsage().evict(max_size=0),
+                          list())
+        tc2 = self.update("tc2", [("foo", "2", checksum2)])
+        removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+        self.assertEquals([x.checksum for x in removed], [checksum1])
+        self.assertFalse(os.path.exists(extracted1))
+        self.assertTrue(os.path.exists(os.path.join(tc2.get("foo"),
+                                                    "foo.bin")))
+
+    def test_unknown_archives(self):
+        self.create_version("foo", "1")
+        tc = self.update("tc", [("foo", "1", None)])
+        # An archive downloaded before the usage was recorded,
+        # and an interrupted download
+        qibuild.sh.rm(os.path.join(tc.cache, "..", ".usage.cache"))
+        legacy = os.path.join(tc.cache, "ab", "cdef.tar.gz")
+        qibuild.sh.mkdir(os.path.dirname(legacy))
+        with open(legacy, "w") as fp:
+            fp.write("legacy\n")
+        part = legacy + ".part"
+        with open(part, "w") as fp:
+            fp.write("part\n")
+        removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+        self.assertEquals([x.path for x in removed],
+                          [os.path.join("tc", "ab", "cdef.tar.gz.part")])
+
+        # Once the toolchain is updated, the archives it
+        # uses are known
+        self.update("tc", [("foo", "1", None)])
+        removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+        self.assertEquals([x.path for x in removed],
+                          [os.path.join("tc", "ab", "cdef.tar.gz")])
+        self.assertEquals(len(self.get_paths()), 1)
+
+    def test_downloads_in_progress(self):
+        self.create_version("foo", "1")
+        tc = self.update("tc", [("foo", "1", None)])
+        archive = os.path.join(tc.cache, "ab", "cdef.tar.gz")
+        qibuild.sh.mkdir(os.path.dirname(archive))
+        with open(archive + ".part", "w") as fp:
+            fp.write("part\n")
+        with open(archive + ".part.validator", "w") as fp:
+            fp.write('"etag"\n')
+        # Being downloaded by someone else
+        with qibuild.sh.FileLock(archive + ".lock"):
+            removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+            self.assertEquals(removed, list())
+        removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+        self.assertEquals([x.path for x in removed],
+                          [os.path.join("tc", "ab", "cdef.tar.gz.part")])
+        self.assertEquals(os.listdir(os.path.dirname(archive)), list())
+
+    def test_removed_toolchain(self):
+        checksum = self.create_version("foo", "1")
+        tc = self.update("tc", [("foo", "1", checksum)])
+        self.update("other", [("foo", "1", checksum)])
+        tc.remove(force_remove=True)
+        removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+        self.assertEquals(removed, list())
+        qitoolchain.Toolchain("other").remove(force_remove=True)
+        removed = qitoolchain.cache.CacheUsage().evict(max_size=0)
+        self.assertEquals([x.checksum for x in removed], [checksum])
+        self.assertEquals(self.get_paths(), list())
+
+    def test_auto_evict(self):
+        self.create_version("foo", "1")
+        self.create_version("foo", "2")
+        qitoolchain.cache.set_policy(max_size="0")
+        self.assertEquals(qitoolchain.cache.get_policy(), (0, None))
+        self.update("tc", [("foo", "1", None)])
+        paths = self.get_paths()
+        self.update("tc", [("foo", "2", None)])
+        new_paths = self.get_paths()
+        self.assertEquals(len(new_paths), 1)
+        self.assertNotEquals(paths, new_paths)
+        qitoolchain.cache.clear_policy()
+        self.assertEquals(qitoolchain.cache.get_policy(), (None, None))
+
+    def test_save_policy(self):
+        qitoolchain.cache.set_policy(max_size="10G")
+        # Settings not given are kept
+        qitoolchain.cache.set_policy(max_age=30)
+        self.assertEquals(qitoolchain.cache.get_policy(), (10 * 1024 ** 3, 30))
+        qitoolchain.cache.set_policy(max_size="1G")
+        self.assertEquals(qitoolchain.cache.get_policy(), (1024 ** 3, 30))
+        qitoolchain.cache.clear_policy()
+        self.assertEquals(qitoolchain.cache.get_policy(), (None, None))
+
+    def test_save_policy_needs_force(self):
+        args = ["--max-size", "10G", "--save"]
+        qibuild.cmdparse.run_action("qitoolchain.actions.clean_cache", args)
+        self.assertEquals(qitoolchain.cache.get_policy(), (None, None))
+        qibuild.cmdparse.run_action("qitoolchain.actions.clean_cache",
+                                    args + ["-f"])
+        self.assertEquals(qitoolchain.cache.get_policy(),
+                          (10 * 1024 ** 3, None))
+
+    def test_concurrent_updates(self):
+        self.create_version("foo", "1")
+        self.create_version("bar", "1")
+        self.update("tc", [("foo", "1", None), ("bar", "1", None)])
+        (bar, foo) = self.get_paths()
+        first = qitoolchain.cache.CacheUsage()
+        second = qitoolchain.cache.CacheUsage()
+        first.get_entries()
+        second.get_entries()
+        first.record(os.path.join(first.root, foo), "first", "foo")
+        second.record(os.path.join(second.root, bar), "second", "bar")
+        first.save()
+        second.save()
+        # Both records were kept
+        usage = qitoolchain.cache.CacheUsage()
+        usage._load()
+        self.assertTrue(("first", "foo") in usage._entries[foo][1])
+        self.assertTrue(("second", "bar") in usage._entries[bar][1])
+
+if __name__ == "__main__":
+    unittest.main()
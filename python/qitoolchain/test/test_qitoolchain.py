@@ -77,6 +77,7 @@ class QiToolchainTestCase(unittest.TestCase):
         foo_package = qitoolchain.Package("foo", "/path/to/foo")
         tc.add_package(foo_package)
         self.assertEquals(tc.packages, [foo_package])
+        self.assertEquals(tc.get("foo"), "/path/to/foo")
 
         # Check that generated toolchain file is correct
         tc_file = get_tc_file_contents(tc)
@@ -110,6 +111,7 @@ class QiToolchainTestCase(unittest.TestCase):
         tc.add_package(foo_package)
 
         tc.remove_package("foo")
+        self.assertRaises(Exception, tc.get, "foo")
 
         tc_file = get_tc_file_contents(tc)
 
@@ -132,6 +134,27 @@ class QiToolchainTestCase(unittest.TestCase):
         tc_file = get_tc_file_contents(tc)
         self.assertFalse("toolchain-geode.cmake" in tc_file)
 
+    def test_update_packages(self):
+        tc = qitoolchain.Toolchain("test")
+        tc.add_package(qitoolchain.Package("a", "/path/to/a"))
+        tc.add_package(qitoolchain.Package("b", "/path/to/b"))
+        ctc = qitoolchain.Package("ctc", "/path/to/ctc", "ctc.cmake")
+        ctc.sysroot = "sysroot"
+        new_a = qitoolchain.Package("a", "/path/to/new/a")
+        res = tc.update_packages([new_a, ctc])
+        self.assertEquals(res, (["ctc"], ["b"], ["a"]))
+        self.assertEquals(tc.get("a"), "/path/to/new/a")
+        self.assertEquals(tc.get_sysroot(), "/path/to/ctc/sysroot")
+        tc_file = get_tc_file_contents(tc)
+        self.assertFalse("/path/to/b" in tc_file)
+        self.assertTrue('include("ctc.cmake")' in tc_file)
+
+        tc = qitoolchain.Toolchain("test")
+        with mock.patch.object(tc, "load_config") as load_config:
+            self.assertEquals(tc.update_packages([new_a, ctc]),
+                              (list(), list(), list()))
+            self.assertFalse(load_config.called)
+
     def test_tc_order(self):
         tc = qitoolchain.Toolchain("test")
         a_path  = "/path/to/a"
@@ -389,6 +412,30 @@ class FeedTestCase(unittest.TestCase):
         self.assertEquals(["boost"], package_names)
         self.assertFalse("python" in get_tc_file_contents(tc2))
 
+    def test_incremental_update(self):
+        self.setup_srv()
+        tc = qitoolchain.Toolchain("test")
+        full = os.path.join(self.srv, "full.xml")
+        minimal = os.path.join(self.srv, "minimal.xml")
+        tc.parse_feed(minimal)
+        boost_path = tc.get("boost")
+        with mock.patch.object(tc, "load_config", wraps=tc.load_config) \
+                as load_config:
+            with mock.patch.object(tc, "remove_package") as remove_package:
+                tc.parse_feed(full)
+                self.assertFalse(remove_package.called)
+            self.assertEquals(load_config.call_count, 1)
+        self.assertEquals(tc.get("boost"), boost_path)
+        package_names = sorted(p.name for p in tc.packages)
+        self.assertEquals(["boost", "python"], package_names)
+        self.assertTrue("python" in get_tc_file_contents(tc))
+
+        tc = qitoolchain.Toolchain("test")
+        tc.parse_feed(minimal)
+        package_names = [p.name for p in tc.packages]
+        self.assertEquals(["boost"], package_names)
+        self.assertFalse("python" in get_tc_file_contents(tc))
+
     def test_relative_url(self):
         os.mkdir(self.srv)
         feeds = os.path.join(self.srv, "feeds")
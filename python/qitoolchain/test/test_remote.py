@@ -0,0 +1,370 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+"""Automatic testing for qitoolchain.remote, using a local
+HTTP server
+
+"""
+
+import os
+import hashlib
+import posixpath
+import threading
+import time
+import unittest
+import urllib
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+
+import mock
+
+import qibuild
+import qitoolchain
+from qitoolchain.test.helpers import ToolchainTestCase
+
+
+class RangeRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """ Serve the files of server.root, with support for
+    keep-alive, for the Range header and for conditional requests
+
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def translate_path(self, path):
+        path = posixpath.normpath(urllib.unquote(path.split("?")[0]))
+        words = [x for x in path.split("/") if x and x not in (".", "..")]
+        return os.path.join(self.server.root, *words)
+
+    def do_GET(self):
+        self.server.requests.append((self.client_address, self.path,
+                                     self.headers.getheader("range")))
+        time.sleep(self.server.delay)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return
+        with open(path, "rb") as fp:
+            data = fp.read()
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        if self.headers.getheader("if-none-match") == etag:
+            self.server.not_modified.append(self.path)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.getheader("range")
+        if_range = self.headers.getheader("if-range")
+        if if_range and if_range != etag:
+            # The file has changed: send all of it
+            range_header = None
+        if range_header:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %i-%i/%i" %
+                             (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        to_send = data[start:]
+        if self.server.truncate:
+            # Simulate a connection lost in the middle of the transfer
+            self.server.truncate -= 1
+            self.wfile.write(to_send[:len(to_send) / 2])
+            self.close_connection = 1
+            return
+        self.wfile.write(to_send)
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           RangeRequestHandler)
+        self.root = root
+        # List of (client_address, path, range header)
+        self.requests = list()
+        # Number of responses to cut in the middle
+        self.truncate = 0
+        # Paths of the requests answered with 304 Not Modified
+        self.not_modified = list()
+        # Seconds to wait before answering
+        self.delay = 0
+        self.url = "http://127.0.0.1:%i" % self.server_address[1]
+
+
+class RemoteTestCase(ToolchainTestCase):
+    def setUp(self):
+        ToolchainTestCase.setUp(self)
+        self.server = HTTPServer(self.srv)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.dest = os.path.join(self.tmp, "dest")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        qitoolchain.remote._POOL.close()
+        ToolchainTestCase.tearDown(self)
+
+    def write_file(self, name, size):
+        data = "".join(chr(i % 256) for i in range(size))
+        with open(os.path.join(self.srv, name), "wb") as fp:
+            fp.write(data)
+        return data
+
+    def read_file(self, name):
+        with open(os.path.join(self.dest, name), "rb") as fp:
+            return fp.read()
+
+    def write_part(self, name, data, etag_of=None):
+        """ Write a partial download of name, started when
+        the file on the server was etag_of
+
+        """
+        qibuild.sh.mkdir(self.dest)
+        part = os.path.join(self.dest, name + ".part")
+        with open(part, "wb") as fp:
+            fp.write(data)
+        if etag_of is not None:
+            with open(part + ".validator", "w") as fp:
+                fp.write('"%s"\n' % hashlib.sha1(etag_of).hexdigest())
+
+    def test_download(self):
+        foo = self.write_file("foo.bin", 1000)
+        bar = self.write_file("bar.bin", 2000)
+        qitoolchain.remote.download(self.server.url + "/foo.bin", self.dest,
+                                    callback=None)
+        qitoolchain.remote.download(self.server.url + "/bar.bin", self.dest,
+                                    callback=None)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        self.assertEquals(self.read_file("bar.bin"), bar)
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "bar.bin.part")))
+        # The connection was used for both downloads
+        clients = set(x[0] for x in self.server.requests)
+        self.assertEquals(len(clients), 1)
+
+    def test_resume_partial_file(self):
+        foo = self.write_file("foo.bin", 1000)
+        self.write_part("foo.bin", foo[:300], etag_of=foo)
+        qitoolchain.remote.download(self.server.url + "/foo.bin", self.dest,
+                                    callback=None)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        self.assertEquals(self.server.requests[-1][2], "bytes=300-")
+        self.assertEquals(os.listdir(self.dest), ["foo.bin"])
+
+    def test_partial_file_without_validator(self):
+        foo = self.write_file("foo.bin", 1000)
+        self.write_part("foo.bin", foo[:300])
+        qitoolchain.remote.download(self.server.url + "/foo.bin", self.dest,
+                                    callback=None)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        self.assertEquals(self.server.requests[-1][2], None)
+
+    def test_file_changed_since_partial_download(self):
+        self.write_file("foo.bin", 1000)
+        self.server.truncate = 10
+        url = self.server.url + "/foo.bin"
+        self.assertRaises(Exception, qitoolchain.remote.download,
+                          url, self.dest, callback=None, retries=1)
+        # Same size, other contents, and no checksum to notice it
+        new_foo = "b" * 1000
+        with open(os.path.join(self.srv, "foo.bin"), "wb") as fp:
+            fp.write(new_foo)
+        self.server.truncate = 0
+        qitoolchain.remote.download(url, self.dest, callback=None)
+        self.assertEquals(self.server.requests[-1][2], "bytes=750-")
+        self.assertEquals(self.read_file("foo.bin"), new_foo)
+
+    def test_resume_after_connection_lost(self):
+        foo = self.write_file("foo.bin", 100 * 1000)
+        self.server.truncate = 2
+        qitoolchain.remote.download(self.server.url + "/foo.bin", self.dest,
+                                    callback=None)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        ranges = [x[2] for x in self.server.requests]
+        self.assertEquals(ranges, [None, "bytes=50000-", "bytes=75000-"])
+
+    def test_partial_file_kept_on_error(self):
+        foo = self.write_file("foo.bin", 1000)
+        self.server.truncate = 10
+        url = self.server.url + "/foo.bin"
+        self.assertRaises(Exception, qitoolchain.remote.download,
+                          url, self.dest, callback=None, retries=1)
+        part = os.path.join(self.dest, "foo.bin.part")
+        self.assertEquals(os.path.getsize(part), 750)
+        self.server.truncate = 0
+        qitoolchain.remote.download(url, self.dest, callback=None)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        self.assertEquals(self.server.requests[-1][2], "bytes=750-")
+
+    def test_range_not_satisfiable(self):
+        foo = self.write_file("foo.bin", 1000)
+        self.write_part("foo.bin", "a" * 2000, etag_of=foo)
+        qitoolchain.remote.download(self.server.url + "/foo.bin", self.dest,
+                                    callback=None)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+
+    def test_not_found(self):
+        url = self.server.url + "/nope.bin"
+        self.assertRaises(Exception, qitoolchain.remote.download,
+                          url, self.dest, callback=None)
+        self.assertEquals(len(self.server.requests), 1)
+        self.assertFalse(os.path.exists(self.dest + "/nope.bin.part"))
+
+    def test_checksum(self):
+        foo = self.write_file("foo.bin", 1000)
+        checksum = "sha1:" + hashlib.sha1(foo).hexdigest()
+        url = self.server.url + "/foo.bin"
+        qitoolchain.remote.download(url, self.dest, callback=None,
+                                    checksum=checksum)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+
+    def test_checksum_mismatch(self):
+        self.write_file("foo.bin", 1000)
+        checksum = "sha1:" + hashlib.sha1("bar").hexdigest()
+        url = self.server.url + "/foo.bin"
+        self.assertRaises(Exception, qitoolchain.remote.download,
+                          url, self.dest, callback=None, checksum=checksum)
+        self.assertEquals(os.listdir(self.dest), list())
+
+    def test_checksum_of_resumed_download(self):
+        foo = self.write_file("foo.bin", 1000)
+        checksum = "sha1:" + hashlib.sha1(foo).hexdigest()
+        self.write_part("foo.bin", foo[:300], etag_of=foo)
+        url = self.server.url + "/foo.bin"
+        qitoolchain.remote.download(url, self.dest, callback=None,
+                                    checksum=checksum)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        self.assertEquals(len(self.server.requests), 1)
+
+    def test_stale_partial_file(self):
+        # The beginning of the file changed since the first download,
+        # but the server did not notice
+        foo = self.write_file("foo.bin", 1000)
+        checksum = "sha1:" + hashlib.sha1(foo).hexdigest()
+        self.write_part("foo.bin", "a" * 300, etag_of=foo)
+        url = self.server.url + "/foo.bin"
+        qitoolchain.remote.download(url, self.dest, callback=None,
+                                    checksum=checksum)
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        ranges = [x[2] for x in self.server.requests]
+        self.assertEquals(ranges, ["bytes=300-", None])
+
+    def test_concurrent_downloads(self):
+        foo = self.write_file("foo.bin", 1000)
+        checksum = "sha1:" + hashlib.sha1(foo).hexdigest()
+        url = self.server.url + "/foo.bin"
+        self.server.delay = 0.5
+        errors = list()
+        def download():
+            try:
+                qitoolchain.remote.download(url, self.dest, callback=None,
+                                            clobber=False, checksum=checksum)
+            except Exception, e:
+                errors.append(e)
+        first = threading.Thread(target=download)
+        first.start()
+        while not self.server.requests:
+            time.sleep(0.01)
+        # The second download waits for the first one,
+        # then finds the file
+        second = threading.Thread(target=download)
+        second.start()
+        first.join()
+        second.join()
+        self.assertEquals(errors, list())
+        self.assertEquals(self.read_file("foo.bin"), foo)
+        self.assertEquals(len(self.server.requests), 1)
+        self.assertEquals(os.listdir(self.dest), ["foo.bin"])
+
+    def test_parallel_feed(self):
+        names = ["a", "b", "c", "d", "e"]
+        for name in names:
+            self.create_package(name)
+        self.write_feed("feed.xml", names)
+
+        tc = qitoolchain.Toolchain("test")
+        tc.parse_feed(self.server.url + "/feed.xml", num_jobs=3)
+        self.assertEquals(sorted(x.name for x in tc.packages), names)
+        for package in tc.packages:
+            with open(os.path.join(package.path, package.name + ".txt")) as fp:
+                self.assertEquals(fp.read(), package.name + "\n")
+        # Connections are re-used between downloads
+        clients = set(x[0] for x in self.server.requests)
+        self.assertTrue(len(clients) <= 4)
+
+    def test_only_new_archives_are_announced(self):
+        for name in ["a", "b", "c"]:
+            self.create_package(name)
+        self.write_feed("feed.xml", ["a", "b"])
+        url = self.server.url + "/feed.xml"
+        tc = qitoolchain.Toolchain("test")
+        tc.parse_feed(url, num_jobs=3)
+        self.write_feed("feed.xml", ["a", "b", "c"])
+        with mock.patch("qibuild.ui.info") as info:
+            tc.parse_feed(url, num_jobs=3)
+        announced = [x[0] for x in info.call_args_list
+                     if "Downloading" in x[0]]
+        self.assertEquals(len(announced), 1)
+        self.assertTrue(announced[0][-1].endswith("/c.tar.gz"))
+
+    def test_feed_cache(self):
+        self.write_feed("feed.xml", ["a"])
+        url = self.server.url + "/feed.xml"
+        feed_cache = qitoolchain.feed.FeedCache()
+        contents = feed_cache.read(url)
+        self.assertTrue('name="a"' in contents)
+        feed_cache.save()
+        feed_cache = qitoolchain.feed.FeedCache()
+        self.assertEquals(feed_cache.read(url), contents)
+        self.assertEquals(self.server.not_modified, ["/feed.xml"])
+        self.write_feed("feed.xml", ["b"])
+        self.assertTrue('name="b"' in feed_cache.read(url))
+
+    def test_update_with_unchanged_feeds(self):
+        for name in ["a", "b", "c"]:
+            self.create_package(name)
+        self.write_feed("feed.xml", ["a"], feeds=["sub1.xml", "sub2.xml"])
+        self.write_feed("sub1.xml", ["b"])
+        self.write_feed("sub2.xml", ["c"])
+        url = self.server.url + "/feed.xml"
+        tc = qitoolchain.Toolchain("test")
+        tc.parse_feed(url)
+        self.assertEquals(sorted(x.name for x in tc.packages), ["a", "b", "c"])
+
+        tc = qitoolchain.Toolchain("test")
+        with mock.patch.object(tc, "remove_package") as remove_package:
+            tc.parse_feed(url)
+            self.assertFalse(remove_package.called)
+        self.assertEquals(sorted(self.server.not_modified),
+                          ["/feed.xml", "/sub1.xml", "/sub2.xml"])
+        self.assertEquals(sorted(x.name for x in tc.packages), ["a", "b", "c"])
+
+        # A sub feed changed
+        self.write_feed("sub2.xml", list())
+        tc.parse_feed(url)
+        self.assertEquals(sorted(x.name for x in tc.packages), ["a", "b"])
+
+        # The feeds did not change, but the packages did
+        tc.remove_package("a")
+        tc.parse_feed(url)
+        self.assertEquals(sorted(x.name for x in tc.packages), ["a", "b"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+## Copyright (c) 2012 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+"""Automatic testing for qitoolchain.store
+
+"""
+
+import os
+import hashlib
+import unittest
+
+import qibuild
+import qitoolchain
+import qitoolchain.store
+from qitoolchain.test.helpers import ToolchainTestCase, get_package
+
+
+class StoreTestCase(ToolchainTestCase):
+    def create_lib_package(self, name, contents):
+        """ Create a package with a library and a symlink to it,
+        return its checksum
+
+        """
+        lib = "lib%s.so" % name
+        return self.create_package(name,
+            files={os.path.join("lib", lib) : contents},
+            links={os.path.join("lib", lib + ".1") : lib})
+
+    def create_feed(self, name, packages):
+        """ packages is a list of (name, url, checksum) """
+        feed = self.write_feed(name, packages)
+        return "file://" + qibuild.sh.to_posix_path(feed)
+
+    def test_parse_checksum(self):
+        self.assertEquals(qitoolchain.store.parse_checksum("SHA1:" + "A" * 40),
+                          ("sha1", "a" * 40))
+        for invalid in ["a" * 40, "nope:" + "a" * 40, "sha1:abc",
+                        "sha1:" + "g" * 40]:
+            self.assertRaises(Exception, qitoolchain.store.parse_checksum,
+                              invalid)
+
+    def test_shared_between_toolchains(self):
+        checksum = self.create_lib_package("foo", "foo\n")
+        srv_foo = os.path.join(self.srv, "foo.tar.gz")
+        qibuild.sh.mkdir(os.path.join(self.srv, "mirror"))
+        os.link(srv_foo, os.path.join(self.srv, "mirror", "foo.tar.gz"))
+        feed1 = self.create_feed("feed1.xml",
+                                 [("foo", "foo.tar.gz", checksum)])
+        feed2 = self.create_feed("feed2.xml",
+                                 [("foo", "mirror/foo.tar.gz", checksum)])
+        tc1 = qitoolchain.Toolchain("tc1")
+        tc1.parse_feed(feed1)
+        tc2 = qitoolchain.Toolchain("tc2")
+        tc2.parse_feed(feed2)
+
+        store = qitoolchain.store.PackageStore()
+        archive = store.get_archive_path(checksum, ".tar.gz")
+        self.assertTrue(os.path.exists(archive))
+        # No archive in the caches of the toolchains
+        for tc in [tc1, tc2]:
+            contents = [os.path.join(tc.cache, x) for x in os.listdir(tc.cache)]
+            self.assertEquals([x for x in contents if os.path.isdir(x)],
+                              list())
+
+        foo1 = get_package(tc1, "foo")
+        foo2 = get_package(tc2, "foo")
+        self.assertEquals(foo1.checksum, checksum)
+        self.assertNotEquals(foo1.path, foo2.path)
+        lib1 = os.path.join(foo1.path, "lib", "libfoo.so")
+        lib2 = os.path.join(foo2.path, "lib", "libfoo.so")
+        self.assertTrue(os.path.samefile(lib1, lib2))
+        self.assertEquals(os.readlink(lib1 + ".1"), "libfoo.so")
+
+        # Removing a toolchain does not touch the store
+        tc1.remove(force_remove=True)
+        with open(lib2) as fp:
+            self.assertEquals(fp.read(), "foo\n")
+
+    def test_update(self):
+        checksum = self.create_lib_package("foo", "foo v1\n")
+        feed = self.create_feed("feed.xml", [("foo", "foo.tar.gz", checksum)])
+        tc = qitoolchain.Toolchain("tc")
+        tc.parse_feed(feed)
+        lib = os.path.join(tc.get("foo"), "lib", "libfoo.so")
+        marker = os.path.join(tc.get("foo"), "marker")
+        with open(marker, "w") as fp:
+            fp.write("")
+
+        # Same checksum: nothing to do
+        tc = qitoolchain.Toolchain("tc")
+        tc.parse_feed(feed)
+        self.assertTrue(os.path.exists(marker))
+
+        # Same url, new checksum: the new archive is downloaded
+        new_checksum = self.create_lib_package("foo", "foo v2\n")
+        feed = self.create_feed("feed.xml", [("foo", "foo.tar.gz", new_checksum)])
+        tc.parse_feed(feed)
+        self.assertEquals(get_package(tc, "foo").checksum, new_checksum)
+        with open(lib) as fp:
+            self.assertEquals(fp.read(), "foo v2\n")
+        self.assertFalse(os.path.exists(marker))
+
+    def test_wrong_checksum(self):
+        self.create_lib_package("foo", "foo\n")
+        feed = self.create_feed("feed.xml",
+            [("foo", "foo.tar.gz", "sha1:" + hashlib.sha1("").hexdigest())])
+        tc = qitoolchain.Toolchain("tc")
+        self.assertRaises(Exception, tc.parse_feed, feed)
+        self.assertEquals(tc.packages, list())
+
+    def test_invalid_checksum(self):
+        self.create_lib_package("foo", "foo\n")
+        feed = self.create_feed("feed.xml", [("foo", "foo.tar.gz", "nope")])
+        tc = qitoolchain.Toolchain("tc")
+        self.assertRaises(Exception, tc.parse_feed, feed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -36,6 +36,42 @@ def get_default_packages_path(tc_name):
     qibuild.sh.mkdir(res, recursive=True)
     return res
 
+def get_cache_root():
+    """ Get the directory containing the caches of every toolchain
+
+    """
+    config = ConfigParser.ConfigParser()
+    config.read(get_tc_config_path())
+    cache_path = qibuild.sh.to_native_path(CACHE_PATH)
+    cache_path = os.path.join(cache_path, "toolchains")
+    if config.has_section("default"):
+        try:
+            root_cfg = config.get("default", "root")
+            cache_path = os.path.join(root_cfg, "cache")
+        except ConfigParser.NoOptionError:
+            pass
+    return cache_path
+
+def get_packages_config_path(tc_name):
+    """ Get the path to the file listing the packages
+    of a toolchain
+
+    """
+    config_path = qibuild.sh.to_native_path(CONFIG_PATH)
+    config_path = os.path.join(config_path, "toolchains")
+    return os.path.join(config_path, tc_name + ".cfg")
+
+def get_packages_config(tc_name):
+    """ Get the configuration of the packages of a toolchain,
+    without loading the toolchain
+
+    :return: a dict package name -> dict of settings
+
+    """
+    configstore = qibuild.configstore.ConfigStore()
+    configstore.read(get_packages_config_path(tc_name))
+    return configstore.get('package', default=dict())
+
 def get_tc_names():
     """ Return the list of all known toolchains
 
@@ -88,14 +124,19 @@ class Package():
     It may also be associated to a toolchain file, relative to its path,
     or a sysroot, also relative to its path
 
+    Packages coming from a feed may also have the checksum
+    of their archive, see :py:mod:`qitoolchain.store`
+
     """
-    def __init__(self, name, path, toolchain_file=None, sysroot=None):
+    def __init__(self, name, path, toolchain_file=None, sysroot=None,
+                 checksum=None):
         self.name = name
         self.path = path
         self.toolchain_file = toolchain_file
         self.sysroot = None
         if sysroot:
             self.sysroot = os.path.join(self.path, sysroot)
+        self.checksum = checksum
 
         # Quick hack for now
         self.depends = list()
@@ -130,6 +171,19 @@ class Package():
     def __lt__(self, other):
         return self.name < other.name
 
+def _get_package_settings(package):
+    """ Get the settings of a package, as written in the
+    configuration of the toolchain by :py:meth:`Toolchain.add_package`
+
+    """
+    res = {"path" : package.path}
+    for key in ["toolchain_file", "sysroot", "checksum"]:
+        value = getattr(package, key)
+        if value:
+            res[key] = value
+    return res
+
+
 class Toolchain:
     """ A toolchain is a set of packages
 
@@ -152,6 +206,8 @@ class Toolchain:
     def __init__(self, name):
         self.name = name
         self.packages = list()
+        # name -> package, updated by self.load_config()
+        self._packages_by_name = dict()
         self.cache = self._get_cache_path()
         self.toolchain_file  = os.path.join(self.cache, "toolchain-%s.cmake" % self.name)
         # Stored in general config file when using self.parse_feed,
@@ -223,27 +279,15 @@ class Toolchain:
         """ Returns path to self configuration file
 
         """
-        config_path = qibuild.sh.to_native_path(CONFIG_PATH)
-        config_path = os.path.join(config_path, "toolchains")
-        qibuild.sh.mkdir(config_path, recursive=True)
-        config_path = os.path.join(config_path, self.name + ".cfg")
+        config_path = get_packages_config_path(self.name)
+        qibuild.sh.mkdir(os.path.dirname(config_path), recursive=True)
         return config_path
 
     def _get_cache_path(self):
         """ Returns path to self cache directory
 
         """
-        config_path = get_tc_config_path()
-        config = ConfigParser.ConfigParser()
-        config.read(config_path)
-        cache_path = qibuild.sh.to_native_path(CACHE_PATH)
-        cache_path = os.path.join(cache_path, "toolchains")
-        if config.has_section("default"):
-            try:
-                root_cfg = config.get("default", "root")
-                cache_path = os.path.join(root_cfg, "cache")
-            except ConfigParser.NoOptionError:
-                pass
+        cache_path = get_cache_root()
         cache_path = os.path.join(cache_path, self.name)
         qibuild.sh.mkdir(cache_path, recursive=True)
         return cache_path
@@ -269,8 +313,10 @@ class Toolchain:
                     raise Exception(mess)
                 package = Package(package_name, package_path,
                                   toolchain_file=package_conf.get('toolchain_file'),
-                                  sysroot=package_conf.get('sysroot'))
+                                  sysroot=package_conf.get('sysroot'),
+                                  checksum=package_conf.get('checksum'))
                 self.packages.append(package)
+        self._packages_by_name = dict((p.name, p) for p in self.packages)
 
         self.update_toolchain_file()
 
@@ -293,6 +339,11 @@ class Toolchain:
             'package "%s"' % package.name,
             "sysroot",
             package.sysroot)
+        if package.checksum:
+            qibuild.configstore.update_config(config_path,
+            'package "%s"' % package.name,
+            "checksum",
+            package.checksum)
         self.load_config()
 
     def remove_package(self, name):
@@ -314,6 +365,46 @@ class Toolchain:
 
         self.load_config()
 
+    def update_packages(self, packages):
+        """ Replace the packages of the toolchain with the given
+        list, writing the configuration and the toolchain file
+        only once, and only if something changed
+
+        :return: a (added, removed, changed) tuple of lists
+            of package names
+
+        """
+        cfg_path = self._get_config_path()
+        config = ConfigParser.RawConfigParser()
+        config.read(cfg_path)
+        current = dict()
+        for section in config.sections():
+            if section.startswith('package "') and section.endswith('"'):
+                current[section[9:-1]] = dict(config.items(section))
+        new = dict((x.name, _get_package_settings(x)) for x in packages)
+        added = [x.name for x in packages if x.name not in current]
+        removed = sorted(x for x in current if x not in new)
+        changed = [x.name for x in packages
+                   if x.name in current and current[x.name] != new[x.name]]
+        if not added and not removed and not changed:
+            return (added, removed, changed)
+
+        for name in removed:
+            config.remove_section('package "%s"' % name)
+        for name in added + changed:
+            section = 'package "%s"' % name
+            if config.has_section(section):
+                config.remove_section(section)
+            config.add_section(section)
+            for key in ["path", "toolchain_file", "sysroot", "checksum"]:
+                if key in new[name]:
+                    config.set(section, key, new[name][key])
+        with open(cfg_path, "w") as fp:
+            config.write(fp)
+
+        self.load_config()
+        return (added, removed, changed)
+
     def update_toolchain_file(self):
         """ Generates a toolchain file for use by qibuild
 
@@ -344,15 +435,19 @@ class Toolchain:
         with open(self.toolchain_file, "w") as fp:
             lines = fp.writelines(lines)
 
-    def parse_feed(self, feed, dry_run=False):
+    def parse_feed(self, feed, dry_run=False, num_jobs=None):
         """ Parse an xml feed,
         adding packages to self while doing so
 
+        :param num_jobs: number of packages to download at the same time.
+            Default: :py:data:`qitoolchain.feed.DOWNLOAD_JOBS`
+
         """
         # Delegate this to qitoolchain.feed module
         qibuild_cfg = qibuild.config.QiBuildConfig()
         qibuild_cfg.read()
-        qitoolchain.feed.parse_feed(self, feed, qibuild_cfg, dry_run=dry_run)
+        qitoolchain.feed.parse_feed(self, feed, qibuild_cfg, dry_run=dry_run,
+                                    num_jobs=num_jobs)
         qibuild_cfg.write()
 
         # Update configuration so we keep which was
@@ -369,14 +464,12 @@ class Toolchain:
         """ Get the path to a package
 
         """
-        package_names = [p.name for p in self.packages]
-        if package_name not in package_names:
+        package = self._packages_by_name.get(package_name)
+        if package is None:
             mess  = "Could not get %s from toolchain %s\n" % (package_name, self.name)
             mess += "No such package"
             raise Exception(mess)
-        package = [p for p in self.packages if p.name == package_name][0]
-        package_path = package.path
-        return package_path
+        return package.path
 
     def get_sysroot(self):
         """ Get the sysroot of the toolchain.